@@ -0,0 +1,184 @@
+"""
+In memory stand-in for the CKAN actions that the scraper uses so that the
+publishing path can be exercised without HDX.
+
+"""
+
+import json
+import re
+from collections import Counter
+from threading import Lock
+from time import sleep
+from uuid import uuid4
+
+from ckanapi.errors import NotFound
+
+from hdx.utilities.saver import save_text
+
+ORGANISATION = "ba5aacba-0633-4364-9528-bc76a3f6cf95"
+STATE_DATASET = "pipeline-state-unosat"
+
+
+class FakeCKAN:
+    """Minimal in memory implementation of the CKAN actions used by the
+    scraper. Each call sleeps for latency seconds to stand in for the network.
+
+    Args:
+        state_path (str): Path to file to use for the state resource
+        state (str): Initial state. Defaults to "2023-01-01".
+        latency (float): Seconds to sleep per call. Defaults to 0.
+    """
+
+    def __init__(self, state_path, state="2023-01-01", latency=0):
+        self.latency = latency
+        self.calls = Counter()
+        self.lock = Lock()
+        self.packages = {}
+        self.showcases = {}
+        self.showcase_packages = {}
+        self.states = {}
+        self.state_resource = self.add_state(STATE_DATASET, state_path, state)
+        self.state_path = state_path
+
+    def add_state(self, name, state_path, state="2023-01-01"):
+        """Add a state dataset
+
+        Args:
+            name (str): Name of state dataset
+            state_path (str): Path to file to use for the state resource
+            state (str): Initial state. Defaults to "2023-01-01".
+
+        Returns:
+            Dict: State resource
+        """
+        save_text(state, state_path)
+        package_id = str(uuid4())
+        resource = {
+            "id": str(uuid4()),
+            "package_id": package_id,
+            "name": "last_build_date.txt",
+            "description": "Pipeline state",
+            "format": "TXT",
+            "url_type": "upload",
+            "resource_type": "file.upload",
+            "url": state_path,
+        }
+        self.packages[name] = {
+            "id": package_id,
+            "name": name,
+            "resources": [resource],
+        }
+        self.states[name] = (resource, state_path)
+        return resource
+
+    def _get_state(self, resource_id):
+        for resource, state_path in self.states.values():
+            if resource["id"] == resource_id:
+                return resource, state_path
+        return self.state_resource, self.state_path
+
+    def _get_package(self, id_or_name):
+        package = self.packages.get(id_or_name)
+        if package is None:
+            for package in self.packages.values():
+                if package["id"] == id_or_name:
+                    return package
+            raise NotFound(f"{id_or_name} not found")
+        return package
+
+    @staticmethod
+    def _add_ids(package):
+        package.setdefault("id", str(uuid4()))
+        for resource in package.get("resources", []):
+            resource.setdefault("id", str(uuid4()))
+            resource["package_id"] = package["id"]
+        return package
+
+    def _search(self, data):
+        fq = data.get("fq", "")
+        if "dataset_type:showcase" in fq:
+            candidates = self.showcases.values()
+        else:
+            candidates = self.packages.values()
+        match = re.search(r"owner_org:(\S+)", fq)
+        if match:
+            candidates = [x for x in candidates if x.get("owner_org") == match[1]]
+        match = re.search(r"name:\(([^)]*)\)", fq)
+        if match:
+            names = set(match[1].split(" OR "))
+            candidates = [x for x in candidates if x["name"] in names]
+        candidates = list(candidates)
+        start = int(data.get("start", 0))
+        rows = int(data.get("rows", 1000))
+        return {
+            "count": len(candidates),
+            "results": [json.loads(json.dumps(x)) for x in candidates][
+                start : start + rows
+            ],
+        }
+
+    def call_remoteckan(self, action, data=None, *args, **kwargs):
+        """Perform CKAN action
+
+        Args:
+            action (str): CKAN action
+            data (Optional[Dict]): CKAN action data. Defaults to None.
+            *args: Ignored
+            **kwargs: Keyword arguments. Only files is used.
+
+        Returns:
+            Union[Dict, List]: Result of action
+        """
+        if data is None:
+            data = {}
+        if self.latency:
+            sleep(self.latency)
+        with self.lock:
+            self.calls[action] += 1
+            result = self._call(action, data, kwargs.get("files") or {})
+            return json.loads(json.dumps(result))
+
+    def _call(self, action, data, files):
+        if action == "user_show":
+            return {"id": "1", "name": "benchmark"}
+        if action == "organization_list_for_user":
+            return [{"id": ORGANISATION, "name": "unosat"}]
+        if action == "package_show":
+            return self._get_package(data["id"])
+        if action == "package_search":
+            return self._search(data)
+        if action == "package_create":
+            package = self._add_ids(dict(data))
+            self.packages[package["name"]] = package
+            return package
+        if action == "package_revise":
+            match = json.loads(data["match"])
+            package = self._get_package(match["id"])
+            update = json.loads(data.get("update", "{}"))
+            package.update(update)
+            self._add_ids(package)
+            return {"package": package}
+        if action in ("resource_show", "resource_update", "resource_patch"):
+            resource, state_path = self._get_state(data.get("id"))
+            upload = files.get("upload")
+            if upload is not None:
+                save_text(upload.read().decode("utf-8"), state_path)
+            return resource
+        if action == "ckanext_showcase_show":
+            showcase = self.showcases.get(data["id"])
+            if showcase is None:
+                raise NotFound(f"{data['id']} not found")
+            return showcase
+        if action in ("ckanext_showcase_create", "ckanext_showcase_update"):
+            showcase = dict(data)
+            showcase.setdefault("id", str(uuid4()))
+            self.showcases[showcase["name"]] = showcase
+            return showcase
+        if action == "ckanext_showcase_package_list":
+            ids = self.showcase_packages.get(data["showcase_id"], [])
+            return [{"id": package_id} for package_id in ids]
+        if action == "ckanext_showcase_package_association_create":
+            ids = self.showcase_packages.setdefault(data["showcase_id"], [])
+            ids.append(data["package_id"])
+            return data
+        return {}
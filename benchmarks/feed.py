@@ -0,0 +1,113 @@
+"""
+Generate synthetic UNOSAT shaped RSS feeds for benchmarking.
+
+"""
+
+import random
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from xml.sax.saxutils import escape
+
+HEADER = (
+    '<?xml version="1.0" encoding="utf-8"?>\n'
+    '<rss version="2.0" xmlns:asgard="http://asgard.jrc.it" '
+    'xmlns:atom="http://www.w3.org/2005/Atom" xmlns:gdacs="http://www.gdacs.org" '
+    'xmlns:geo="http://www.w3.org/2003/01/geo/wgs84_pos#" '
+    'xmlns:georss="http://www.georss.org/georss" xmlns:glide="http://glidenumber.net" '
+    'xmlns:wfw="http://wellformedweb.org/CommentAPI/"><channel>'
+    "<title>Unosat latest maps</title><link>http://unosat.org/product/feed/latest/</link>"
+    "<description>The latest news about unosat products</description>"
+    '<atom:link href="http://unosat.org/product/feed/" rel="self"></atom:link>'
+    "<language>en-us</language><lastBuildDate>{}</lastBuildDate>"
+)
+FOOTER = "</channel></rss>"
+
+CATEGORIES = ["FL", "TC", "EQ", "CE", "DR", "LS", "VO", "WF", "EP", "OT"]
+COUNTRIES = ["PAK", "SSD", "VUT", "IRQ", "AFG", "BGD", "HTI", "MOZ", "SYR", "YEM"]
+WORDS = (
+    "satellite detected water extents flood damage assessment buildings "
+    "structures population exposure analysis imagery preliminary province "
+    "district village area council cumulative compared period affected "
+    "potentially living close observed monitoring further action status"
+).split()
+
+
+def get_description(rng):
+    sentences = []
+    for _ in range(rng.randint(5, 25)):
+        words = rng.choices(WORDS, k=rng.randint(8, 30))
+        sentences.append(f"{' '.join(words).capitalize()}.")
+    return "\n".join(sentences)
+
+
+def get_item(rng, number, published):
+    category = rng.choice(CATEGORIES)
+    countries = rng.sample(COUNTRIES, k=rng.choice((1, 1, 1, 2, 3)))
+    event_code = f"{category}{published:%Y%m%d}{countries[0]}"
+    base = f"https://unosat.org/static/unosat_filesystem/{number}"
+    title = (
+        f"Satellite detected {category} analysis {number} over {', '.join(countries)}"
+    )
+    if rng.random() < 0.5:
+        eventid = str(rng.randint(1000000, 1100000))
+    else:
+        eventid = "None"
+    lat = rng.uniform(-60, 60)
+    lon = rng.uniform(-180, 180)
+    polygon = " ".join(
+        f"{lat + dlat:.6f} {lon + dlon:.6f}"
+        for dlat, dlon in ((0, 0), (-1, 0), (-1, -1), (0, -1), (0, 0))
+    )
+
+    def link(probability, url):
+        return url if rng.random() < probability else ""
+
+    return (
+        f"<item><title>{escape(title)}</title>"
+        f"<link>http://unosat.org/products/{number}</link>"
+        f"<description>{escape(get_description(rng))}</description>"
+        f"<pubDate>{format_datetime(published)}</pubDate>"
+        f"<guid>http://unosat.org/products/{number}</guid>"
+        f'<enclosure length="1" type="image/*" url="{base}/{event_code}.jpg"></enclosure>'
+        f"<eventCode>{event_code}</eventCode><image>{base}/{event_code}.jpg</image>"
+        f"<category>{category}</category>"
+        f"<georss:point>{lat:.6f} {lon:.6f}</georss:point>"
+        f"<georss:polygon>{polygon}</georss:polygon>"
+        f"<gdacs:eventid>{eventid}</gdacs:eventid>"
+        f"<WMAP_Link>{link(0.3, f'https://unosat.maps.arcgis.com/apps/{number}')}</WMAP_Link>"
+        f"<SHP_Link>{link(0.7, f'{base}/{event_code}_SHP.zip')}</SHP_Link>"
+        f"<GDB_Link>{link(0.7, f'{base}/{event_code}.gdb.zip')}</GDB_Link>"
+        f"<WMS_Link></WMS_Link>"
+        f"<KML_Link>{link(0.1, f'{base}/{event_code}.kml')}</KML_Link>"
+        f"<PDF>{link(0.9, f'{base}/{event_code}.pdf')}</PDF>"
+        f"<EXCEL>{link(0.4, f'{base}/{event_code}.xlsx')}</EXCEL>"
+        f"<ISO3>{';'.join(countries)}</ISO3>"
+        "<author>UNOSAT@UNITAR.ORG (UNOSAT)</author></item>"
+    )
+
+
+def generate_feed(path, items, seed=0, newest=None, interval=timedelta(hours=6)):
+    """Write a feed with the given number of items, newest first
+
+    Args:
+        path (str): Path to write feed to
+        items (int): Number of items
+        seed (int): Random seed. Defaults to 0.
+        newest (Optional[datetime]): Date of newest item. Defaults to 2023-01-25.
+        interval (timedelta): Time between items. Defaults to 6 hours.
+
+    Returns:
+        List[datetime]: Publication dates of the items
+    """
+    rng = random.Random(seed)
+    if newest is None:
+        newest = datetime(2023, 1, 25, 16, 5, 21, tzinfo=timezone.utc)
+    dates = []
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(HEADER.format(format_datetime(newest)))
+        for i in range(items):
+            published = newest - i * interval
+            dates.append(published)
+            f.write(get_item(rng, items - i, published))
+        f.write(FOOTER)
+    return dates
@@ -0,0 +1,251 @@
+"""
+Local HTTP stand-in for HDX. Serves the CKAN action API at /api/action/<action>
+from a FakeCKAN and the state resources at /state/<name> so that the scraper can
+be run unchanged with its HDX url pointing at it. Latency, errors and rate limiting can
+be injected to exercise retries and resuming after a failed run.
+
+"""
+
+import json
+import logging
+import random
+from collections import deque
+from email.parser import BytesParser
+from email.policy import default
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from threading import Lock, Thread
+from time import monotonic, sleep
+
+from ckanapi.errors import NotFound
+
+from benchmarks.fake_hdx import FakeCKAN
+
+logger = logging.getLogger(__name__)
+
+WRITE_ACTIONS = (
+    "package_create",
+    "package_revise",
+    "package_update",
+    "resource_update",
+    "resource_patch",
+    "ckanext_showcase_create",
+    "ckanext_showcase_update",
+    "ckanext_showcase_package_association_create",
+)
+
+
+def _parse_multipart(content_type, body):
+    message = BytesParser(policy=default).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode("utf-8") + body
+    )
+    data = {}
+    files = {}
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        payload = part.get_payload(decode=True)
+        if part.get_filename() is None:
+            data[name] = payload.decode("utf-8")
+        else:
+            files[name] = BytesIO(payload)
+    return data, files
+
+
+class HDXServer:
+    """HTTP server in a background thread answering CKAN actions with a
+    FakeCKAN.
+
+    Each request first sleeps for latency seconds. If rate limiting is set,
+    requests beyond calls per period seconds get 429 Too Many Requests with a
+    Retry-After header. A fraction error_rate of write actions get the
+    error_status (by default 503 which the HDX library retries). Once
+    fail_after write actions have succeeded, all write actions fail with a
+    validation error, which is not retried, to simulate HDX going away part
+    way through a run. Set fail_after to None to let writes through again.
+
+    Args:
+        ckan (FakeCKAN): In memory CKAN to serve
+        latency (float): Seconds to sleep per request. Defaults to 0.
+        error_rate (float): Fraction of write actions to fail. Defaults to 0.
+        error_status (int): HTTP status of injected errors. Defaults to 503.
+        rate_limit (Optional[Tuple[int, float]]): (calls, period) allowed. Defaults to None.
+        fail_after (Optional[int]): Number of write actions before all writes fail. Defaults to None.
+        seed (int): Random seed for error injection. Defaults to 0.
+    """
+
+    def __init__(
+        self,
+        ckan,
+        latency=0,
+        error_rate=0,
+        error_status=503,
+        rate_limit=None,
+        fail_after=None,
+        seed=0,
+    ):
+        self.ckan = ckan
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.rate_limit = rate_limit
+        self.fail_after = fail_after
+        self.random = random.Random(seed)
+        self.lock = Lock()
+        self.requests = deque()
+        self.writes = 0
+        self.injected = {"errors": 0, "rate_limited": 0, "failures": 0}
+        self.httpd = None
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _check_rate_limit(self):
+        if not self.rate_limit:
+            return None
+        calls, period = self.rate_limit
+        now = monotonic()
+        with self.lock:
+            while self.requests and now - self.requests[0] >= period:
+                self.requests.popleft()
+            if len(self.requests) >= calls:
+                self.injected["rate_limited"] += 1
+                return period - (now - self.requests[0])
+            self.requests.append(now)
+        return None
+
+    def _inject_error(self, action):
+        """Return the HTTP status and error to inject if any"""
+        if action not in WRITE_ACTIONS:
+            return None
+        with self.lock:
+            if self.fail_after is not None and self.writes >= self.fail_after:
+                self.injected["failures"] += 1
+                return 409, {
+                    "__type": "Validation Error",
+                    "message": "Injected failure",
+                }
+            if self.error_rate and self.random.random() < self.error_rate:
+                self.injected["errors"] += 1
+                return self.error_status, {"message": "Injected error"}
+            self.writes += 1
+        return None
+
+    def handle(self, action, data, files):
+        """Answer a CKAN action
+
+        Args:
+            action (str): CKAN action
+            data (Dict): Action data
+            files (Dict): Files uploaded
+
+        Returns:
+            Tuple[int, Dict, Dict]: (HTTP status, response body, extra headers)
+        """
+        if self.latency:
+            sleep(self.latency)
+        retry_after = self._check_rate_limit()
+        if retry_after is not None:
+            body = {"success": False, "error": {"message": "Rate limit exceeded"}}
+            return 429, body, {"Retry-After": str(max(1, round(retry_after)))}
+        error = self._inject_error(action)
+        if error:
+            status, error = error
+            return status, {"success": False, "error": error}, {}
+        try:
+            result = self.ckan.call_remoteckan(action, data, files=files)
+        except NotFound as ex:
+            error = {"__type": "Not Found Error", "message": str(ex)}
+            return 404, {"success": False, "error": error}, {}
+        return 200, {"success": True, "result": result}, {}
+
+    def start(self):
+        """Start serving on a free local port in a background thread
+
+        Returns:
+            HDXServer: self
+        """
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+            def _send(self, status, content, content_type, headers=None):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(content)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(content)
+
+            def do_GET(self):
+                path = self.path.split("?")[0]
+                if path == "/state":
+                    state_path = server.ckan.state_path
+                elif path.startswith("/state/") and path[7:] in server.ckan.states:
+                    state_path = server.ckan.states[path[7:]][1]
+                else:
+                    self._send(404, b"Not found", "text/plain")
+                    return
+                with open(state_path, "rb") as f:
+                    self._send(200, f.read(), "text/plain")
+
+            def do_POST(self):
+                prefix = "/api/action/"
+                if not self.path.startswith(prefix):
+                    self._send(404, b"Not found", "text/plain")
+                    return
+                action = self.path[len(prefix) :]
+                length = int(self.headers.get("Content-Length", 0))
+                body = self.rfile.read(length)
+                content_type = self.headers.get("Content-Type", "")
+                if content_type.startswith("multipart/form-data"):
+                    data, files = _parse_multipart(content_type, body)
+                else:
+                    data = json.loads(body or b"{}")
+                    files = {}
+                status, response, headers = server.handle(action, data, files)
+                content = json.dumps(response).encode("utf-8")
+                self._send(status, content, "application/json", headers)
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        for name, (resource, _) in self.ckan.states.items():
+            resource["url"] = f"{self.url}/state/{name}"
+        self.thread = Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving
+
+        Returns:
+            None
+        """
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+def create_server(state_path, state="2023-01-01", **kwargs):
+    """Create server for a new FakeCKAN
+
+    Args:
+        state_path (str): Path to file to use for the state resource
+        state (str): Initial state. Defaults to "2023-01-01".
+        **kwargs: Arguments to pass to HDXServer
+
+    Returns:
+        HDXServer: Server (not yet started)
+    """
+    return HDXServer(FakeCKAN(state_path, state), **kwargs)
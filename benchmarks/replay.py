@@ -0,0 +1,141 @@
+"""
+Run the scraper's main end to end against the local HDX stand-in server using a
+saved or synthetic feed. If a run fails, HDX is made healthy again and main is
+run again so that resuming from the progress file can be checked. The result
+reports each run and what ended up in the stand-in.
+
+    python -m benchmarks.replay --items 500 --latency 0.05 --rate-limit 100 60
+    python -m benchmarks.replay --feed tests/fixtures/feed --state 2020-02-09 --fail-after 2
+
+"""
+
+import argparse
+import json
+import logging
+from collections import Counter
+from os import chdir, getcwd, makedirs
+from os.path import exists, join
+from shutil import copyfile
+from time import perf_counter
+
+from benchmarks.feed import generate_feed
+from benchmarks.hdx_server import create_server
+from benchmarks.run import create_configuration
+
+from hdx.scraper.unosat.__main__ import lookup, main
+from hdx.utilities.loader import load_json, load_text
+from hdx.utilities.path import get_temp_dir, temp_dir
+
+logger = logging.getLogger(__name__)
+
+
+def replay(folder, feed, state, runs=3, publishing=None, **kwargs):
+    """Run main against a stand-in HDX server until it succeeds or runs is
+    reached. The feed is put where main(use_saved=True) will look for it in
+    folder which becomes the working directory while main runs.
+
+    Args:
+        folder (str): Folder to run in
+        feed (str): Path to feed to replay
+        state (str): State to start from
+        runs (int): Maximum number of runs. Defaults to 3.
+        publishing (Optional[Dict]): Overrides of publishing configuration. Defaults to None.
+        **kwargs: Arguments to pass to HDXServer
+
+    Returns:
+        Dict: Results of runs
+    """
+    saved_folder = join(folder, "saved_data")
+    makedirs(saved_folder, exist_ok=True)
+    copyfile(feed, join(saved_folder, "feed"))
+    server = create_server(join(folder, "state.txt"), state, **kwargs)
+    results = {"runs": []}
+    # Remove progress left behind by an earlier run that failed
+    get_temp_dir(lookup, delete_if_exists=True)
+    cwd = getcwd()
+    with server:
+        chdir(folder)
+        try:
+            for _ in range(runs):
+                # A fresh configuration so wrappers of call_remoteckan from a
+                # previous run are not stacked
+                configuration = create_configuration(hdx_url=server.url)
+                configuration["publishing"].update(publishing or {})
+                start = perf_counter()
+                run = {}
+                try:
+                    main(use_saved=True)
+                    run["success"] = True
+                except Exception as ex:
+                    logger.exception("Run failed")
+                    run["success"] = False
+                    run["error"] = repr(ex)
+                run["seconds"] = round(perf_counter() - start, 4)
+                metrics_path = configuration["metrics"]["json"]
+                if exists(metrics_path):
+                    run["metrics"] = load_json(metrics_path)
+                results["runs"].append(run)
+                if run["success"]:
+                    break
+                # HDX is back for the next run
+                server.fail_after = None
+        finally:
+            chdir(cwd)
+    ckan = server.ckan
+    associations = Counter()
+    for showcase_id, package_ids in ckan.showcase_packages.items():
+        for package_id in package_ids:
+            associations[(showcase_id, package_id)] += 1
+    results["hdx_calls"] = dict(ckan.calls)
+    results["datasets"] = len(ckan.packages) - 1
+    results["showcases"] = len(ckan.showcases)
+    results["duplicate_associations"] = sum(
+        1 for number in associations.values() if number > 1
+    )
+    results["injected"] = server.injected
+    results["state"] = load_text(ckan.state_path)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay feed against stand-in HDX")
+    parser.add_argument("--feed", help="Saved feed. Defaults to a synthetic feed")
+    parser.add_argument("--items", type=int, default=200)
+    parser.add_argument("--state", default="2023-01-01")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--latency", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument(
+        "--rate-limit", type=float, nargs=2, metavar=("CALLS", "PERIOD")
+    )
+    parser.add_argument("--fail-after", type=int)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    publishing = {"hdx_calls": 1000000, "period": 1}
+    if args.workers:
+        publishing["workers"] = args.workers
+    with temp_dir("unosat_replay", delete_if_exists=True) as folder:
+        feed = args.feed
+        if not feed:
+            feed = join(folder, "feed.xml")
+            generate_feed(feed, args.items)
+        results = replay(
+            folder,
+            feed,
+            args.state,
+            args.runs,
+            publishing,
+            latency=args.latency,
+            error_rate=args.error_rate,
+            error_status=args.error_status,
+            rate_limit=args.rate_limit,
+            fail_after=args.fail_after,
+        )
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
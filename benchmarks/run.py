@@ -0,0 +1,195 @@
+"""
+Benchmark the UNOSAT pipeline against synthetic feeds.
+
+Times and measures peak memory of Pipeline.parse_feed, Pipeline.generate_dataset
+and the end to end main loop publishing to an in memory stand-in for HDX.
+
+    python -m benchmarks.run --items 1000 10000 100000 --output bench.json
+
+"""
+
+import argparse
+import json
+import logging
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from os import chdir, getcwd, makedirs
+from os.path import join
+from time import perf_counter
+
+from benchmarks.fake_hdx import FakeCKAN
+from benchmarks.feed import COUNTRIES, generate_feed
+
+from hdx.api.configuration import Configuration
+from hdx.api.locations import Locations
+from hdx.data.resource import Resource
+from hdx.data.vocabulary import Vocabulary
+from hdx.scraper.unosat.__main__ import lookup, main
+from hdx.scraper.unosat.pipeline import Pipeline
+from hdx.utilities.downloader import Download
+from hdx.utilities.loader import load_json
+from hdx.utilities.path import get_temp_dir, script_dir_plus_file, temp_dir
+from hdx.utilities.retriever import Retrieve
+from hdx.utilities.useragent import UserAgent
+
+OLDEST = datetime(1900, 1, 1, tzinfo=timezone.utc)
+
+
+def create_configuration(**kwargs):
+    UserAgent.set_global("benchmark")
+    Configuration._create(
+        hdx_read_only=False,
+        hdx_key="benchmark",
+        hdx_site="prod",
+        user_agent="benchmark",
+        project_config_yaml=script_dir_plus_file(
+            join("config", "project_configuration.yaml"), main
+        ),
+        **kwargs,
+    )
+    Locations.set_validlocations(
+        [{"name": iso3.lower(), "title": iso3} for iso3 in COUNTRIES]
+    )
+    formats = ("geodatabase", "shp", "kml", "xlsx", "txt", "csv", "json")
+    Resource.set_formatsdict({file_format: file_format for file_format in formats})
+    configuration = Configuration.read()
+    # Reference data is set here rather than read from the on disk cache and
+    # links in replayed feeds are not probed
+    del configuration["reference_data"]
+    del configuration["probe_links"]
+    tags = [tag for tag in configuration["tag_mapping"].values() if tag]
+    Vocabulary._tags_dict = {tag: {"Action to Take": "ok"} for tag in tags}
+    Vocabulary._approved_vocabulary = {
+        "tags": [{"name": "geodata"}] + [{"name": tag} for tag in tags],
+        "id": "4e61d464-4943-4e97-973a-84673c1aaa87",
+        "name": "approved",
+    }
+    return configuration
+
+
+@contextmanager
+def measure(results, name, memory):
+    result = {}
+    if memory:
+        tracemalloc.start()
+    start = perf_counter()
+    try:
+        yield result
+    finally:
+        result["seconds"] = round(perf_counter() - start, 4)
+        if memory:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            result["peak_mb"] = round(peak / 1048576, 2)
+        results[name] = result
+
+
+def benchmark_parse(results, configuration, folder, dates, memory):
+    with Download() as downloader:
+        retriever = Retrieve(downloader, folder, folder, folder, False, True)
+        for stream in (True, False):
+            configuration["stream_feed"] = stream
+            mode = "stream" if stream else "full"
+            pipeline = Pipeline(configuration, retriever)
+            with measure(results, f"parse_feed_{mode}_all_new", memory) as result:
+                _, entries = pipeline.iterate_feed(OLDEST)
+                result["entries"] = sum(1 for _ in entries)
+            previous_build_date = dates[min(10, len(dates) - 1)]
+            with measure(results, f"parse_feed_{mode}_10_new", memory) as result:
+                _, entries = pipeline.iterate_feed(previous_build_date)
+                result["entries"] = sum(1 for _ in entries)
+        configuration["stream_feed"] = True
+
+
+def benchmark_generate(results, configuration, folder, limit, memory):
+    with Download() as downloader:
+        retriever = Retrieve(downloader, folder, folder, folder, False, True)
+        pipeline = Pipeline(configuration, retriever)
+        _, entries = pipeline.iterate_feed(OLDEST)
+        with measure(results, "generate_dataset", memory) as result:
+            count = 0
+            generated = 0
+            for entry in entries:
+                if count == limit:
+                    break
+                count += 1
+                dataset, _ = pipeline.generate_dataset(entry)
+                if dataset:
+                    generated += 1
+            result["entries"] = count
+            result["datasets"] = generated
+        result["ms_per_entry"] = round(result["seconds"] * 1000 / max(count, 1), 3)
+
+
+def benchmark_main(results, folder, dates, limit, latency, memory):
+    configuration = create_configuration()
+    configuration["publishing"]["hdx_calls"] = 1000000
+    configuration["publishing"]["period"] = 1
+    previous_build_date = dates[min(limit, len(dates) - 1)]
+    fake = FakeCKAN(join(folder, "state.txt"), previous_build_date.isoformat(), latency)
+    configuration.call_remoteckan = fake.call_remoteckan
+    # Remove progress left behind by an earlier run that failed
+    get_temp_dir(lookup, delete_if_exists=True)
+    cwd = getcwd()
+    chdir(folder)
+    try:
+        with measure(results, "main", memory) as result:
+            main(use_saved=True)
+    finally:
+        chdir(cwd)
+    result["hdx_calls"] = dict(fake.calls)
+    result["datasets"] = len(fake.packages) - 1
+    report = load_json(join(folder, configuration["metrics"]["json"]))
+    result["stages"] = {
+        stage: metrics["seconds"] for stage, metrics in report["stages"].items()
+    }
+    result["rate_limit_wait_seconds"] = report["values"]["rate_limit_wait_seconds"]
+
+
+def run(sizes, generate_limit, main_limit, latency, memory):
+    create_configuration()
+    all_results = {}
+    with temp_dir("unosat_benchmarks", delete_if_exists=True) as folder:
+        for size in sizes:
+            logging.warning(f"Benchmarking {size} items")
+            results = {}
+            saved_folder = join(folder, str(size), "saved_data")
+            makedirs(saved_folder)
+            feed_path = join(saved_folder, "feed")
+            with measure(results, "generate_feed", False):
+                dates = generate_feed(feed_path, size)
+            configuration = create_configuration()
+            benchmark_parse(results, configuration, saved_folder, dates, memory)
+            benchmark_generate(
+                results, configuration, saved_folder, generate_limit, memory
+            )
+            benchmark_main(
+                results, join(folder, str(size)), dates, main_limit, latency, memory
+            )
+            all_results[size] = results
+    return all_results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark UNOSAT pipeline")
+    parser.add_argument("--items", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--generate-limit", type=int, default=1000)
+    parser.add_argument("--main-limit", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0)
+    parser.add_argument("--no-memory", action="store_true")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    results = run(
+        args.items,
+        args.generate_limit,
+        args.main_limit,
+        args.latency,
+        not args.no_memory,
+    )
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
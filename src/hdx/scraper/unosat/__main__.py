@@ -2,25 +2,25 @@
 """
 Top level script. Calls other functions that generate datasets that this script then creates in HDX.
 
+The HDX libraries are only imported once the quick check has found that the
+feed may have changed so that runs with nothing to do finish quickly.
+
 """
 
 import logging
-from os.path import expanduser, join
+import sys
+from inspect import signature
+from os.path import abspath, dirname, expanduser, join
+from typing import Optional
 
-from hdx.api.configuration import Configuration
-from hdx.api.utilities.hdx_state import HDXState
-from hdx.data.user import User
-from hdx.facades.infer_arguments import facade
 from hdx.scraper.unosat._version import __version__
-from hdx.scraper.unosat.pipeline import Pipeline
-from hdx.utilities.dateparse import iso_string_from_datetime, parse_date
-from hdx.utilities.downloader import Download
-from hdx.utilities.path import (
-    progress_storing_folder,
-    script_dir_plus_file,
-    wheretostart_tempdir_batch,
+from hdx.scraper.unosat.metrics import Metrics
+from hdx.scraper.unosat.quickcheck import (
+    feed_unchanged,
+    get_hdx_site,
+    load_yaml,
+    read_hdx_state,
 )
-from hdx.utilities.retriever import Retrieve
 
 logger = logging.getLogger(__name__)
 
@@ -28,70 +28,248 @@ lookup = "hdx-scraper-unosat"
 updated_by_script = "HDX Scraper: UNOSAT"
 
 
-def main(save: bool = False, use_saved: bool = False) -> None:
+def main(
+    save: bool = False,
+    use_saved: bool = False,
+    watch: bool = False,
+    refresh_reference: bool = False,
+    backfill: bool = False,
+    backfill_from: Optional[str] = None,
+) -> None:
     """Generate datasets and create them in HDX
 
     Args:
         save (bool): Save downloaded data. Defaults to False.
         use_saved (bool): Use saved data. Defaults to False.
+        watch (bool): Keep running and poll the feed for new entries. Defaults to False.
+        refresh_reference (bool): Download HDX reference data even if cached. Defaults to False.
+        backfill (bool): Carry on the backfill of the feed's history. Defaults to False.
+        backfill_from (Optional[str]): Start a new backfill from this date. Defaults to None.
 
     Returns:
         None
     """
+    from hdx.api.configuration import Configuration
+    from hdx.scraper.unosat.catalogue import get_catalogue
+    from hdx.scraper.unosat.pipeline import Pipeline
+    from hdx.scraper.unosat.reference import get_reference_cache
+    from hdx.scraper.unosat.runner import Runner
+    from hdx.scraper.unosat.state import PipelineState
+    from hdx.utilities.downloader import Download
+    from hdx.utilities.path import get_temp_dir, wheretostart_tempdir_batch
+    from hdx.utilities.retriever import Retrieve
 
     logger.info(f"##### {lookup} version {__version__} ####")
     configuration = Configuration.read()
-    User.check_current_user_write_access(
-        "ba5aacba-0633-4364-9528-bc76a3f6cf95", configuration=configuration
-    )
-    with wheretostart_tempdir_batch(lookup) as info:
-        folder = info["folder"]
-        with HDXState(
-            "pipeline-state-unosat",
-            folder,
-            parse_date,
-            iso_string_from_datetime,
-            configuration,
-        ) as state:
+    organisation = configuration["organisation"]
+    metrics = Metrics(configuration.get("metrics"))
+    reference = get_reference_cache(configuration)
+    if reference and refresh_reference:
+        reference.invalidate()
+    feeds = configuration.get("feeds")
+    if backfill_from:
+        backfill = True
+    if feeds and not (watch or backfill):
+        from hdx.scraper.unosat.shard import run_feeds
+
+        # Each feed is read in its own process which sets up its own metrics,
+        # reference data and catalogue
+        with metrics.run():
+            run_feeds(
+                configuration,
+                feeds,
+                lookup,
+                organisation,
+                updated_by_script,
+                save,
+                use_saved,
+                metrics,
+            )
+        return
+    metrics.install(configuration)
+    catalogue = get_catalogue(configuration)
+    if backfill:
+        from hdx.scraper.unosat.backfill import Backfill
+        from hdx.utilities.dateparse import parse_date
+
+        # The backfill has its own state dataset and progress folder so that
+        # scheduled runs carry on as normal alongside it
+        since = parse_date(backfill_from) if backfill_from else None
+        with metrics.run():
+            with wheretostart_tempdir_batch(f"{lookup}-backfill") as info:
+                folder = info["folder"]
+                with PipelineState(
+                    configuration["backfill"]["state"], folder, configuration
+                ) as state:
+                    with Download() as downloader:
+                        retriever = Retrieve(
+                            downloader, folder, "saved_data", folder, save, use_saved
+                        )
+                        pipeline = Pipeline(configuration, retriever, metrics)
+                        runner = Backfill(
+                            configuration,
+                            pipeline,
+                            state,
+                            metrics,
+                            organisation,
+                            updated_by_script,
+                            reference,
+                            catalogue,
+                        )
+                        runner.run(info, since)
+        return
+    if watch:
+        from hdx.scraper.unosat.watch import PollInterval, Watcher
+
+        # Configuration, the download and HDX sessions, the state and the
+        # publisher are kept from poll to poll
+        folder = get_temp_dir(f"{lookup}-watch")
+        with PipelineState(configuration["state"], folder, configuration) as state:
             with Download() as downloader:
                 retriever = Retrieve(
                     downloader, folder, "saved_data", folder, save, use_saved
                 )
-                pipeline = Pipeline(configuration, retriever)
-                last_build_date, entries = pipeline.parse_feed(state.get())
-                logger.info(f"Number of datasets: {len(entries)}")
-
-                for _, entry in progress_storing_folder(info, entries, "title"):
-                    dataset, showcase = pipeline.generate_dataset(entry)
-                    if not dataset:
-                        continue
-                    dataset.update_from_yaml(
-                        script_dir_plus_file(
-                            join("config", "hdx_dataset_static.yaml"), main
-                        )
+                pipeline = Pipeline(configuration, retriever, metrics)
+                runner = Runner(
+                    configuration,
+                    pipeline,
+                    state,
+                    metrics,
+                    organisation,
+                    updated_by_script,
+                    reference,
+                    catalogue,
+                )
+
+                def poll():
+                    metrics.reset()
+                    with metrics.run():
+                        try:
+                            with wheretostart_tempdir_batch(lookup) as info:
+                                return runner.run(info)
+                        finally:
+                            state.write()
+
+                watch_configuration = configuration.get("watch", {})
+                interval = PollInterval(
+                    watch_configuration.get("minimum", 60),
+                    watch_configuration.get("maximum", 1800),
+                    watch_configuration.get("backoff", 2),
+                    watch_configuration.get("jitter", 0.1),
+                )
+                Watcher(poll, interval, watch_configuration.get("polls")).run()
+        return
+    with metrics.run():
+        with wheretostart_tempdir_batch(lookup) as info:
+            folder = info["folder"]
+            with PipelineState(configuration["state"], folder, configuration) as state:
+                with Download() as downloader:
+                    retriever = Retrieve(
+                        downloader, folder, "saved_data", folder, save, use_saved
                     )
-                    # ensure markdown has line breaks
-                    dataset["notes"] = dataset["notes"].replace("\n", "  \n")
-
-                    dataset.create_in_hdx(
-                        remove_additional_resources=True,
-                        hxl_update=False,
-                        updated_by_script=updated_by_script,
-                        batch=info["batch"],
+                    pipeline = Pipeline(configuration, retriever, metrics)
+                    runner = Runner(
+                        configuration,
+                        pipeline,
+                        state,
+                        metrics,
+                        organisation,
+                        updated_by_script,
+                        reference,
+                        catalogue,
                     )
-                    if not showcase:
-                        continue
-                    showcase.create_in_hdx()
-                    showcase.add_dataset(dataset)
-                state.set(last_build_date)
+                    runner.run(info)
+
+
+def sets_main_argument(argument):
+    """Check if a command line argument may set one of the arguments of main,
+    allowing for values given after = and abbreviated or negated flags. Short
+    flags may set any argument.
+
+    Args:
+        argument (str): Command line argument
+
+    Returns:
+        bool: True if the argument may set an argument of main
+    """
+    if not argument.startswith("-"):
+        return False
+    if not argument.startswith("--"):
+        return True
+    name = argument.split("=", 1)[0]
+    for parameter in signature(main).parameters:
+        flag = parameter.replace("_", "-")
+        if f"--{flag}".startswith(name) or f"--no-{flag}".startswith(name):
+            return True
+    return False
+
+
+def quick_check(project_config_yaml, argv=None):
+    """Check if the feed, or any of the feeds if there are several, has
+    changed since the last run using only the project configuration and the
+    state read from HDX without the HDX libraries. The check is skipped when
+    any argument of main is given such as saving or using saved data,
+    watching, refreshing the reference data or backfilling. If the check fails
+    for any reason, a full run is done.
+
+    Args:
+        project_config_yaml (str): Path to project configuration
+        argv (Optional[List[str]]): Command line arguments. Defaults to sys.argv[1:].
+
+    Returns:
+        bool: True if there is nothing to do, False if a full run is needed
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    if any(sets_main_argument(argument) for argument in argv):
+        return False
+    project_configuration = load_yaml(project_config_yaml)
+    quick_check_configuration = project_configuration.get("quick_check")
+    if quick_check_configuration is None:
+        return False
+    timeout = quick_check_configuration.get("timeout", 60)
+    feeds = project_configuration.get("feeds")
+    if feeds:
+        checks = [(x["url"], x["state"]) for x in feeds["sources"]]
+    else:
+        checks = [(project_configuration["url"], project_configuration["state"])]
+    user_agent = f"{lookup}/{__version__}"
+    metrics = Metrics(project_configuration.get("metrics"))
+    try:
+        with metrics.time("quick_check"):
+            hdx_url, hdx_key = get_hdx_site(argv, project_configuration)
+            unchanged = all(
+                feed_unchanged(
+                    url,
+                    read_hdx_state(hdx_url, state, user_agent, hdx_key, timeout),
+                    user_agent,
+                    timeout,
+                )
+                for url, state in checks
+            )
+    except Exception:
+        logger.exception("Quick check failed!")
+        return False
+    if unchanged:
+        logger.info("Feed unchanged since last run. Nothing to do!")
+        with metrics.run():
+            metrics.count("quick_check_skips")
+    return unchanged
 
 
 if __name__ == "__main__":
-    facade(
-        main,
-        user_agent_config_yaml=join(expanduser("~"), ".useragents.yaml"),
-        user_agent_lookup=lookup,
-        project_config_yaml=script_dir_plus_file(
-            join("config", "project_configuration.yaml"), main
-        ),
+    from hdx.utilities.easy_logging import setup_logging
+
+    setup_logging(log_file="errors.log")
+    project_config_yaml = join(
+        dirname(abspath(__file__)), "config", "project_configuration.yaml"
     )
+    if not quick_check(project_config_yaml):
+        from hdx.facades.infer_arguments import facade
+
+        facade(
+            main,
+            user_agent_config_yaml=join(expanduser("~"), ".useragents.yaml"),
+            user_agent_lookup=lookup,
+            project_config_yaml=project_config_yaml,
+        )
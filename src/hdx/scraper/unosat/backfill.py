@@ -0,0 +1,150 @@
+#!/usr/bin/python
+"""
+Backfill:
+--------
+
+Republishes the history of the feed oldest first in chunks, saving in its own
+HDX state dataset how far it has got after each chunk so that a long backfill
+can be stopped and carried on from where it got to. The feed is read
+incrementally for each chunk so that memory use is bounded by the chunk size
+rather than the size of the feed. The rate of publishing is limited so that a
+backfill does not use up the HDX call budget of scheduled runs.
+
+"""
+
+import logging
+from os.path import getsize
+
+from hdx.scraper.unosat.feed import StreamingFeed
+from hdx.scraper.unosat.publisher import TokenBucket, get_call_budget
+from hdx.scraper.unosat.runner import Runner
+from hdx.utilities.dateparse import parse_date
+
+logger = logging.getLogger(__name__)
+
+
+class Backfill(Runner):
+    """Publish the entries in the feed published after the build date in the
+    state, oldest first, chunk_size entries at a time. The feed's build date
+    when the backfill starts is kept in the state under until and entries
+    published after it are left to scheduled runs. Once the backfill has
+    finished, until is removed so that the next backfill carries on to the
+    feed's new build date.
+
+    HDX calls are limited to budget_fraction of the calls in publishing,
+    scheduled runs getting the rest, and if datasets_per_hour is set, datasets
+    are published at that rate at most.
+    Entries that are left out or unchanged do not count towards it.
+
+    Args:
+        configuration (Configuration): HDX configuration
+        pipeline (Pipeline): Pipeline to read feed and generate datasets with
+        state (PipelineState): State of the backfill
+        metrics (Metrics): Metrics to record in
+        organisation (str): Organisation id
+        updated_by_script (str): String to identify the script
+        reference (Optional[ReferenceCache]): Cache of HDX reference data. Defaults to None.
+        catalogue (Optional[Catalogue]): Catalogue of processed entries. Defaults to None.
+    """
+
+    def __init__(
+        self,
+        configuration,
+        pipeline,
+        state,
+        metrics,
+        organisation,
+        updated_by_script,
+        reference=None,
+        catalogue=None,
+    ):
+        backfill = configuration.get("backfill", {})
+        period = configuration.get("publishing", {}).get("period", 1800)
+        bucket = TokenBucket(get_call_budget(configuration, True), period)
+        super().__init__(
+            configuration,
+            pipeline,
+            state,
+            metrics,
+            organisation,
+            updated_by_script,
+            reference,
+            catalogue,
+            bucket,
+        )
+        self.chunk_size = backfill.get("chunk_size", 100)
+        self.datasets_per_hour = backfill.get("datasets_per_hour")
+        if self.datasets_per_hour:
+            self.pace = TokenBucket(self.datasets_per_hour, 3600, 1)
+        else:
+            self.pace = None
+
+    def run(self, info, since=None):
+        """Publish chunks of entries until the backfill has finished, saving
+        the state after each one. If since is given, a new backfill is started
+        from that date, otherwise the backfill in the state is carried on.
+
+        Args:
+            info (Dict): Dictionary containing folder and batch
+            since (Optional[datetime]): Date from which to start a new backfill. Defaults to None.
+
+        Returns:
+            int: Number of datasets published
+        """
+        state_dict = self.state.get()
+        if since is not None:
+            state_dict["last_build_date"] = since
+            state_dict.pop("until", None)
+        with self.metrics.time("read_feed"):
+            path = self.pipeline.retriever.download_file(self.pipeline.url, keep=True)
+        self.metrics.add_bytes_downloaded(getsize(path))
+        until = state_dict.get("until")
+        if until is None:
+            with StreamingFeed(path, state_dict["last_build_date"]) as feed:
+                until = feed.last_build_date
+            state_dict["until"] = until.isoformat()
+        else:
+            until = parse_date(until)
+        logger.info(f"Backfilling from {state_dict['last_build_date']} to {until}")
+        dead_letters = self.get_dead_letters(state_dict)
+        if self.reference is not None:
+            with self.metrics.time("load_reference"):
+                if self.reference.load():
+                    self.pipeline.mapped_tags = {}
+        published = 0
+        while True:
+            checkpoint = state_dict["last_build_date"]
+            with self.metrics.time("backfill_chunk_read"):
+                remaining, chunk = self.get_chunk(
+                    path, checkpoint, until, self.chunk_size
+                )
+            self.metrics.set_value("backfill_entries_remaining", remaining)
+            if not chunk:
+                break
+            message = f"{remaining} entries left to backfill"
+            if self.datasets_per_hour:
+                # Unchanged and left out entries are not paced
+                hours = remaining / self.datasets_per_hour
+                message = (
+                    f"{message}, taking {hours:.1f} hours if all are published "
+                    f"at {self.datasets_per_hour} an hour"
+                )
+            logger.info(message)
+            published += self.publish_chunk(
+                info,
+                state_dict,
+                dead_letters,
+                dead_letters.get_due(),
+                chunk,
+                checkpoint,
+            )
+            state_dict["last_build_date"] = chunk[-1].published
+            self.state.set(state_dict)
+            self.state.write()
+            self.metrics.count("backfill_chunks")
+        del state_dict["until"]
+        self.state.set(state_dict)
+        logger.info(f"Backfill finished. Number of datasets published: {published}")
+        if dead_letters:
+            logger.warning(f"{len(dead_letters)} entries waiting to be retried")
+        return published
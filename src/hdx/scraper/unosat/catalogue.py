@@ -0,0 +1,224 @@
+#!/usr/bin/python
+"""
+Catalogue:
+---------
+
+Local SQLite catalogue of every entry the scraper has processed with the
+dataset it generated and the outcome of publishing it. Entries can be looked up
+by country, event, GDACS id, category or bounding box without reading the feed
+or HDX again.
+
+"""
+
+import logging
+import sqlite3
+from datetime import datetime, timezone
+
+from hdx.scraper.unosat.pipeline import Pipeline
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    title TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    eventcode TEXT,
+    gdacs_eventid TEXT,
+    iso3 TEXT,
+    categories TEXT,
+    published TEXT NOT NULL,
+    processed TEXT NOT NULL,
+    min_lon REAL,
+    min_lat REAL,
+    max_lon REAL,
+    max_lat REAL,
+    outcome TEXT NOT NULL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS entries_name ON entries (name);
+CREATE INDEX IF NOT EXISTS entries_eventcode ON entries (eventcode);
+CREATE INDEX IF NOT EXISTS entries_gdacs_eventid ON entries (gdacs_eventid);
+CREATE INDEX IF NOT EXISTS entries_published ON entries (published);
+CREATE INDEX IF NOT EXISTS entries_outcome ON entries (outcome);
+CREATE INDEX IF NOT EXISTS entries_bbox ON entries (min_lon, max_lon, min_lat, max_lat);
+CREATE TABLE IF NOT EXISTS countries (
+    title TEXT NOT NULL,
+    iso3 TEXT NOT NULL,
+    PRIMARY KEY (iso3, title)
+);
+CREATE TABLE IF NOT EXISTS categories (
+    title TEXT NOT NULL,
+    category TEXT NOT NULL,
+    PRIMARY KEY (category, title)
+);
+"""
+
+
+class Catalogue:
+    """SQLite catalogue of processed entries. Each entry is stored under its
+    title with the name of its dataset and the outcome of its last processing
+    which is one of published, unchanged, skipped (no dataset was generated),
+    failed or abandoned (failed too many times to be retried). Countries and
+    categories are also stored in their own tables so that they can be looked
+    up by index.
+
+    Args:
+        path (str): Path to SQLite database. Defaults to ":memory:".
+    """
+
+    outcomes = ("published", "unchanged", "skipped", "failed", "abandoned")
+
+    def __init__(self, path=":memory:"):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.row_factory = sqlite3.Row
+        if path != ":memory:":
+            self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def record(self, entry, outcome, name=None, error=None, now=None):
+        """Record the outcome of processing an entry replacing any earlier one
+
+        Args:
+            entry (FeedEntry): Entry
+            outcome (str): One of published, unchanged, skipped, failed or abandoned
+            name (Optional[str]): Dataset name. Defaults to name generated from title.
+            error (Optional[Exception]): Error if failed. Defaults to None.
+            now (Optional[datetime]): Time of processing. Defaults to now.
+
+        Returns:
+            None
+        """
+        if outcome not in self.outcomes:
+            raise ValueError(f"Unknown outcome {outcome}!")
+        if name is None:
+            name = Pipeline.get_name(entry.title)
+        if now is None:
+            now = datetime.now(timezone.utc)
+        iso3s = []
+        if entry.iso3:
+            iso3s = [iso3.strip().upper() for iso3 in entry.iso3.split(";")]
+        bbox = entry.bbox or (None, None, None, None)
+        title = entry.title
+        with self.connection:
+            self.connection.execute("DELETE FROM countries WHERE title = ?", (title,))
+            self.connection.execute("DELETE FROM categories WHERE title = ?", (title,))
+            self.connection.execute(
+                "INSERT OR REPLACE INTO entries VALUES "
+                "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    title,
+                    name,
+                    entry.eventcode,
+                    entry.gdacs_eventid,
+                    ";".join(iso3s),
+                    ";".join(entry.tags),
+                    entry.published.isoformat(),
+                    now.isoformat(),
+                    *bbox,
+                    outcome,
+                    repr(error) if error else None,
+                ),
+            )
+            self.connection.executemany(
+                "INSERT INTO countries VALUES (?, ?)",
+                [(title, iso3) for iso3 in dict.fromkeys(iso3s) if iso3],
+            )
+            self.connection.executemany(
+                "INSERT INTO categories VALUES (?, ?)",
+                [(title, category) for category in dict.fromkeys(entry.tags)],
+            )
+
+    def get(self, title):
+        """Get the catalogue record of an entry
+
+        Args:
+            title (str): Entry title
+
+        Returns:
+            Optional[Dict]: Record or None if entry is not in the catalogue
+        """
+        row = self.connection.execute(
+            "SELECT * FROM entries WHERE title = ?", (title,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def find(
+        self,
+        iso3=None,
+        eventcode=None,
+        gdacs_eventid=None,
+        category=None,
+        bbox=None,
+        outcome=None,
+        name=None,
+    ):
+        """Find records matching all of the given criteria newest first. A
+        bounding box matches records whose bounding box intersects it.
+
+        Args:
+            iso3 (Optional[str]): Country ISO3 code. Defaults to None.
+            eventcode (Optional[str]): UNOSAT event code. Defaults to None.
+            gdacs_eventid (Optional[str]): GDACS event id. Defaults to None.
+            category (Optional[str]): UNOSAT category. Defaults to None.
+            bbox (Optional[Tuple[float, float, float, float]]): (min lon, min lat, max lon, max lat). Defaults to None.
+            outcome (Optional[str]): Outcome. Defaults to None.
+            name (Optional[str]): Dataset name. Defaults to None.
+
+        Returns:
+            List[Dict]: Matching records
+        """
+        conditions = []
+        parameters = []
+        if iso3:
+            conditions.append("title IN (SELECT title FROM countries WHERE iso3 = ?)")
+            parameters.append(iso3.upper())
+        if category:
+            conditions.append(
+                "title IN (SELECT title FROM categories WHERE category = ?)"
+            )
+            parameters.append(category)
+        for column, value in (
+            ("eventcode", eventcode),
+            ("gdacs_eventid", gdacs_eventid),
+            ("outcome", outcome),
+            ("name", name),
+        ):
+            if value:
+                conditions.append(f"{column} = ?")
+                parameters.append(value)
+        if bbox:
+            min_lon, min_lat, max_lon, max_lat = bbox
+            conditions.append(
+                "min_lon <= ? AND max_lon >= ? AND min_lat <= ? AND max_lat >= ?"
+            )
+            parameters.extend((max_lon, min_lon, max_lat, min_lat))
+        query = "SELECT * FROM entries"
+        if conditions:
+            query = f"{query} WHERE {' AND '.join(conditions)}"
+        query = f"{query} ORDER BY published DESC"
+        return [dict(row) for row in self.connection.execute(query, parameters)]
+
+
+def get_catalogue(configuration):
+    """Get the catalogue whose path is set under catalogue in the configuration
+
+    Args:
+        configuration (Configuration): HDX configuration
+
+    Returns:
+        Optional[Catalogue]: Catalogue or None if not configured
+    """
+    path = configuration.get("catalogue", {}).get("path")
+    if not path:
+        return None
+    return Catalogue(path)
@@ -0,0 +1,108 @@
+#!/usr/bin/python
+"""
+Dead letters:
+------------
+
+Entries that failed to publish are kept in the state as dead letters so that
+a failure of one entry does not hold back the rest. Later runs retry only the
+dead letters that are due, waiting exponentially longer after each failure,
+until they have been tried a maximum number of times.
+
+"""
+
+import logging
+from time import time
+
+from hdx.scraper.unosat.feed import FeedEntry
+
+logger = logging.getLogger(__name__)
+
+
+class DeadLetterQueue:
+    """Queue of failed entries held in a dictionary from the state keyed by
+    entry title. Each dead letter holds the entry, the number of attempts made,
+    the last error and the time (in seconds since the epoch) after which it
+    should be retried. After n attempts, the wait is delay * 2 ** (n - 1) up to
+    max_delay. If max_attempts is set, an entry that has failed that many times
+    is dropped from the queue and not retried again.
+
+    Args:
+        letters (Dict): Dictionary of dead letters from the state
+        delay (float): Seconds to wait before the first retry. Defaults to 600.
+        max_delay (float): Maximum seconds to wait before a retry. Defaults to 86400.
+        max_attempts (Optional[int]): Attempts after which to give up. Defaults to None (never).
+    """
+
+    def __init__(self, letters, delay=600, max_delay=86400, max_attempts=None):
+        self.letters = letters
+        self.delay = delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+
+    def __len__(self):
+        return len(self.letters)
+
+    def add(self, entry, error, now=None):
+        """Add a failed entry or record another failed attempt. If the entry
+        has been tried max_attempts times, it is dropped instead.
+
+        Args:
+            entry (FeedEntry): Entry that failed
+            error (Exception): Error raised
+            now (Optional[float]): Time now in seconds since the epoch. Defaults to time().
+
+        Returns:
+            bool: Whether the entry will be retried
+        """
+        if now is None:
+            now = time()
+        letter = self.letters.get(entry.title)
+        attempts = letter["attempts"] + 1 if letter else 1
+        if self.max_attempts and attempts >= self.max_attempts:
+            self.letters.pop(entry.title, None)
+            logger.error(
+                f"Failed to publish {entry.title} after {attempts} attempts. Giving up: {error!r}"
+            )
+            return False
+        delay = min(self.max_delay, self.delay * 2 ** (attempts - 1))
+        self.letters[entry.title] = {
+            "entry": entry.to_dict(),
+            "attempts": attempts,
+            "error": repr(error),
+            "retry_after": round(now + delay),
+        }
+        logger.error(
+            f"Failed to publish {entry.title} (attempt {attempts}). Retrying in {delay} seconds: {error!r}"
+        )
+        return True
+
+    def remove(self, title, reason="published"):
+        """Remove entry if it is in the queue
+
+        Args:
+            title (str): Entry title
+            reason (str): Why it is removed for the log. Defaults to "published".
+
+        Returns:
+            None
+        """
+        if self.letters.pop(title, None):
+            logger.info(f"Dead letter {title} {reason}")
+
+    def get_due(self, now=None):
+        """Get the entries that are due to be retried oldest first
+
+        Args:
+            now (Optional[float]): Time now in seconds since the epoch. Defaults to time().
+
+        Returns:
+            List[FeedEntry]: Entries to retry
+        """
+        if now is None:
+            now = time()
+        entries = [
+            FeedEntry.from_dict(letter["entry"])
+            for letter in self.letters.values()
+            if letter["retry_after"] <= now
+        ]
+        return sorted(entries, key=lambda entry: entry.published)
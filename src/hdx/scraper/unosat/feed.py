@@ -0,0 +1,351 @@
+#!/usr/bin/python
+"""
+Feed:
+----
+
+Conditional download and streaming parser for the UNOSAT RSS feed. Items are
+read incrementally and reading stops at the first item that is not newer than
+the previous build date as the feed is ordered newest first. Entries are
+returned as compact FeedEntry objects holding only what is needed to generate
+datasets.
+
+"""
+
+import hashlib
+import logging
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from os import remove
+from xml.etree.ElementTree import XMLPullParser
+
+from feedparser import FeedParserDict
+
+from hdx.utilities.dateparse import parse_date
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True, slots=True)
+class FeedEntry:
+    """The fields of a feed item that are used to generate a dataset and its
+    showcase. Tags are the category terms of the item. The bounding box of the
+    item's georss polygon or point is kept as (min lon, min lat, max lon, max
+    lat). Items can be looked up by key as well as attribute like the
+    feedparser entries they replace.
+    """
+
+    title: str
+    published: datetime
+    eventcode: str = None
+    gdacs_eventid: str = None
+    summary: str = ""
+    iso3: str = None
+    tags: tuple = ()
+    gdb_link: str = None
+    shp_link: str = None
+    kml_link: str = None
+    excel: str = None
+    wmap_link: str = None
+    pdf: str = None
+    image_link: str = None
+    bbox: tuple = None
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def to_dict(self):
+        """Convert to a dictionary that can be serialised as JSON
+
+        Returns:
+            Dict: Dictionary of fields
+        """
+        data = asdict(self)
+        data["published"] = self.published.isoformat()
+        data["tags"] = list(self.tags)
+        if self.bbox is not None:
+            data["bbox"] = list(self.bbox)
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        """Create FeedEntry from a dictionary made by to_dict
+
+        Args:
+            data (Dict): Dictionary of fields
+
+        Returns:
+            FeedEntry: Compact feed entry
+        """
+        data = dict(data)
+        data["published"] = parse_date(data["published"])
+        data["tags"] = tuple(data["tags"])
+        bbox = data.get("bbox")
+        if bbox is not None:
+            data["bbox"] = tuple(bbox)
+        return cls(**data)
+
+    @classmethod
+    def from_parsed(cls, entry, published):
+        """Create FeedEntry from a feedparser entry
+
+        Args:
+            entry (FeedParserDict): Parsed feed entry
+            published (datetime): Publication date of entry
+
+        Returns:
+            FeedEntry: Compact feed entry
+        """
+        image_link = None
+        for link in entry.get("links", ()):
+            if "image" in link.type:
+                image_link = link.href
+        where = entry.get("where")
+        if where:
+            # feedparser gives GeoJSON style geometry
+            coordinates = where["coordinates"]
+            if where["type"] == "Point":
+                points = [coordinates]
+            else:
+                points = [point for ring in coordinates for point in ring]
+        else:
+            georss = entry.get("georss_polygon") or entry.get("georss_point")
+            points = parse_georss(georss) if georss else []
+        return cls(
+            title=entry.title,
+            published=published,
+            eventcode=entry.get("eventcode"),
+            gdacs_eventid=entry.get("gdacs_eventid"),
+            summary=entry.get("summary", ""),
+            iso3=entry.get("iso3"),
+            tags=tuple(tag.term for tag in entry.get("tags", ())),
+            gdb_link=entry.get("gdb_link"),
+            shp_link=entry.get("shp_link"),
+            kml_link=entry.get("kml_link"),
+            excel=entry.get("excel"),
+            wmap_link=entry.get("wmap_link"),
+            pdf=entry.get("pdf"),
+            image_link=image_link,
+            bbox=get_bbox(points),
+        )
+
+
+def parse_georss(text):
+    """Parse the text of a georss point or polygon which is a list of
+    latitudes and longitudes separated by spaces
+
+    Args:
+        text (str): Text of georss element
+
+    Returns:
+        List[Tuple[float, float]]: List of (longitude, latitude)
+    """
+    values = [float(value) for value in text.split()]
+    return list(zip(values[1::2], values[::2]))
+
+
+def get_bbox(points):
+    """Get the bounding box of a list of points. Items with no location have
+    a polygon whose points are all 0, 0 which is taken to be no bounding box.
+
+    Args:
+        points (List[Tuple[float, float]]): List of (longitude, latitude)
+
+    Returns:
+        Optional[Tuple[float, float, float, float]]: (min lon, min lat, max lon, max lat)
+    """
+    if not points:
+        return None
+    lons = [point[0] for point in points]
+    lats = [point[1] for point in points]
+    bbox = (min(lons), min(lats), max(lons), max(lats))
+    if not any(bbox):
+        return None
+    return bbox
+
+
+def hash_file(path):
+    md5hash = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            md5hash.update(chunk)
+    return md5hash.hexdigest()
+
+
+def download_feed(retriever, url, validators):
+    """Download the feed sending the ETag and Last-Modified validators from the
+    previous run so that the server can reply 304 Not Modified. If the server
+    does not support conditional requests, the hash of the body is compared
+    with the previous one instead. Saved data is never taken to be unchanged
+    so that it can be replayed.
+
+    Args:
+        retriever (Retrieve): Retrieve object
+        url (str): Feed url
+        validators (Dict): Validators from the previous run (etag, last_modified, hash)
+
+    Returns:
+        Tuple[Optional[str], Dict]: (path to feed or None if unchanged, new validators)
+    """
+    headers = {}
+    etag = validators.get("etag")
+    if etag:
+        headers["If-None-Match"] = etag
+    last_modified = validators.get("last_modified")
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    path = retriever.download_file(url, overwrite=True, headers=headers)
+    new_validators = {}
+    if not retriever.use_saved:
+        response = retriever.downloader.response
+        if response.status_code == 304:
+            logger.info(f"Feed {url} not modified since {last_modified}")
+            remove(path)
+            return None, validators
+        new_validators["etag"] = response.headers.get("ETag")
+        new_validators["last_modified"] = response.headers.get("Last-Modified")
+    new_validators["hash"] = hash_file(path)
+    if retriever.use_saved:
+        return path, new_validators
+    if new_validators["hash"] == validators.get("hash"):
+        logger.info(f"Feed {url} has the same hash as last time")
+        return None, validators
+    return path, new_validators
+
+
+def _get_key(tag, namespaces):
+    """Convert an element tag like {http://www.gdacs.org}eventid into the key
+    feedparser would use eg. gdacs_eventid"""
+    if tag[0] == "{":
+        uri, localname = tag[1:].split("}")
+        prefix = namespaces.get(uri)
+        if prefix:
+            return f"{prefix}_{localname}".lower()
+        return localname.lower()
+    return tag.lower()
+
+
+def _read_events(file, parser):
+    # Unlike iterparse, this holds no reference cycle so the parser and what it
+    # has parsed are freed as soon as the feed is closed
+    while True:
+        data = file.read(16 * 1024)
+        if not data:
+            break
+        parser.feed(data)
+        yield from parser.read_events()
+    parser.close()
+    yield from parser.read_events()
+
+
+def _item_to_entry(item, namespaces):
+    entry = FeedParserDict()
+    links = []
+    tags = []
+    for element in item:
+        key = _get_key(element.tag, namespaces)
+        text = (element.text or "").strip()
+        if key == "description":
+            entry["summary"] = text
+        elif key == "pubdate":
+            entry["published"] = text
+        elif key == "guid":
+            entry["id"] = text
+        elif key == "category":
+            tags.append(FeedParserDict(term=text, scheme=None, label=None))
+        elif key == "link":
+            entry["link"] = text
+            links.append(FeedParserDict(rel="alternate", type="text/html", href=text))
+        elif key == "enclosure":
+            links.append(
+                FeedParserDict(
+                    rel="enclosure",
+                    length=element.get("length"),
+                    type=element.get("type", ""),
+                    href=element.get("url"),
+                )
+            )
+        else:
+            entry[key] = text
+    entry["links"] = links
+    entry["tags"] = tags
+    return entry
+
+
+class StreamingFeed:
+    """Incrementally parse an RSS file. The channel's lastBuildDate is read on
+    construction, then FeedEntry objects for entries newer than
+    previous_build_date are yielded one at a time by iterating over the
+    object. Parsed elements are cleared as soon as they have been processed so
+    that memory use does not grow with the size of the feed.
+
+    Args:
+        path (str): Path to RSS file
+        previous_build_date (datetime): Date of the previous build
+    """
+
+    def __init__(self, path, previous_build_date):
+        self.previous_build_date = previous_build_date
+        self.last_build_date = None
+        self._file = open(path, "rb")
+        self._events = _read_events(
+            self._file, XMLPullParser(events=("start-ns", "start", "end"))
+        )
+        self._namespaces = {}
+        self._channel = None
+        self._pending = None
+        self._read_channel()
+
+    def _next_item(self):
+        for event, value in self._events:
+            if event == "start-ns":
+                prefix, uri = value
+                self._namespaces[uri] = prefix
+            elif event == "start":
+                if value.tag == "channel":
+                    self._channel = value
+            elif value.tag == "item":
+                return value
+            elif value.tag == "lastBuildDate":
+                self.last_build_date = parse_date(value.text.strip())
+        return None
+
+    def _parse_item(self, item):
+        entry = _item_to_entry(item, self._namespaces)
+        # Drop everything parsed so far so memory use stays flat
+        if self._channel is not None:
+            self._channel.clear()
+        return entry
+
+    def _read_channel(self):
+        item = self._next_item()
+        if item is not None:
+            self._pending = self._parse_item(item)
+            if self.last_build_date is None:
+                self.last_build_date = parse_date(self._pending.published)
+
+    def close(self):
+        self._events.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __iter__(self):
+        try:
+            entry = self._pending
+            self._pending = None
+            while entry is not None:
+                published = parse_date(entry.published)
+                if published <= self.previous_build_date:
+                    logger.info(f"Stopped reading feed at entry published {published}")
+                    break
+                yield FeedEntry.from_parsed(entry, published)
+                item = self._next_item()
+                if item is None:
+                    break
+                entry = self._parse_item(item)
+        finally:
+            self.close()
@@ -0,0 +1,173 @@
+#!/usr/bin/python
+"""
+Index:
+-----
+
+In memory index of the UNOSAT datasets and showcases that are about to be
+published and exist in HDX. It is built with bulk searches before publishing
+and then answers the reads that create_in_hdx and add_dataset make for each
+entry so that they do not need to go to HDX.
+
+"""
+
+import logging
+from copy import deepcopy
+
+from ckanapi.errors import NotFound
+
+from hdx.data.dataset import Dataset
+from hdx.data.showcase import Showcase
+
+logger = logging.getLogger(__name__)
+
+
+class HDXIndex:
+    """Index of datasets of an organisation and their showcases. Showcases
+    are named after their dataset with the suffix -showcase.
+
+    The index is only relied upon to say that a dataset or showcase does not
+    exist for dataset names that have been passed to expect.
+
+    Which datasets a showcase contains is not available in bulk, so a showcase
+    is taken to contain its dataset if that dataset has a fingerprint ie. it
+    was completely published (including add_dataset) by an earlier run.
+    Otherwise the read goes to HDX.
+
+    Args:
+        configuration (Configuration): HDX configuration
+        organisation (str): Organisation id
+        fingerprints (Dict): Fingerprints of published datasets
+        batch_size (int): Number of names to look up in one search. Defaults to 100.
+    """
+
+    def __init__(self, configuration, organisation, fingerprints, batch_size=100):
+        self.configuration = configuration
+        self.organisation = organisation
+        self.fingerprints = fingerprints
+        self.batch_size = batch_size
+        self.datasets = {}
+        self.showcases = {}
+        self.showcase_datasets = {}
+        self.expected = set()
+
+    def build(self, names):
+        """Add the datasets with the given names and their showcases to the
+        index using bulk searches of HDX that include private and draft
+        datasets. Datasets and showcases already in the index that are not
+        found are kept as they may have been created too recently to be
+        searchable.
+
+        Args:
+            names (Iterable[str]): Names of datasets about to be published
+
+        Returns:
+            None
+        """
+        names = list(dict.fromkeys(names))
+        self.expected = set()
+        for i in range(0, len(names), self.batch_size):
+            batch = " OR ".join(names[i : i + self.batch_size])
+            for dataset in Dataset.search_in_hdx(
+                fq=f"owner_org:{self.organisation} AND name:({batch})",
+                configuration=self.configuration,
+                include_private=True,
+                include_drafts=True,
+            ):
+                package = dict(dataset.data)
+                package["resources"] = [
+                    resource.data for resource in dataset.get_resources()
+                ]
+                self.datasets[package["name"]] = package
+            batch = " OR ".join(
+                f"{name}-showcase" for name in names[i : i + self.batch_size]
+            )
+            for showcase in Showcase.search_in_hdx(
+                fq=f"name:({batch})",
+                configuration=self.configuration,
+                include_private=True,
+            ):
+                self.showcases[showcase["name"]] = dict(showcase.data)
+        for name in names:
+            dataset = self.datasets.get(name)
+            showcase = self.showcases.get(f"{name}-showcase")
+            if dataset and showcase and name in self.fingerprints:
+                self.showcase_datasets.setdefault(
+                    showcase["id"], [{"id": dataset["id"]}]
+                )
+        logger.info(
+            f"Indexed {len(self.datasets)} datasets and {len(self.showcases)} showcases"
+        )
+
+    def expect(self, name):
+        """Register the name of a dataset that is about to be published
+
+        Args:
+            name (str): Dataset name
+
+        Returns:
+            None
+        """
+        self.expected.add(name)
+
+    def call(self, call_remoteckan, action, data=None, *args, **kwargs):
+        """Answer reads from the index where possible and keep the index up to
+        date with writes
+
+        Args:
+            call_remoteckan (Callable): Function that calls HDX
+            action (str): CKAN action
+            data (Optional[Dict]): CKAN action data. Defaults to None.
+            *args: Other arguments to pass to call_remoteckan
+            **kwargs: Other keyword arguments to pass to call_remoteckan
+
+        Returns:
+            Union[Dict, List]: The response from HDX or index
+        """
+        if action == "package_show":
+            package = self.datasets.get(data["id"])
+            if package is not None:
+                return deepcopy(package)
+            if data["id"] in self.expected:
+                raise NotFound(f"Dataset {data['id']} not in index!")
+        elif action == "ckanext_showcase_show":
+            showcase = self.showcases.get(data["id"])
+            if showcase is not None:
+                return deepcopy(showcase)
+            if data["id"][: -len("-showcase")] in self.expected:
+                raise NotFound(f"Showcase {data['id']} not in index!")
+        elif action == "ckanext_showcase_package_list":
+            datasets = self.showcase_datasets.get(data["showcase_id"])
+            if datasets is not None:
+                return deepcopy(datasets)
+        result = call_remoteckan(action, data, *args, **kwargs)
+        if action == "package_create":
+            self.datasets[result["name"]] = result
+        elif action == "package_revise":
+            self.datasets[result["package"]["name"]] = result["package"]
+        elif action == "ckanext_showcase_create":
+            self.showcases[result["name"]] = result
+            self.showcase_datasets[result["id"]] = []
+        elif action == "ckanext_showcase_update":
+            self.showcases[result["name"]] = result
+        elif action == "ckanext_showcase_package_list":
+            self.showcase_datasets[data["showcase_id"]] = [
+                {"id": dataset["id"]} for dataset in result
+            ]
+        elif action == "ckanext_showcase_package_association_create":
+            datasets = self.showcase_datasets.get(data["showcase_id"])
+            if datasets is not None:
+                datasets.append({"id": data["package_id"]})
+        return result
+
+    def install(self):
+        """Route HDX calls made with the configuration through the index
+
+        Returns:
+            None
+        """
+        call_remoteckan = self.configuration.call_remoteckan
+
+        def indexed_call_remoteckan(*args, **kwargs):
+            return self.call(call_remoteckan, *args, **kwargs)
+
+        self.configuration.call_remoteckan = indexed_call_remoteckan
@@ -0,0 +1,337 @@
+#!/usr/bin/python
+"""
+Metrics:
+-------
+
+Instrumentation of a run: wall time and latency histograms per stage, HDX API
+calls by action, bytes downloaded and other counts. At the end of the run the
+metrics are written as a JSON report and as a Prometheus textfile for the node
+exporter's textfile collector.
+
+"""
+
+import json
+import logging
+from collections import Counter
+from contextlib import contextmanager
+from os import replace
+from threading import Lock
+from time import perf_counter, time
+
+logger = logging.getLogger(__name__)
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _save_text(text, path):
+    # Plain file writing keeps this module cheap to import for the quick check
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    text = ",".join(f'{key}="{value}"' for key, value in labels.items())
+    return f"{{{text}}}"
+
+
+class Metrics:
+    """Thread safe collection of metrics for a run. Durations are observed per
+    stage into histograms with the given bucket upper bounds.
+
+    Args:
+        outputs (Optional[Dict]): Paths to write to with keys json and prometheus. Defaults to None.
+        buckets (Tuple[float]): Histogram bucket upper bounds in seconds. Defaults to BUCKETS.
+        labels (Optional[Dict]): Labels to add to every Prometheus sample. Defaults to None.
+    """
+
+    def __init__(self, outputs=None, buckets=BUCKETS, labels=None):
+        if outputs is None:
+            outputs = {}
+        self.outputs = outputs
+        self.buckets = buckets
+        self.labels = labels or {}
+        self.lock = Lock()
+        self.stages = {}
+        self.hdx_calls = Counter()
+        self.hdx_errors = Counter()
+        self.counts = Counter()
+        self.values = {}
+        self.bytes_downloaded = 0
+
+    def reset(self):
+        """Clear all metrics so that the same object can be used for another
+        run. Wrapping of HDX calls done by install is kept.
+
+        Returns:
+            None
+        """
+        with self.lock:
+            self.stages = {}
+            self.hdx_calls = Counter()
+            self.hdx_errors = Counter()
+            self.counts = Counter()
+            self.values = {}
+            self.bytes_downloaded = 0
+
+    def observe(self, stage, seconds):
+        """Record that a stage took the given number of seconds
+
+        Args:
+            stage (str): Name of stage
+            seconds (float): Duration in seconds
+
+        Returns:
+            None
+        """
+        with self.lock:
+            metrics = self.stages.get(stage)
+            if metrics is None:
+                metrics = {
+                    "count": 0,
+                    "seconds": 0.0,
+                    "max_seconds": 0.0,
+                    "buckets": [0] * len(self.buckets),
+                }
+                self.stages[stage] = metrics
+            metrics["count"] += 1
+            metrics["seconds"] += seconds
+            metrics["max_seconds"] = max(metrics["max_seconds"], seconds)
+            buckets = metrics["buckets"]
+            for i, upper_bound in enumerate(self.buckets):
+                if seconds <= upper_bound:
+                    buckets[i] += 1
+
+    @contextmanager
+    def time(self, stage):
+        """Time the body of a with statement as a stage
+
+        Args:
+            stage (str): Name of stage
+
+        Returns:
+            None
+        """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, perf_counter() - start)
+
+    def time_iterator(self, stage, iterator):
+        """Wrap an iterator timing how long getting each item takes
+
+        Args:
+            stage (str): Name of stage
+            iterator (Iterator): Iterator to wrap
+
+        Returns:
+            Iterator: Iterator yielding the same items
+        """
+        iterator = iter(iterator)
+        while True:
+            start = perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.observe(stage, perf_counter() - start)
+            yield item
+
+    def count(self, name, number=1):
+        """Add to a count
+
+        Args:
+            name (str): Name of count
+            number (int): Number to add. Defaults to 1.
+
+        Returns:
+            None
+        """
+        with self.lock:
+            self.counts[name] += number
+
+    def set_value(self, name, value):
+        """Set a value
+
+        Args:
+            name (str): Name of value
+            value (float): Value
+
+        Returns:
+            None
+        """
+        with self.lock:
+            self.values[name] = value
+
+    def add_bytes_downloaded(self, number):
+        """Add to bytes downloaded
+
+        Args:
+            number (int): Number of bytes
+
+        Returns:
+            None
+        """
+        with self.lock:
+            self.bytes_downloaded += number
+
+    def install(self, configuration):
+        """Count and time every HDX API call made with the given configuration.
+        This should be done before any other wrapping of call_remoteckan so
+        that only calls that reach HDX are counted and the time spent waiting
+        for the rate limit is excluded.
+
+        Args:
+            configuration (Configuration): HDX configuration
+
+        Returns:
+            None
+        """
+        call_remoteckan = configuration.call_remoteckan
+
+        def measured_call_remoteckan(action, *args, **kwargs):
+            with self.lock:
+                self.hdx_calls[action] += 1
+            try:
+                with self.time("hdx_call"):
+                    return call_remoteckan(action, *args, **kwargs)
+            except Exception:
+                with self.lock:
+                    self.hdx_errors[action] += 1
+                raise
+
+        configuration.call_remoteckan = measured_call_remoteckan
+
+    def get_report(self):
+        """Get the metrics as a dictionary
+
+        Returns:
+            Dict: Metrics
+        """
+        with self.lock:
+            stages = {}
+            for stage, metrics in self.stages.items():
+                histogram = dict(zip(map(str, self.buckets), metrics["buckets"]))
+                stages[stage] = {
+                    "count": metrics["count"],
+                    "seconds": round(metrics["seconds"], 6),
+                    "mean_seconds": round(metrics["seconds"] / metrics["count"], 6),
+                    "max_seconds": round(metrics["max_seconds"], 6),
+                    "histogram": histogram,
+                }
+            return {
+                "stages": stages,
+                "hdx_calls": dict(self.hdx_calls),
+                "hdx_errors": dict(self.hdx_errors),
+                "counts": dict(self.counts),
+                "values": dict(self.values),
+                "bytes_downloaded": self.bytes_downloaded,
+            }
+
+    def get_prometheus_text(self, prefix="unosat"):
+        """Get the metrics in the Prometheus text exposition format
+
+        Args:
+            prefix (str): Prefix for metric names. Defaults to "unosat".
+
+        Returns:
+            str: Metrics in Prometheus text format
+        """
+        report = self.get_report()
+        lines = []
+
+        def add(name, kind, description, samples):
+            name = f"{prefix}_{name}"
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            for suffix, labels, value in samples:
+                labels = {**self.labels, **(labels or {})}
+                lines.append(f"{name}{suffix}{_format_labels(labels)} {value}")
+
+        stages = report["stages"]
+        add(
+            "stage_seconds",
+            "gauge",
+            "Wall time spent in each stage in the last run",
+            [("", {"stage": stage}, x["seconds"]) for stage, x in stages.items()],
+        )
+        samples = []
+        for stage, metrics in stages.items():
+            for upper_bound, number in metrics["histogram"].items():
+                samples.append(("_bucket", {"stage": stage, "le": upper_bound}, number))
+            samples.append(
+                ("_bucket", {"stage": stage, "le": "+Inf"}, metrics["count"])
+            )
+            samples.append(("_sum", {"stage": stage}, metrics["seconds"]))
+            samples.append(("_count", {"stage": stage}, metrics["count"]))
+        add(
+            "stage_duration_seconds",
+            "histogram",
+            "Duration of each execution of a stage in the last run",
+            samples,
+        )
+        add(
+            "hdx_calls",
+            "gauge",
+            "HDX API calls by action in the last run",
+            [("", {"action": x}, n) for x, n in report["hdx_calls"].items()],
+        )
+        add(
+            "hdx_errors",
+            "gauge",
+            "Failed HDX API calls by action in the last run",
+            [("", {"action": x}, n) for x, n in report["hdx_errors"].items()],
+        )
+        add(
+            "bytes_downloaded",
+            "gauge",
+            "Bytes downloaded in the last run",
+            [("", None, report["bytes_downloaded"])],
+        )
+        for name, number in report["counts"].items():
+            add(
+                name, "gauge", f"Number of {name} in the last run", [("", None, number)]
+            )
+        for name, value in report["values"].items():
+            add(name, "gauge", f"Value of {name} in the last run", [("", None, value)])
+        return "\n".join(lines) + "\n"
+
+    def write(self):
+        """Write the JSON report and Prometheus textfile to the paths given in
+        outputs if any. The Prometheus textfile is written to a temporary file
+        and then renamed so that it is never read half written.
+
+        Returns:
+            None
+        """
+        path = self.outputs.get("json")
+        if path:
+            _save_text(json.dumps(self.get_report(), indent=2, sort_keys=True), path)
+            logger.info(f"Metrics report written to {path}")
+        path = self.outputs.get("prometheus")
+        if path:
+            temp_path = f"{path}.tmp"
+            _save_text(self.get_prometheus_text(), temp_path)
+            replace(temp_path, path)
+            logger.info(f"Prometheus metrics written to {path}")
+
+    @contextmanager
+    def run(self):
+        """Time the body of a with statement as the run, record whether it
+        succeeded and when it finished and write the metrics at the end even if
+        the run fails
+
+        Returns:
+            None
+        """
+        success = 0
+        try:
+            with self.time("run"):
+                yield
+            success = 1
+        finally:
+            self.set_value("last_run_success", success)
+            self.set_value("last_run_timestamp_seconds", round(time()))
+            self.write()
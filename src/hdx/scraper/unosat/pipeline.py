@@ -8,6 +8,8 @@ Reads UNOSAT data and creates datasets.
 """
 
 import logging
+from os.path import getsize, join
+from types import MappingProxyType
 
 import feedparser
 from slugify import slugify
@@ -15,32 +17,372 @@ from slugify import slugify
 from hdx.data.dataset import Dataset
 from hdx.data.resource import Resource
 from hdx.data.showcase import Showcase
+from hdx.data.vocabulary import Vocabulary
+from hdx.scraper.unosat.feed import FeedEntry, StreamingFeed, download_feed
+from hdx.scraper.unosat.metrics import Metrics
+from hdx.scraper.unosat.probe import LinkProber
 from hdx.utilities.dateparse import parse_date
-from hdx.utilities.path import get_filename_from_url
+from hdx.utilities.path import get_filename_from_url, script_dir_plus_file
 
 logger = logging.getLogger(__name__)
 
 
 class Pipeline:
-    def __init__(self, configuration, retriever):
+    """Read a UNOSAT feed and generate datasets and showcases from its entries.
+    If claims is set to a dictionary shared with pipelines reading other feeds,
+    a dataset is only generated by the first pipeline, identified by shard, to
+    claim its name.
+
+    Args:
+        configuration (Configuration): HDX configuration
+        retriever (Retrieve): Retrieve object
+        metrics (Optional[Metrics]): Metrics to record in. Defaults to None.
+        url (Optional[str]): Feed url. Defaults to url in configuration.
+        probe_results (Optional[str]): Path to link probe results. Defaults to results in configuration.
+    """
+
+    def __init__(
+        self, configuration, retriever, metrics=None, url=None, probe_results=None
+    ):
         self.configuration = configuration
         self.retriever = retriever
+        if url is None:
+            url = configuration["url"]
+        self.url = url
+        self.claims = None
+        self.shard = None
+        if metrics is None:
+            metrics = Metrics()
+        self.metrics = metrics
         self.last_build_date = None
+        self.feed_unchanged = False
+        self.feed_validators = {}
+        self.template = self.get_template(configuration["organisation"])
+        # None in the YAML is the string "None" so it is filtered out here too
+        self.tag_mapping = {
+            term: tag
+            for term, tag in configuration["tag_mapping"].items()
+            if tag and tag != "None"
+        }
+        self.mapped_tags = {}
+        probe_links = configuration.get("probe_links")
+        if probe_links is None:
+            self.prober = None
+        else:
+            if probe_results is None:
+                probe_results = probe_links.get("results")
+            self.prober = LinkProber(
+                probe_results,
+                probe_links.get("workers", 8),
+                probe_links.get("timeout", 30),
+                probe_links.get("retry_dead", 86400),
+                metrics,
+            )
+
+    @staticmethod
+    def get_template(organisation):
+        """Resolve the metadata that is the same for every dataset: the fixed
+        maintainer, organisation, update frequency and subnational flag and the
+        static metadata in hdx_dataset_static.yaml (which takes precedence). This
+        is done once so that generating a dataset only adds what is specific to
+        its entry.
+
+        Args:
+            organisation (str): Organisation id
+
+        Returns:
+            MappingProxyType: Read only dataset metadata
+        """
+        dataset = Dataset()
+        dataset.set_maintainer("83fa9515-3ba4-4f1d-9860-f38b20f80442")
+        dataset.set_organization(organisation)
+        dataset.set_expected_update_frequency("Never")
+        dataset.set_subnational(True)
+        dataset.update_from_yaml(
+            script_dir_plus_file(join("config", "hdx_dataset_static.yaml"), Pipeline)
+        )
+        return MappingProxyType(dict(dataset.data))
+
+    @staticmethod
+    def get_name(title):
+        """Get the name of the dataset generated for an entry from its title
+
+        Args:
+            title (str): Entry title
+
+        Returns:
+            str: Dataset name
+        """
+        slugified_name = slugify(title)
+        if len(slugified_name) > 90:
+            slugified_name = slugified_name.replace("satellite-detected-", "")
+            slugified_name = slugified_name.replace("estimation-of-", "")
+            slugified_name = slugified_name.replace("geodata-of-", "")[:90]
+        return slugified_name
+
+    def get_tags(self, terms):
+        """Get the tags for a combination of UNOSAT categories. The categories
+        are mapped using tag_mapping and the result is mapped and checked
+        against the approved vocabulary which is only done once for each
+        combination.
+
+        Args:
+            terms (Tuple[str, ...]): UNOSAT categories
+
+        Returns:
+            List[Dict]: Tags with vocabulary id
+        """
+        mapped_tags = self.mapped_tags.get(terms)
+        if mapped_tags is None:
+            tags = ["geodata"]
+            for term in terms:
+                tag = self.tag_mapping.get(term)
+                if tag:
+                    tags.append(tag)
+            tags, _ = Vocabulary.get_mapped_tags(tags, configuration=self.configuration)
+            vocabulary_id = Vocabulary.get_approved_vocabulary(
+                configuration=self.configuration
+            )["id"]
+            mapped_tags = tuple(
+                {"name": tag, "vocabulary_id": vocabulary_id}
+                for tag in dict.fromkeys(tag.lower() for tag in tags)
+            )
+            self.mapped_tags[terms] = mapped_tags
+        return [dict(tag) for tag in mapped_tags]
+
+    @staticmethod
+    def get_links(entry):
+        """Get the urls of an entry's resources and showcase
+
+        Args:
+            entry (FeedEntry): Feed entry
+
+        Returns:
+            List[str]: Urls
+        """
+        links = (
+            entry.gdb_link,
+            entry.shp_link,
+            entry.kml_link,
+            entry.excel,
+            entry.wmap_link,
+            entry.pdf,
+            entry.image_link,
+        )
+        return [link for link in links if link]
+
+    def probe_links(self, entries):
+        """Probe the urls of entries concurrently if probe_links is set in the
+        configuration so that dead links are left out when generating datasets
+
+        Args:
+            entries (Iterable[FeedEntry]): Feed entries
+
+        Returns:
+            None
+        """
+        if self.prober is None:
+            return
+        with self.metrics.time("probe_links"):
+            self.prober.probe(
+                link for entry in entries for link in self.get_links(entry)
+            )
+        self.prober.save()
+
+    def is_dead(self, link):
+        """Check if a link was found to be dead when links were probed
+
+        Args:
+            link (str): Link
 
-    def parse_feed(self, previous_build_date):
-        url = self.configuration["url"]
-        rssfile = self.retriever.download_file(url, keep=True)
+        Returns:
+            bool: Whether the link is dead
+        """
+        if self.prober is None:
+            return False
+        result = self.prober.get(link)
+        return result is not None and self.prober.is_dead(result)
+
+    def check_entry(self, entry, log=True):
+        """Check that a dataset would be generated from an entry ie. it has
+        ISO3 codes and resource links that are not dead and, if claims is set,
+        its dataset name is not claimed by another feed. The name is claimed
+        if it is not.
+
+        Args:
+            entry (FeedEntry): Feed entry
+            log (bool): Whether to log why no dataset would be generated. Defaults to True.
+
+        Returns:
+            Optional[str]: Dataset name or None if no dataset would be generated
+        """
+        title = entry.title
+        if not entry.iso3:
+            if log:
+                logger.error(f"ISO3 is blank for {title}!")
+            return None
+        links = (entry.gdb_link, entry.shp_link, entry.kml_link, entry.excel)
+        if not any(link and not self.is_dead(link) for link in links):
+            if log:
+                logger.error(f"Dataset {title} has no resources!")
+            return None
+        name = self.get_name(title)
+        if self.claims is not None:
+            claimant = self.claims.setdefault(name, self.shard)
+            if claimant != self.shard:
+                if log:
+                    logger.info(
+                        f"Dataset {name} is published from feed {claimant}. Skipping!"
+                    )
+                    self.metrics.count("datasets_claimed_elsewhere")
+                return None
+        return name
+
+    def coalesce(self, entries, by_event=False):
+        """Drop entries that are superseded by a newer entry. An entry is
+        superseded if a newer one that generates a dataset would generate one
+        with the same name (which would overwrite it) or has any of the same
+        resource urls or, if by_event is True, has the same UNOSAT event code.
+        Entries are checked newest first so that an entry is only dropped in
+        favour of one that is kept.
+
+        Args:
+            entries (List[FeedEntry]): Feed entries oldest first
+            by_event (bool): Whether entries with the same event code supersede each other. Defaults to False.
+
+        Returns:
+            List[FeedEntry]: Entries that are not superseded oldest first
+        """
+        seen = set()
+        kept = []
+        for entry in reversed(entries):
+            keys = {("name", self.get_name(entry.title))}
+            for url in (entry.gdb_link, entry.shp_link, entry.kml_link, entry.excel):
+                if url:
+                    keys.add(("url", url))
+            event_code = entry.eventcode
+            if by_event and event_code and event_code.lower() != "none":
+                keys.add(("event", event_code))
+            if not keys.isdisjoint(seen):
+                logger.info(
+                    f"Entry {entry.title} published {entry.published} superseded by newer entry"
+                )
+                self.metrics.count("entries_superseded")
+                continue
+            kept.append(entry)
+            if self.check_entry(entry, log=False):
+                seen |= keys
+        kept.reverse()
+        return kept
+
+    def iterate_feed(self, previous_build_date, validators=None):
+        """Download the feed and return the last build date and an iterator
+        over entries newer than previous_build_date. If stream_feed is set in
+        the configuration, entries are parsed incrementally and parsing stops
+        at the first entry that is not new, otherwise the whole feed is parsed.
+
+        If validators from the previous run are given, the download is
+        conditional and if the feed has not changed, feed_unchanged is set and
+        no parsing is done. The validators to store for the next run are put in
+        feed_validators along with the build date they were stored for. They
+        are only used if that is still previous_build_date so that moving the
+        build date in the state back has the feed read again.
+
+        The time taken to download the feed and read its header and the time
+        taken to parse each entry are recorded in metrics.
+
+        Args:
+            previous_build_date (datetime): Date of the previous build
+            validators (Optional[Dict]): Feed validators from previous run. Defaults to None.
+
+        Returns:
+            Tuple[datetime, Iterator[FeedEntry]]: (last build date, iterator of entries)
+        """
+        self.feed_unchanged = False
+        self.feed_validators = {}
+        with self.metrics.time("read_feed"):
+            last_build_date, entries = self._read_feed(previous_build_date, validators)
+        if self.feed_validators:
+            self.feed_validators["build_date"] = last_build_date.isoformat()
+        entries = self.metrics.time_iterator("parse_entry", entries)
+        return last_build_date, entries
+
+    def fetch_feed(self, previous_build_date, validators=None):
+        """Download the feed and return its last build date and path so that
+        it can be read in chunks. Validators are handled as in iterate_feed.
+        The path is None if the feed has not changed or has not been built
+        since previous_build_date.
+
+        Args:
+            previous_build_date (datetime): Date of the previous build
+            validators (Optional[Dict]): Feed validators from previous run. Defaults to None.
+
+        Returns:
+            Tuple[datetime, Optional[str]]: (last build date, path to feed)
+        """
+        self.feed_unchanged = False
+        self.feed_validators = {}
+        with self.metrics.time("read_feed"):
+            rssfile = self._download_feed(previous_build_date, validators)
+            last_build_date = None
+            if rssfile is not None:
+                with StreamingFeed(rssfile, previous_build_date) as feed:
+                    last_build_date = feed.last_build_date
+        if last_build_date is None or last_build_date <= previous_build_date:
+            last_build_date = previous_build_date
+            rssfile = None
+        if self.feed_validators:
+            self.feed_validators["build_date"] = last_build_date.isoformat()
+        return last_build_date, rssfile
+
+    def _download_feed(self, previous_build_date, validators):
+        url = self.url
+        if validators is None:
+            rssfile = self.retriever.download_file(url, keep=True)
+        else:
+            if validators.get("build_date") != previous_build_date.isoformat():
+                # The state has been moved back (or validators are from an
+                # older version) so the feed is read whether it changed or not
+                validators = {}
+            rssfile, validators = download_feed(self.retriever, url, validators)
+            self.feed_validators = dict(validators)
+            if rssfile is None:
+                self.feed_unchanged = True
+                return None
+        self.metrics.add_bytes_downloaded(getsize(rssfile))
+        return rssfile
+
+    def _read_feed(self, previous_build_date, validators):
+        rssfile = self._download_feed(previous_build_date, validators)
+        if rssfile is None:
+            return previous_build_date, iter(())
+        if not self.configuration.get("stream_feed", False):
+            return self._parse_whole_feed(rssfile, previous_build_date)
+        feed = StreamingFeed(rssfile, previous_build_date)
+        last_build_date = feed.last_build_date
+        if last_build_date is None or last_build_date <= previous_build_date:
+            feed.close()
+            return previous_build_date, iter(())
+        return last_build_date, iter(feed)
+
+    def parse_feed(self, previous_build_date, validators=None):
+        last_build_date, entries = self.iterate_feed(previous_build_date, validators)
+        return last_build_date, list(entries)
+
+    @staticmethod
+    def _parse_whole_feed(rssfile, previous_build_date):
         feed = feedparser.parse(rssfile)
         last_build_date = parse_date(feed.feed.updated)
-        results = []
         if last_build_date <= previous_build_date:
-            return previous_build_date, results
-        for entry in feed.entries:
-            published = parse_date(entry.published)
-            if published > previous_build_date:
-                entry.published = published
-                results.append(entry)
-        return last_build_date, results
+            return previous_build_date, iter(())
+
+        def get_entries():
+            for entry in feed.entries:
+                published = parse_date(entry.published)
+                if published > previous_build_date:
+                    yield FeedEntry.from_parsed(entry, published)
+
+        return last_build_date, get_entries()
 
     def generate_dataset(
         self,
@@ -49,43 +391,29 @@ class Pipeline:
         """ """
         title = entry.title
         logger.info(f"Creating dataset: {title}")
-        slugified_name = slugify(title)
-        if len(slugified_name) > 90:
-            slugified_name = slugified_name.replace("satellite-detected-", "")
-            slugified_name = slugified_name.replace("estimation-of-", "")
-            slugified_name = slugified_name.replace("geodata-of-", "")[:90]
+        slugified_name = self.check_entry(entry)
+        if slugified_name is None:
+            return None, None
         event_code = entry.eventcode
         gdacs_eventid = entry.gdacs_eventid
         if gdacs_eventid and gdacs_eventid.lower() != "none":
             gdacs_id = f", GDACS ID: {gdacs_eventid}"
         else:
             gdacs_id = ""
-        summary = entry.summary
+        # ensure markdown has line breaks
+        summary = entry.summary.replace("\n", "  \n")
         notes = f"**UNOSAT code: {event_code}{gdacs_id}**  {summary}"
         dataset = Dataset(
             {
+                **self.template,
                 "name": slugified_name,
                 "title": title,
                 "notes": notes,
             }
         )
-        dataset.set_maintainer("83fa9515-3ba4-4f1d-9860-f38b20f80442")
-        dataset.set_organization("ba5aacba-0633-4364-9528-bc76a3f6cf95")
-        dataset.set_expected_update_frequency("Never")
-        dataset.set_subnational(True)
-        countryiso3 = entry.iso3
-        if not countryiso3:
-            logger.error(f"ISO3 is blank for {title}!")
-            return None, None
         for countryiso in entry.iso3.split(";"):
             dataset.add_country_location(countryiso)
-        tag_mapping = self.configuration["tag_mapping"]
-        tags = ["geodata"]
-        for tag in entry.tags:
-            tag = tag_mapping.get(tag.term)
-            if tag:
-                tags.append(tag)
-        dataset.add_tags(tags)
+        dataset["tags"] = self.get_tags(entry.tags)
         dataset.set_time_period(entry.published)
 
         def get_resource(link, file_format, description):
@@ -99,40 +427,42 @@ class Pipeline:
                 }
             )
             resource.set_date_data_updated(entry.published)
+            if self.prober is not None:
+                result = self.prober.get(link)
+                if result and result["size"] is not None:
+                    resource["size"] = result["size"]
             return resource
 
         resources = []
-        gdb_link = entry.gdb_link
-        if gdb_link:
-            resources.append(
-                get_resource(gdb_link, "Geodatabase", "Zipped geodatabase")
-            )
-        shp_link = entry.shp_link
-        if shp_link:
-            resources.append(get_resource(shp_link, "SHP", "Zipped shapefile"))
-        kml_link = entry.kml_link
-        if kml_link:
-            resources.append(get_resource(kml_link, "KML", "KML file"))
-        excel_link = entry.excel
-        if excel_link:
-            resources.append(get_resource(excel_link, "XLSX", "Excel file"))
-
-        if not resources:
-            logger.error(f"Dataset {title} has no resources!")
-            return None, None
+        for link, file_format, description in (
+            (entry.gdb_link, "Geodatabase", "Zipped geodatabase"),
+            (entry.shp_link, "SHP", "Zipped shapefile"),
+            (entry.kml_link, "KML", "KML file"),
+            (entry.excel, "XLSX", "Excel file"),
+        ):
+            if not link:
+                continue
+            if self.is_dead(link):
+                logger.error(f"Leaving out dead link {link}!")
+                continue
+            resources.append(get_resource(link, file_format, description))
         dataset.add_update_resources(resources)
 
         showcase_link = entry.wmap_link
         title = "WMap Link"
-        if not showcase_link:
+        if not showcase_link or self.is_dead(showcase_link):
+            if showcase_link:
+                logger.error(f"Leaving out dead link {showcase_link}!")
             showcase_link = entry.pdf
             title = "Static PDF Map"
-        if not showcase_link:
+        if not showcase_link or self.is_dead(showcase_link):
+            if showcase_link:
+                logger.error(f"Leaving out dead link {showcase_link}!")
             return dataset, None
-        image_link = None
-        for link in entry.links:
-            if "image" in link.type:
-                image_link = link.href
+        image_link = entry.image_link
+        if image_link and self.is_dead(image_link):
+            logger.error(f"Leaving out dead link {image_link}!")
+            image_link = None
         showcase = Showcase(
             {
                 "name": f"{slugified_name}-showcase",
@@ -142,6 +472,6 @@ class Pipeline:
                 "image_url": image_link,
             }
         )
-        showcase.add_tags(tags)
+        showcase["tags"] = self.get_tags(entry.tags)
 
         return dataset, showcase
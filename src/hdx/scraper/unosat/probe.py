@@ -0,0 +1,194 @@
+#!/usr/bin/python
+"""
+Link probing:
+------------
+
+Checks that the urls of resources and showcases respond before they are
+published so that broken links do not reach HDX. Urls are probed concurrently
+over one pooled session and the results are kept in a file so that a url that
+worked is never probed again.
+
+"""
+
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from os import fdopen, replace
+from os.path import abspath, basename, dirname, exists
+from tempfile import mkstemp
+from time import time
+
+from requests import RequestException
+
+from hdx.scraper.unosat.metrics import Metrics
+from hdx.utilities.session import get_session
+
+logger = logging.getLogger(__name__)
+
+
+def get_size(headers):
+    """Get the size of a file from the headers of a HEAD or range request
+
+    Args:
+        headers (Mapping): Response headers
+
+    Returns:
+        Optional[int]: Size in bytes or None if not known
+    """
+    content_range = headers.get("Content-Range")
+    if content_range:
+        # bytes 0-0/12345
+        total = content_range.rsplit("/", 1)[-1]
+        return int(total) if total.isdigit() else None
+    content_length = headers.get("Content-Length")
+    if content_length and content_length.isdigit():
+        return int(content_length)
+    return None
+
+
+class LinkProber:
+    """Probe urls with HEAD requests, falling back to a GET of the first byte
+    if HEAD is refused or gives no size. The status, size and Last-Modified
+    header of each url are kept in results which are read from and saved to
+    path. Urls that responded are not probed again. Urls that gave a client
+    error are dead and are probed again after retry_dead seconds. Urls that
+    could not be reached or gave a server error are not kept so that they are
+    probed again next time.
+
+    Args:
+        path (Optional[str]): Path to file of results. Defaults to None (not saved).
+        workers (int): Number of urls to probe at once. Defaults to 8.
+        timeout (float): Timeout of each request in seconds. Defaults to 30.
+        retry_dead (float): Seconds after which dead urls are probed again. Defaults to 86400.
+        metrics (Optional[Metrics]): Metrics to record in. Defaults to None.
+    """
+
+    def __init__(
+        self, path=None, workers=8, timeout=30, retry_dead=86400, metrics=None
+    ):
+        self.path = path
+        self.workers = workers
+        self.timeout = timeout
+        self.retry_dead = retry_dead
+        if metrics is None:
+            metrics = Metrics()
+        self.metrics = metrics
+        self.results = {}
+        if path and exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.results = json.load(f)
+        self.session = None
+
+    @staticmethod
+    def is_dead(result):
+        """Check if the result of probing a url is a client error ie. the url
+        is dead. Server and network errors are not taken to be dead.
+
+        Args:
+            result (Dict): Result with status, size and last_modified
+
+        Returns:
+            bool: Whether the url is dead
+        """
+        return 400 <= result["status"] < 500
+
+    def get(self, url):
+        """Get the result of probing a url
+
+        Args:
+            url (str): Url
+
+        Returns:
+            Optional[Dict]: Result with status, size and last_modified or None if not known
+        """
+        return self.results.get(url)
+
+    def needs_probe(self, url, now):
+        result = self.results.get(url)
+        if result is None:
+            return True
+        return self.is_dead(result) and now - result["checked"] >= self.retry_dead
+
+    def probe_url(self, url):
+        """Probe a url
+
+        Args:
+            url (str): Url
+
+        Returns:
+            Optional[Dict]: Result or None if the url could not be reached
+        """
+        try:
+            response = self.session.head(
+                url, allow_redirects=True, timeout=self.timeout
+            )
+            size = get_size(response.headers)
+            if response.status_code in (403, 405, 501) or (
+                response.ok and size is None
+            ):
+                response = self.session.get(
+                    url,
+                    headers={"Range": "bytes=0-0"},
+                    allow_redirects=True,
+                    stream=True,
+                    timeout=self.timeout,
+                )
+                response.close()
+                size = get_size(response.headers)
+        except RequestException as ex:
+            logger.warning(f"Could not probe {url}: {ex!r}")
+            return None
+        status = response.status_code
+        if status >= 500:
+            logger.warning(f"Could not probe {url}: status {status}")
+            return None
+        return {
+            "status": status,
+            "size": size,
+            "last_modified": response.headers.get("Last-Modified"),
+            "checked": int(time()),
+        }
+
+    def probe(self, urls):
+        """Probe urls that have not been probed or are dead and due to be
+        probed again
+
+        Args:
+            urls (Iterable[str]): Urls
+
+        Returns:
+            None
+        """
+        now = time()
+        to_probe = [url for url in dict.fromkeys(urls) if self.needs_probe(url, now)]
+        if not to_probe:
+            return
+        if self.session is None:
+            self.session = get_session(use_env=False, retry_attempts=2)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for url, result in zip(to_probe, executor.map(self.probe_url, to_probe)):
+                self.metrics.count("links_probed")
+                if result is None:
+                    self.metrics.count("links_unreachable")
+                    continue
+                self.results[url] = result
+                if self.is_dead(result):
+                    logger.error(f"Link {url} is dead: status {result['status']}")
+                    self.metrics.count("links_dead")
+
+    def save(self):
+        """Save results to path if given
+
+        Returns:
+            None
+        """
+        if not self.path:
+            return
+        fd, temp_path = mkstemp(
+            suffix=".tmp",
+            prefix=f"{basename(self.path)}.",
+            dir=dirname(abspath(self.path)),
+        )
+        with fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(self.results, f)
+        replace(temp_path, self.path)
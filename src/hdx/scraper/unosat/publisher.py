@@ -0,0 +1,408 @@
+#!/usr/bin/python
+"""
+Publisher:
+---------
+
+Publishes generated datasets and showcases to HDX using a pool of threads. All
+HDX API calls go through a token bucket so that the run stays within the HDX
+call budget. Datasets whose content has not changed since they were last
+published are skipped.
+
+"""
+
+import hashlib
+import json
+import logging
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from os.path import join
+from threading import Lock
+from time import monotonic, sleep
+
+from hdx.scraper.unosat.index import HDXIndex
+from hdx.scraper.unosat.metrics import Metrics
+from hdx.utilities.path import progress_storing_folder
+from hdx.utilities.saver import save_text
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Thread safe token bucket. Up to capacity calls can be made in a burst
+    after which calls are allowed at a rate of calls per period seconds. The
+    total time callers have spent waiting for tokens is kept in waited.
+
+    Args:
+        calls (int): Number of calls allowed per period
+        period (float): Period in seconds
+        capacity (Optional[int]): Maximum burst size. Defaults to calls.
+    """
+
+    def __init__(self, calls, period, capacity=None):
+        self.rate = calls / period
+        self.capacity = capacity or calls
+        self.tokens = self.capacity
+        self.updated = monotonic()
+        self.waited = 0.0
+        self.lock = Lock()
+
+    def acquire(self):
+        """Take a token, waiting until one is available
+
+        Returns:
+            None
+        """
+        while True:
+            with self.lock:
+                now = monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+                self.waited += wait
+            sleep(wait)
+
+
+def get_call_budget(configuration, backfill=False):
+    """Get the number of HDX calls allowed per period. If budget_fraction is
+    set under backfill, the backfill gets that fraction of hdx_calls in
+    publishing and other runs the rest so that a backfill can run alongside
+    them without going over. Otherwise each gets all of hdx_calls.
+
+    Args:
+        configuration (Configuration): HDX configuration
+        backfill (bool): Whether the budget is for a backfill. Defaults to False.
+
+    Returns:
+        float: Number of HDX calls allowed per period
+    """
+    calls = configuration.get("publishing", {}).get("hdx_calls", 100)
+    fraction = configuration.get("backfill", {}).get("budget_fraction")
+    if fraction is None:
+        return calls
+    if not backfill:
+        fraction = 1 - fraction
+    return max(1, calls * fraction)
+
+
+def limit_hdx_calls(configuration, bucket):
+    """Make every HDX API call made with the given configuration take a token
+    from the bucket first
+
+    Args:
+        configuration (Configuration): HDX configuration
+        bucket (TokenBucket): Token bucket
+
+    Returns:
+        None
+    """
+    call_remoteckan = configuration.call_remoteckan
+
+    def limited_call_remoteckan(*args, **kwargs):
+        bucket.acquire()
+        return call_remoteckan(*args, **kwargs)
+
+    configuration.call_remoteckan = limited_call_remoteckan
+
+
+def get_fingerprint(dataset, showcase):
+    """Get a stable hash of a dataset, its resources and its showcase
+
+    Args:
+        dataset (Dataset): Dataset
+        showcase (Optional[Showcase]): Showcase
+
+    Returns:
+        str: Fingerprint
+    """
+    content = {
+        "dataset": dataset.data,
+        "resources": [resource.data for resource in dataset.get_resources()],
+        "showcase": showcase.data if showcase else None,
+    }
+    text = json.dumps(content, sort_keys=True, default=str)
+    return hashlib.md5(text.encode("utf-8")).hexdigest()
+
+
+class Publisher:
+    """Publish datasets and showcases to HDX concurrently. Progress is stored
+    in the same way as progress_storing_folder, but the progress file always
+    points at the oldest entry that is not yet published so that a resumed run
+    does not skip entries that were in flight when the run stopped.
+
+    The fingerprints dictionary maps dataset names to the fingerprint of what
+    was last published successfully. It is updated as datasets are published,
+    keeping only the max_fingerprints most recently published so that the
+    state does not grow with every dataset ever published. A dataset whose
+    fingerprint has been dropped is published again if it comes up.
+
+    If prefetch is set in the publishing configuration, an index of the
+    datasets about to be published and their showcases is built before
+    publishing so that HDX does not need to be read for each entry.
+
+    If dead letters are given to run, an entry that fails is added to them and
+    publishing carries on unless max_failures entries fail in a row, in which
+    case HDX is taken to be down and the run stops.
+
+    If pace is given, a token is taken from it before each dataset is
+    published so that datasets are published at its rate at most. Entries
+    that are left out or unchanged do not take a token.
+
+    The time taken by each step of generating and publishing is recorded in
+    metrics. If a catalogue is given, the outcome of each entry is recorded in
+    it as the entry finishes.
+
+    Args:
+        configuration (Configuration): HDX configuration
+        info (Dict): Dictionary containing folder and batch
+        updated_by_script (str): String to identify the script
+        fingerprints (Optional[Dict]): Fingerprints of published datasets. Defaults to None.
+        metrics (Optional[Metrics]): Metrics to record in. Defaults to None.
+        catalogue (Optional[Catalogue]): Catalogue to record entries in. Defaults to None.
+        bucket (Optional[TokenBucket]): Token bucket to share. Defaults to one made from the call budget of scheduled runs.
+        pace (Optional[TokenBucket]): Token bucket limiting datasets published. Defaults to None (no limit).
+    """
+
+    def __init__(
+        self,
+        configuration,
+        info,
+        updated_by_script,
+        fingerprints=None,
+        metrics=None,
+        catalogue=None,
+        bucket=None,
+        pace=None,
+    ):
+        self.configuration = configuration
+        self.info = info
+        self.updated_by_script = updated_by_script
+        if fingerprints is None:
+            fingerprints = {}
+        self.fingerprints = fingerprints
+        if metrics is None:
+            metrics = Metrics()
+        self.metrics = metrics
+        self.catalogue = catalogue
+        self.index = None
+        self.last_done = None
+        publishing = configuration.get("publishing", {})
+        self.workers = publishing.get("workers", 1)
+        self.max_failures = publishing.get("max_failures", 5)
+        self.max_fingerprints = publishing.get("max_fingerprints", 10000)
+        if bucket is None:
+            bucket = TokenBucket(
+                get_call_budget(configuration), publishing.get("period", 1800)
+            )
+        self.bucket = bucket
+        limit_hdx_calls(configuration, bucket)
+        self.pace = pace
+        self.prefetch = publishing.get("prefetch", False)
+
+    def build_index(self, organisation, names):
+        """Build index of the datasets with the given names in the
+        organisation and their showcases in HDX and use it to answer HDX reads.
+        If the index has already been built, the names are added to it.
+
+        Args:
+            organisation (str): Organisation id
+            names (Iterable[str]): Names of datasets about to be published
+
+        Returns:
+            None
+        """
+        if self.index is None:
+            self.index = HDXIndex(self.configuration, organisation, self.fingerprints)
+            self.index.install()
+        with self.metrics.time("build_index"):
+            self.index.build(names)
+
+    def publish(self, dataset, showcase):
+        """Create or update dataset and showcase in HDX
+
+        Args:
+            dataset (Dataset): Dataset to publish
+            showcase (Optional[Showcase]): Showcase to publish
+
+        Returns:
+            None
+        """
+        if self.pace is not None:
+            self.pace.acquire()
+        with self.metrics.time("publish"):
+            with self.metrics.time("create_in_hdx"):
+                dataset.create_in_hdx(
+                    remove_additional_resources=True,
+                    hxl_update=False,
+                    updated_by_script=self.updated_by_script,
+                    batch=self.info["batch"],
+                )
+            if not showcase:
+                return
+            with self.metrics.time("showcase_create_in_hdx"):
+                showcase.create_in_hdx()
+            with self.metrics.time("showcase_add_dataset"):
+                showcase.add_dataset(dataset)
+
+    def _remember(self, name, fingerprint):
+        # The most recently published are kept at the end
+        self.fingerprints.pop(name, None)
+        self.fingerprints[name] = fingerprint
+        while len(self.fingerprints) > self.max_fingerprints:
+            del self.fingerprints[next(iter(self.fingerprints))]
+
+    def _record(self, entry, outcome, name, error=None):
+        if self.catalogue is not None:
+            self.catalogue.record(entry, outcome, name, error)
+
+    def _save_progress(self, title):
+        output = f"title={title}"
+        self.info["progress"] = output
+        save_text(output, join(self.info["folder"], "progress.txt"))
+
+    def _start(self, executor, entry, generate, dead_letters, publishing):
+        """Generate dataset for entry and start publishing it if it has changed.
+        If an older entry for the same dataset is still publishing, it is
+        waited for first so that the newer content lands last.
+
+        Returns:
+            Tuple: (entry, dataset name, fingerprint, future or None if not published)
+        """
+        self.metrics.count("entries")
+        try:
+            with self.metrics.time("generate_dataset"):
+                dataset, showcase = generate(entry)
+        except Exception as ex:
+            if dead_letters is None:
+                raise
+            future = Future()
+            future.set_exception(ex)
+            return entry, None, None, future
+        if not dataset:
+            return entry, None, None, None
+        name = dataset["name"]
+        fingerprint = get_fingerprint(dataset, showcase)
+        if self.fingerprints.get(name) == fingerprint:
+            logger.info(f"Dataset {name} unchanged. Skipping!")
+            self.metrics.count("datasets_unchanged")
+            return entry, name, fingerprint, None
+        if self.index is not None:
+            self.index.expect(name)
+        previous = publishing.get(name)
+        if previous is not None:
+            wait([previous])
+        future = executor.submit(self.publish, dataset, showcase)
+        publishing[name] = future
+        return entry, name, fingerprint, future
+
+    def run(self, entries, generate, dead_letters=None):
+        """Generate datasets from entries in the calling thread and publish
+        them in a pool of threads. Datasets whose fingerprint matches the one
+        last published are skipped.
+
+        If publishing an entry fails and dead_letters is None, the exception
+        is raised once in flight entries have finished. Otherwise, the entry is
+        added to dead_letters and the next entry is published unless
+        max_failures entries have failed in a row in which case the exception
+        is raised. Entries that are published or skipped are removed from
+        dead_letters. Entries that dead_letters gives up on are recorded as
+        abandoned.
+
+        Entries are finished in order. The last entry that finished (by being
+        published, skipped or added to dead letters) is kept in last_done. The
+        progress file points at the first entry that failed if there is one.
+        Entries for the same dataset are never published at the same time.
+
+        Args:
+            entries (Iterable): Feed entries
+            generate (Callable): Function taking an entry returning (dataset, showcase)
+            dead_letters (Optional[DeadLetterQueue]): Queue for failed entries. Defaults to None.
+
+        Returns:
+            int: Number of datasets published
+        """
+        in_flight = deque()
+        # Dataset names to the future publishing them
+        publishing = {}
+        published = 0
+        failures = 0
+        first_failed = None
+        self.last_done = None
+
+        def save_progress():
+            # Entries that failed in this run are not yet published either
+            if first_failed:
+                self._save_progress(first_failed)
+            elif in_flight:
+                self._save_progress(in_flight[0][0].title)
+
+        def finish_oldest():
+            nonlocal published, failures, first_failed
+            entry, name, fingerprint, future = in_flight[0]
+            save_progress()
+            if future is not None and publishing.get(name) is future:
+                del publishing[name]
+            try:
+                if future is not None:
+                    future.result()
+            except Exception as ex:
+                if dead_letters is None:
+                    self._record(entry, "failed", name, ex)
+                    raise
+                in_flight.popleft()
+                self.last_done = entry
+                if dead_letters.add(entry, ex):
+                    self._record(entry, "failed", name, ex)
+                else:
+                    self._record(entry, "abandoned", name, ex)
+                    self.metrics.count("datasets_abandoned")
+                if first_failed is None:
+                    first_failed = entry.title
+                self.metrics.count("datasets_failed")
+                failures += 1
+                if failures >= self.max_failures:
+                    logger.error(f"{failures} entries failed in a row. Stopping!")
+                    raise
+                return
+            in_flight.popleft()
+            self.last_done = entry
+            if dead_letters is not None:
+                dead_letters.remove(entry.title)
+            if future is None:
+                self._record(entry, "unchanged" if name else "skipped", name)
+                return
+            self._record(entry, "published", name)
+            failures = 0
+            self._remember(name, fingerprint)
+            published += 1
+            self.metrics.count("datasets_published")
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for _, entry in progress_storing_folder(self.info, entries, "title"):
+                    # progress_storing_folder has saved this entry, but older
+                    # ones may still be publishing while it is generated
+                    save_progress()
+                    in_flight.append(
+                        self._start(executor, entry, generate, dead_letters, publishing)
+                    )
+                    while in_flight and (
+                        len(in_flight) > self.workers
+                        or in_flight[0][-1] is None
+                        or in_flight[0][-1].done()
+                    ):
+                        finish_oldest()
+                    save_progress()
+                while in_flight:
+                    finish_oldest()
+        finally:
+            self.metrics.set_value(
+                "rate_limit_wait_seconds", round(self.bucket.waited, 6)
+            )
+            if self.pace is not None:
+                self.metrics.set_value("pace_wait_seconds", round(self.pace.waited, 6))
+        return published
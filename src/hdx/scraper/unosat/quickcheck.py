@@ -0,0 +1,198 @@
+#!/usr/bin/python
+"""
+Quick check:
+-----------
+
+Fast check on startup of whether there is anything to do. Most scheduled runs
+find that the feed has not changed, so before the HDX libraries are imported,
+the state is read from its HDX dataset and the feed is requested conditionally
+and only read as far as its lastBuildDate which is compared with the state.
+Only the standard library, YAML and date parsing are used here so that a run
+with nothing to do finishes quickly.
+
+"""
+
+import json
+import logging
+import os
+from importlib.util import find_spec
+from os.path import exists, expanduser, join
+from time import time
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+from xml.etree.ElementTree import iterparse
+
+from ruamel.yaml import YAML
+
+from hdx.utilities.dateparse import parse_date
+
+logger = logging.getLogger(__name__)
+
+
+def load_yaml(path):
+    """Load a YAML file without the HDX utilities loader which is slow to
+    import
+
+    Args:
+        path (str): Path to YAML file
+
+    Returns:
+        Dict: Contents of file
+    """
+    with open(path, encoding="utf-8") as f:
+        return YAML(typ="safe").load(f) or {}
+
+
+def get_hdx_site(argv, project_configuration, hdx_config_yaml=None):
+    """Get the HDX url and key in the same way as the HDX configuration does,
+    from the command line, then the environment, then the HDX and project
+    configuration files
+
+    Args:
+        argv (List[str]): Command line arguments
+        project_configuration (Dict): Project configuration
+        hdx_config_yaml (Optional[str]): Path to HDX configuration. Defaults to ~/.hdx_configuration.yaml.
+
+    Returns:
+        Tuple[str, Optional[str]]: (HDX url, HDX key or None if there is none)
+    """
+    arguments = {}
+    for index, argument in enumerate(argv):
+        if not argument.startswith("--hdx-"):
+            continue
+        name, _, value = argument[2:].partition("=")
+        if not value and index + 1 < len(argv):
+            value = argv[index + 1]
+        arguments[name.replace("-", "_")] = value
+    if hdx_config_yaml is None:
+        hdx_config_yaml = join(expanduser("~"), ".hdx_configuration.yaml")
+    hdx_config_yaml = arguments.get("hdx_config_yaml", hdx_config_yaml)
+    data = load_yaml(hdx_config_yaml) if exists(hdx_config_yaml) else {}
+    data.update(project_configuration)
+
+    def get(name):
+        return arguments.get(name) or os.getenv(name.upper()) or data.get(name)
+
+    hdx_url = get("hdx_url")
+    hdx_key = None
+    if hdx_url:
+        hdx_url = hdx_url.rstrip("/")
+    else:
+        hdx_site = get("hdx_site") or "stage"
+        # Read from the HDX library's files without importing it
+        folder = find_spec("hdx.api").submodule_search_locations[0]
+        base = load_yaml(join(folder, "hdx_base_configuration.yaml"))
+        hdx_url = base[f"hdx_{hdx_site}_site"]["url"]
+        hdx_key = get(f"hdx_key_{hdx_site}")
+    return hdx_url, hdx_key or get("hdx_key")
+
+
+def read_hdx_state(hdx_url, dataset_name, user_agent, hdx_key=None, timeout=60):
+    """Read the state written by PipelineState from its HDX dataset
+
+    Args:
+        hdx_url (str): HDX url
+        dataset_name (str): Name of state dataset
+        user_agent (str): User agent to send
+        hdx_key (Optional[str]): HDX key. Defaults to None.
+        timeout (float): Timeout in seconds. Defaults to 60.
+
+    Returns:
+        Dict: State dictionary
+    """
+    headers = {"User-Agent": user_agent}
+    if hdx_key:
+        headers["Authorization"] = hdx_key
+    request = Request(
+        f"{hdx_url}/api/action/package_show",
+        json.dumps({"id": dataset_name}).encode("utf-8"),
+        dict(headers, **{"Content-Type": "application/json"}),
+    )
+    with urlopen(request, timeout=timeout) as response:
+        dataset = json.load(response)["result"]
+    url = dataset["resources"][0]["url"]
+    with urlopen(Request(url, headers=headers), timeout=timeout) as response:
+        text = response.read().decode("utf-8").strip()
+    if text.startswith("{"):
+        state = json.loads(text)
+    else:
+        state = {"last_build_date": text}
+    state["last_build_date"] = parse_date(state["last_build_date"])
+    state.setdefault("feed", {})
+    state.setdefault("dead_letters", {})
+    return state
+
+
+def read_last_build_date(fileobj):
+    """Read the channel's lastBuildDate from the start of an RSS feed stopping
+    as soon as it is found. If the channel has no lastBuildDate, the date of
+    the first item is used as is done when the whole feed is read.
+
+    Args:
+        fileobj (IO): File like object to read from
+
+    Returns:
+        Optional[datetime]: Last build date or None if not found
+    """
+    in_item = False
+    for event, element in iterparse(fileobj, events=("start", "end")):
+        if event == "start":
+            if element.tag == "item":
+                in_item = True
+        elif element.tag == "lastBuildDate" and not in_item:
+            return parse_date(element.text.strip())
+        elif element.tag == "pubDate" and in_item:
+            return parse_date(element.text.strip())
+    return None
+
+
+def feed_unchanged(url, state, user_agent, timeout=60):
+    """Check if the feed has changed since the state was saved. The feed is
+    requested with the ETag and Last-Modified validators of the
+    previous run if they were stored for the build date in the state. If the
+    server does not reply 304 Not Modified, the feed is read only as far as
+    its lastBuildDate. The feed is taken to have changed if any failed entries
+    are due to be retried.
+
+    Args:
+        url (str): Feed url
+        state (Dict): State read from HDX
+        user_agent (str): User agent to send
+        timeout (float): Timeout in seconds. Defaults to 60.
+
+    Returns:
+        bool: True if the feed is unchanged, False if it may have changed
+    """
+    now = time()
+    for title, letter in state.get("dead_letters", {}).items():
+        if letter["retry_after"] <= now:
+            logger.info(f"Dead letter {title} is due for a retry")
+            return False
+    headers = {"User-Agent": user_agent}
+    validators = state["feed"]
+    if validators.get("build_date") != state["last_build_date"].isoformat():
+        # The state has been moved back since the validators were stored
+        validators = {}
+    etag = validators.get("etag")
+    if etag:
+        headers["If-None-Match"] = etag
+    last_modified = validators.get("last_modified")
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    try:
+        with urlopen(Request(url, headers=headers), timeout=timeout) as response:
+            last_build_date = read_last_build_date(response)
+    except HTTPError as ex:
+        if ex.code == 304:
+            logger.info(f"Feed {url} not modified since {last_modified}")
+            return True
+        raise
+    if last_build_date is None:
+        return False
+    previous_build_date = state["last_build_date"]
+    if last_build_date <= previous_build_date:
+        logger.info(
+            f"Feed {url} last built {last_build_date} which is not after {previous_build_date}"
+        )
+        return True
+    return False
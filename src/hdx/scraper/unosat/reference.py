@@ -0,0 +1,213 @@
+#!/usr/bin/python
+"""
+Reference data:
+--------------
+
+HDX reference data used when generating datasets: the valid locations, the
+approved tag vocabulary, the tags cleanup mapping and the OCHA countries data.
+These change rarely but are otherwise downloaded by every run, so they are
+cached on disk and only downloaded again once they are older than a time to
+live.
+
+"""
+
+import json
+import logging
+from os import fdopen, makedirs, remove, replace
+from os.path import exists, getmtime, join
+from tempfile import mkstemp
+from time import time
+
+import hxl
+from hxl.input import InputOptions
+
+from hdx.api.locations import Locations
+from hdx.data.vocabulary import Vocabulary
+from hdx.location.country import Country
+from hdx.utilities.downloader import Download
+from hdx.utilities.path import get_temp_dir
+
+logger = logging.getLogger(__name__)
+
+
+class ReferenceCache:
+    """On disk cache of HDX reference data. Each item is kept in its own file
+    in folder and is downloaded again if the file is older than ttl seconds or
+    has been invalidated. If downloading fails, an expired file is used rather
+    than failing the run. Loading sets the data in the HDX libraries so that it
+    is shared by every dataset that is generated.
+
+    Args:
+        configuration (Configuration): HDX configuration
+        folder (Optional[str]): Folder for cache files. Defaults to a folder in the temp folder.
+        ttl (float): Seconds before data is downloaded again. Defaults to 86400.
+    """
+
+    names = ("locations", "vocabulary", "tags_mapping", "countries")
+
+    def __init__(self, configuration, folder=None, ttl=86400):
+        self.configuration = configuration
+        if folder is None:
+            folder = get_temp_dir("hdx-scraper-unosat-reference")
+        makedirs(folder, exist_ok=True)
+        self.folder = folder
+        self.ttl = ttl
+        self.loaded = {}
+
+    def get_path(self, name):
+        if name == "countries":
+            return join(self.folder, "countries.csv")
+        return join(self.folder, f"{name}.json")
+
+    def is_fresh(self, name, now=None):
+        """Check if the cache file for an item exists and has not expired
+
+        Args:
+            name (str): Name of item
+            now (Optional[float]): Time now in seconds since the epoch. Defaults to time().
+
+        Returns:
+            bool: True if the cache file can be used
+        """
+        if now is None:
+            now = time()
+        path = self.get_path(name)
+        if not exists(path):
+            return False
+        return now - getmtime(path) < self.ttl
+
+    def invalidate(self, names=None):
+        """Delete cache files so that the data is downloaded when next loaded
+
+        Args:
+            names (Optional[ListTuple[str]]): Names of items. Defaults to all items.
+
+        Returns:
+            None
+        """
+        if names is None:
+            names = self.names
+        for name in names:
+            path = self.get_path(name)
+            if exists(path):
+                remove(path)
+                logger.info(f"Invalidated cached {name} in {path}")
+            self.loaded.pop(name, None)
+
+    def _save(self, name, write):
+        path = self.get_path(name)
+        # A unique temporary file as feeds run in parallel share the folder
+        fd, temp_path = mkstemp(suffix=".tmp", prefix=f"{name}.", dir=self.folder)
+        with fdopen(fd, "w", encoding="utf-8") as f:
+            write(f)
+        replace(temp_path, path)
+
+    def _download_locations(self):
+        return self.configuration.call_remoteckan("group_list", {"all_fields": True})
+
+    def _download_vocabulary(self):
+        vocabulary = Vocabulary.read_from_hdx(
+            self.configuration["approved_tags_vocabulary"],
+            configuration=self.configuration,
+        )
+        return vocabulary.data
+
+    def _download_tags_mapping(self):
+        with Download(
+            full_agent=self.configuration.get_user_agent(), use_env=False
+        ) as downloader:
+            return downloader.download_tabular_rows_as_dicts(
+                self.configuration["tags_mapping_url"], keycolumn=1
+            )
+
+    def _download_countries(self):
+        with Download(
+            full_agent=self.configuration.get_user_agent(), use_env=False
+        ) as downloader:
+            return downloader.download_text(Country._ochaurl)
+
+    def get(self, name):
+        """Get an item from the cache file if it is fresh, otherwise download
+        it and save it to the cache file. If the download fails and there is
+        an expired cache file, it is used instead.
+
+        Args:
+            name (str): Name of item
+
+        Returns:
+            Union[Dict, List, str]: Data (text for countries)
+        """
+        path = self.get_path(name)
+        if not self.is_fresh(name):
+            download = getattr(self, f"_download_{name}")
+            try:
+                data = download()
+            except Exception:
+                if not exists(path):
+                    raise
+                logger.exception(f"Download of {name} failed! Using expired {path}.")
+            else:
+                if name == "countries":
+                    self._save(name, lambda f: f.write(data))
+                else:
+                    self._save(name, lambda f: json.dump(data, f))
+                logger.info(f"Downloaded {name} to {path}")
+                return data
+        with open(path, encoding="utf-8") as f:
+            if name == "countries":
+                return f.read()
+            return json.load(f)
+
+    def load(self):
+        """Load any items that have not been loaded or have expired since they
+        were loaded and set them in the HDX libraries. This can be called
+        before every run of a long running process.
+
+        Returns:
+            bool: True if any items were loaded
+        """
+        now = time()
+        loaded_any = False
+        for name in self.names:
+            loaded = self.loaded.get(name)
+            if loaded is not None and now - loaded < self.ttl:
+                continue
+            data = self.get(name)
+            logger.info(f"Loaded {name}")
+            if name == "locations":
+                Locations.set_validlocations(data)
+            elif name == "vocabulary":
+                Vocabulary._approved_vocabulary = Vocabulary(
+                    data, configuration=self.configuration
+                )
+            elif name == "tags_mapping":
+                Vocabulary.set_tagsdict(data)
+            else:
+                countries = hxl.data(
+                    self.get_path(name),
+                    InputOptions(allow_local=True, encoding="utf-8"),
+                )
+                Country.set_countriesdata(countries)
+            self.loaded[name] = now
+            loaded_any = True
+        return loaded_any
+
+
+def get_reference_cache(configuration):
+    """Get the reference data cache set under reference_data in the
+    configuration
+
+    Args:
+        configuration (Configuration): HDX configuration
+
+    Returns:
+        Optional[ReferenceCache]: Reference data cache or None if not configured
+    """
+    reference_configuration = configuration.get("reference_data")
+    if not reference_configuration:
+        return None
+    return ReferenceCache(
+        configuration,
+        reference_configuration.get("folder"),
+        reference_configuration.get("ttl", 86400),
+    )
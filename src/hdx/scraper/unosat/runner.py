@@ -0,0 +1,351 @@
+#!/usr/bin/python
+"""
+Runner:
+------
+
+Publishes the new entries in the feed in chunks, retries the entries that
+failed before and advances the state. It is used once per run in batch mode and once per poll
+in watch mode, where the same runner is kept so that the HDX call budget, index
+and write access check carry over from poll to poll.
+
+"""
+
+import logging
+from heapq import heappop, heappush
+from itertools import chain
+from os import remove
+from os.path import exists, join
+
+from hdx.data.user import User
+from hdx.scraper.unosat.deadletter import DeadLetterQueue
+from hdx.scraper.unosat.feed import StreamingFeed
+from hdx.scraper.unosat.publisher import Publisher
+
+logger = logging.getLogger(__name__)
+
+
+class Runner:
+    """Publish new entries from the feed read by pipeline. The publisher is
+    only created, after checking write access to the organisation, once there
+    is something to publish. If reference is given, the HDX reference data is
+    loaded from it then too. If catalogue is given, every entry processed is
+    recorded in it.
+
+    Args:
+        configuration (Configuration): HDX configuration
+        pipeline (Pipeline): Pipeline to read feed and generate datasets with
+        state (PipelineState): State of the scraper
+        metrics (Metrics): Metrics to record in
+        organisation (str): Organisation id
+        updated_by_script (str): String to identify the script
+        reference (Optional[ReferenceCache]): Cache of HDX reference data. Defaults to None.
+        catalogue (Optional[Catalogue]): Catalogue of processed entries. Defaults to None.
+        bucket (Optional[TokenBucket]): Token bucket for HDX calls. Defaults to None (publisher's own).
+    """
+
+    def __init__(
+        self,
+        configuration,
+        pipeline,
+        state,
+        metrics,
+        organisation,
+        updated_by_script,
+        reference=None,
+        catalogue=None,
+        bucket=None,
+    ):
+        self.configuration = configuration
+        self.pipeline = pipeline
+        self.state = state
+        self.metrics = metrics
+        self.organisation = organisation
+        self.updated_by_script = updated_by_script
+        self.reference = reference
+        self.catalogue = catalogue
+        self.bucket = bucket
+        self.chunk_size = configuration.get("publishing", {}).get("chunk_size", 100)
+        # Token bucket limiting datasets published, set by subclasses
+        self.pace = None
+        self.publisher = None
+
+    def get_publisher(self, info, fingerprints, entries):
+        """Get the publisher creating it on first use and add the datasets of
+        entries to its index if prefetch is set. The fingerprints are only used
+        when the publisher is created as the state keeps the same dictionary
+        from run to run.
+
+        Args:
+            info (Dict): Dictionary containing folder and batch
+            fingerprints (Dict): Fingerprints of published datasets
+            entries (Iterable[FeedEntry]): Entries about to be published
+
+        Returns:
+            Publisher: Publisher
+        """
+        if self.publisher is None:
+            User.check_current_user_write_access(
+                self.organisation, configuration=self.configuration
+            )
+            self.publisher = Publisher(
+                self.configuration,
+                info,
+                self.updated_by_script,
+                fingerprints,
+                self.metrics,
+                self.catalogue,
+                self.bucket,
+                self.pace,
+            )
+        else:
+            self.publisher.info = info
+        if self.publisher.prefetch:
+            names = (self.pipeline.get_name(entry.title) for entry in entries)
+            self.publisher.build_index(self.organisation, names)
+        return self.publisher
+
+    @staticmethod
+    def get_contiguous_build_date(entries, last_done, previous_build_date):
+        """Get the newest date up to which all entries have finished
+
+        Args:
+            entries (List[FeedEntry]): New entries oldest first
+            last_done (Optional[FeedEntry]): Last entry that finished
+            previous_build_date (datetime): Date of the previous build
+
+        Returns:
+            datetime: Build date to store in state
+        """
+        index = None
+        for i, entry in enumerate(entries):
+            if entry is last_done:
+                index = i
+                break
+        if index is None:
+            return previous_build_date
+        published = entries[index].published
+        # Entries published at the same time as an unfinished one must be kept
+        if index + 1 < len(entries) and entries[index + 1].published == published:
+            while index >= 0 and entries[index].published == published:
+                index -= 1
+            if index < 0:
+                return previous_build_date
+        return entries[index].published
+
+    @staticmethod
+    def get_chunk(path, checkpoint, until, size):
+        """Get the oldest size entries in the feed published after checkpoint
+        and not after until. Entries published at the same time are kept in the
+        same chunk so a chunk can be bigger than size. The feed is read once,
+        stopping at checkpoint, keeping only the oldest entries found so far.
+
+        Args:
+            path (str): Path to feed
+            checkpoint (datetime): Date after which to get entries
+            until (datetime): Date up to which to get entries
+            size (int): Number of entries to get
+
+        Returns:
+            Tuple[int, List[FeedEntry]]: (number of entries left, chunk oldest first)
+        """
+        remaining = 0
+        # Negated timestamps so that the newest kept is at the top of the heap
+        # with the position in the feed to break ties
+        oldest = []
+        with StreamingFeed(path, checkpoint) as feed:
+            for position, entry in enumerate(feed):
+                if entry.published > until:
+                    continue
+                remaining += 1
+                heappush(oldest, (-entry.published.timestamp(), position, entry))
+                # Drop the newest entries, those published at the same time
+                # together, as long as enough are left to fill the chunk
+                while len(oldest) > size:
+                    newest = [heappop(oldest)]
+                    while oldest and oldest[0][0] == newest[0][0]:
+                        newest.append(heappop(oldest))
+                    if len(oldest) < size:
+                        for item in newest:
+                            heappush(oldest, item)
+                        break
+        oldest.sort(key=lambda item: (-item[0], item[1]))
+        return remaining, [entry for _, _, entry in oldest]
+
+    def get_new_entries(self, previous_build_date, validators):
+        """Read the entries that are new since previous_build_date in chunks
+        of chunk_size entries oldest first. The feed is read again for each
+        chunk so that only one chunk is held in memory at a time and memory
+        use is bounded by the chunk size rather than the number of new
+        entries.
+
+        Args:
+            previous_build_date (datetime): Date of the previous build
+            validators (Optional[Dict]): Feed validators from previous run
+
+        Returns:
+            Tuple[datetime, Iterator[List[FeedEntry]]]: (last build date, iterator of chunks)
+        """
+        last_build_date, path = self.pipeline.fetch_feed(
+            previous_build_date, validators
+        )
+
+        def get_chunks():
+            checkpoint = previous_build_date
+            while path is not None:
+                with self.pipeline.metrics.time("read_chunk"):
+                    _, chunk = self.get_chunk(
+                        path, checkpoint, last_build_date, self.chunk_size
+                    )
+                if not chunk:
+                    return
+                yield chunk
+                checkpoint = chunk[-1].published
+
+        return last_build_date, get_chunks()
+
+    def get_dead_letters(self, state_dict):
+        """Get the queue of dead letters in the state
+
+        Args:
+            state_dict (Dict): State
+
+        Returns:
+            DeadLetterQueue: Dead letters
+        """
+        publishing = self.configuration.get("publishing", {})
+        return DeadLetterQueue(
+            state_dict["dead_letters"],
+            publishing.get("retry_delay", 600),
+            publishing.get("max_retry_delay", 86400),
+            publishing.get("max_attempts"),
+        )
+
+    def coalesce(self, retries, chunk, dead_letters):
+        """Drop retries and entries in chunk that are superseded by a newer
+        one if coalesce is set in the configuration. Retries are older than the
+        entries in chunk so they can be superseded by them. Retries that are
+        dropped are removed from dead letters.
+
+        Args:
+            retries (List[FeedEntry]): Dead letters to retry oldest first
+            chunk (List[FeedEntry]): New entries oldest first
+            dead_letters (DeadLetterQueue): Dead letters
+
+        Returns:
+            Tuple[List[FeedEntry], List[FeedEntry]]: (retries, chunk) that are kept
+        """
+        coalesce = self.configuration.get("coalesce")
+        if coalesce is None:
+            return retries, chunk
+        kept = self.pipeline.coalesce(retries + chunk, coalesce.get("by_event", False))
+        kept = {id(entry) for entry in kept}
+        for entry in retries:
+            if id(entry) not in kept:
+                dead_letters.remove(entry.title, "superseded")
+        retries = [entry for entry in retries if id(entry) in kept]
+        chunk = [entry for entry in chunk if id(entry) in kept]
+        return retries, chunk
+
+    def publish_chunk(self, info, state_dict, dead_letters, retries, chunk, checkpoint):
+        """Publish retries then the entries in chunk oldest first. If
+        publishing stops part way, the build date in the state is set to the
+        newest date up to which all entries in chunk have finished, or
+        checkpoint if there is none, and the exception is raised.
+
+        Args:
+            info (Dict): Dictionary containing folder and batch
+            state_dict (Dict): State
+            dead_letters (DeadLetterQueue): Dead letters
+            retries (List[FeedEntry]): Dead letters to retry oldest first
+            chunk (List[FeedEntry]): New entries oldest first
+            checkpoint (datetime): Date up to which entries have been published
+
+        Returns:
+            int: Number of datasets published
+        """
+        self.pipeline.probe_links(chain(retries, chunk))
+        # After probing so that entries with only dead links do not supersede
+        # older ones
+        retries, chunk = self.coalesce(retries, chunk, dead_letters)
+        publisher = self.get_publisher(
+            info, state_dict["fingerprints"], chain(retries, chunk)
+        )
+        try:
+            return publisher.run(
+                chain(retries, chunk), self.pipeline.generate_dataset, dead_letters
+            )
+        except Exception:
+            # Keep the old feed validators so that the feed is read again
+            state_dict["last_build_date"] = self.get_contiguous_build_date(
+                chunk, publisher.last_done, checkpoint
+            )
+            self.state.set(state_dict)
+            raise
+        finally:
+            # From here the state records where to carry on from. If it
+            # cannot be saved, the next run starts again from the old state.
+            progress_file = join(info["folder"], "progress.txt")
+            if exists(progress_file):
+                remove(progress_file)
+            info.pop("progress", None)
+
+    def run(self, info):
+        """Publish dead letters that are due for a retry and entries that are
+        new since the last build date in the state, oldest first in chunks,
+        and update the state. After each chunk that is not the last, the state
+        is saved so that a run that is stopped carries on from there. If
+        publishing stops part way through a chunk, the build date in the state
+        only advances to the newest entry up to which all entries have
+        finished. If coalesce is set in the configuration, retries and new
+        entries superseded by a newer entry in the same chunk are dropped.
+
+        Args:
+            info (Dict): Dictionary containing folder and batch
+
+        Returns:
+            Optional[int]: Number of datasets published or None if there is nothing to do
+        """
+        state_dict = self.state.get()
+        dead_letters = self.get_dead_letters(state_dict)
+        previous_build_date = state_dict["last_build_date"]
+        last_build_date, chunks = self.get_new_entries(
+            previous_build_date, state_dict["feed"]
+        )
+        retries = dead_letters.get_due()
+        if self.pipeline.feed_unchanged and not retries:
+            logger.info("Feed unchanged since last run. Nothing to do!")
+            return None
+        if retries:
+            logger.info(f"Retrying {len(retries)} dead letters")
+        published = 0
+        chunk = next(chunks, [])
+        if not chunk and not retries:
+            logger.info("No new entries in feed. Nothing to publish!")
+        else:
+            if self.reference is not None:
+                with self.metrics.time("load_reference"):
+                    if self.reference.load():
+                        # Tags are mapped again with the new reference data
+                        self.pipeline.mapped_tags = {}
+            checkpoint = previous_build_date
+            while True:
+                published += self.publish_chunk(
+                    info, state_dict, dead_letters, retries, chunk, checkpoint
+                )
+                retries = []
+                if not chunk:
+                    break
+                checkpoint = chunk[-1].published
+                chunk = next(chunks, [])
+                if not chunk:
+                    break
+                state_dict["last_build_date"] = checkpoint
+                self.state.set(state_dict)
+                self.state.write()
+            logger.info(f"Number of datasets published: {published}")
+        if dead_letters:
+            logger.warning(f"{len(dead_letters)} entries waiting to be retried")
+        state_dict["last_build_date"] = last_build_date
+        state_dict["feed"] = self.pipeline.feed_validators
+        self.state.set(state_dict)
+        return published
@@ -0,0 +1,267 @@
+#!/usr/bin/python
+"""
+Shards:
+------
+
+Reads several feeds at once, each in its own process with its own state and
+progress folder. The processes share one HDX call budget through a token
+bucket in shared memory and claim dataset names in a shared dictionary so that
+a product that appears in more than one feed is only published once per run.
+
+"""
+
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from os.path import join, splitext
+
+from hdx.api.configuration import Configuration
+from hdx.scraper.unosat.catalogue import get_catalogue
+from hdx.scraper.unosat.metrics import Metrics
+from hdx.scraper.unosat.pipeline import Pipeline
+from hdx.scraper.unosat.publisher import TokenBucket, get_call_budget
+from hdx.scraper.unosat.reference import get_reference_cache
+from hdx.scraper.unosat.runner import Runner
+from hdx.scraper.unosat.state import PipelineState
+from hdx.utilities.downloader import Download
+from hdx.utilities.path import wheretostart_tempdir_batch
+from hdx.utilities.retriever import Retrieve
+from hdx.utilities.useragent import UserAgent
+
+logger = logging.getLogger(__name__)
+
+# Set in each worker process by init_shard
+_shared = {}
+
+
+class SharedTokenBucket(TokenBucket):
+    """TokenBucket whose tokens are held in shared memory so that it limits
+    the calls made by all processes it is passed to when they are created.
+    The time waited is kept per process.
+
+    Args:
+        calls (int): Number of calls allowed per period
+        period (float): Period in seconds
+        capacity (Optional[int]): Maximum burst size. Defaults to calls.
+        context (Optional[BaseContext]): Multiprocessing context. Defaults to the default context.
+    """
+
+    def __init__(self, calls, period, capacity=None, context=None):
+        if context is None:
+            context = get_context()
+        self.shared = context.Array("d", 2)
+        super().__init__(calls, period, capacity)
+        self.lock = self.shared.get_lock()
+
+    @property
+    def tokens(self):
+        return self.shared[0]
+
+    @tokens.setter
+    def tokens(self, value):
+        self.shared[0] = value
+
+    @property
+    def updated(self):
+        return self.shared[1]
+
+    @updated.setter
+    def updated(self, value):
+        self.shared[1] = value
+
+
+def get_shard_path(path, name):
+    """Get the path of a file written by a feed by adding its name to path
+
+    Args:
+        path (Optional[str]): Path
+        name (str): Feed name
+
+    Returns:
+        Optional[str]: Path for feed or None if path is not given
+    """
+    if not path:
+        return None
+    root, extension = splitext(path)
+    return f"{root}_{name}{extension}"
+
+
+def get_shard_outputs(outputs, name):
+    """Get the metrics outputs of a feed by adding its name to the paths
+
+    Args:
+        outputs (Optional[Dict]): Paths with keys json and prometheus
+        name (str): Feed name
+
+    Returns:
+        Dict: Paths for feed
+    """
+    return {key: get_shard_path(path, name) for key, path in (outputs or {}).items()}
+
+
+def init_shard(configuration, user_agent, bucket, claims):
+    """Set up a worker process. HDX calls made with the configuration are
+    wrapped for each feed run, so the unwrapped call is kept to be restored
+    for the next feed as a worker can run several.
+
+    Args:
+        configuration (Configuration): HDX configuration
+        user_agent (str): Full user agent
+        bucket (SharedTokenBucket): Token bucket shared by all processes
+        claims (Dict): Dictionary of dataset names to the feed that claimed them
+
+    Returns:
+        None
+    """
+    Configuration.setup(configuration)
+    UserAgent.user_agent = user_agent
+    _shared["bucket"] = bucket
+    _shared["claims"] = claims
+    _shared["call_remoteckan"] = Configuration.read().call_remoteckan
+
+
+def run_shard(feed, lookup, organisation, updated_by_script, save, use_saved):
+    """Publish the new entries of a feed in a worker process. HDX calls are
+    unwrapped before and after so that the metrics, rate limit and index of
+    one feed are not used by the next feed run in the same process.
+
+    Args:
+        feed (Dict): Feed with name, url and state
+        lookup (str): Name of scraper
+        organisation (str): Organisation id
+        updated_by_script (str): String to identify the script
+        save (bool): Save downloaded data
+        use_saved (bool): Use saved data
+
+    Returns:
+        Optional[int]: Number of datasets published or None if there is nothing to do
+    """
+    name = feed["name"]
+    configuration = Configuration.read()
+    # Drop the wrappers installed for the last feed run in this process and
+    # the time it waited for the rate limit
+    configuration.call_remoteckan = _shared["call_remoteckan"]
+    _shared["bucket"].waited = 0.0
+    metrics = Metrics(
+        get_shard_outputs(configuration.get("metrics"), name), labels={"feed": name}
+    )
+    metrics.install(configuration)
+    reference = get_reference_cache(configuration)
+    catalogue = get_catalogue(configuration)
+    try:
+        with metrics.run():
+            with wheretostart_tempdir_batch(f"{lookup}-{name}") as info:
+                folder = info["folder"]
+                with PipelineState(feed["state"], folder, configuration) as state:
+                    with Download() as downloader:
+                        retriever = Retrieve(
+                            downloader,
+                            folder,
+                            join("saved_data", name),
+                            folder,
+                            save,
+                            use_saved,
+                        )
+                        # Each feed keeps its own probe results as they are
+                        # saved whole and would overwrite those of other feeds
+                        probe_results = get_shard_path(
+                            configuration.get("probe_links", {}).get("results"), name
+                        )
+                        pipeline = Pipeline(
+                            configuration,
+                            retriever,
+                            metrics,
+                            feed["url"],
+                            probe_results,
+                        )
+                        pipeline.claims = _shared["claims"]
+                        pipeline.shard = name
+                        runner = Runner(
+                            configuration,
+                            pipeline,
+                            state,
+                            metrics,
+                            organisation,
+                            updated_by_script,
+                            reference,
+                            catalogue,
+                            _shared["bucket"],
+                        )
+                        return runner.run(info)
+    finally:
+        configuration.call_remoteckan = _shared["call_remoteckan"]
+
+
+def run_feeds(
+    configuration,
+    feeds,
+    lookup,
+    organisation,
+    updated_by_script,
+    save=False,
+    use_saved=False,
+    metrics=None,
+):
+    """Publish the new entries of each feed in sources in a pool of up to
+    processes worker processes. All feeds are run even if some fail.
+
+    Args:
+        configuration (Configuration): HDX configuration
+        feeds (Dict): Feeds configuration with sources and optionally processes
+        lookup (str): Name of scraper
+        organisation (str): Organisation id
+        updated_by_script (str): String to identify the script
+        save (bool): Save downloaded data. Defaults to False.
+        use_saved (bool): Use saved data. Defaults to False.
+        metrics (Optional[Metrics]): Metrics to record in. Defaults to None.
+
+    Returns:
+        Dict[str, Optional[int]]: Number of datasets published by feed name
+    """
+    if metrics is None:
+        metrics = Metrics()
+    sources = feeds["sources"]
+    names = [source["name"] for source in sources]
+    if len(set(names)) != len(names):
+        raise ValueError("Feed names must be unique!")
+    publishing = configuration.get("publishing", {})
+    context = get_context()
+    bucket = SharedTokenBucket(
+        get_call_budget(configuration), publishing.get("period", 1800), None, context
+    )
+    results = {}
+    failed = []
+    with context.Manager() as manager:
+        claims = manager.dict()
+        with ProcessPoolExecutor(
+            max_workers=feeds.get("processes", len(sources)),
+            mp_context=context,
+            initializer=init_shard,
+            initargs=(configuration, UserAgent.user_agent, bucket, claims),
+        ) as executor:
+            futures = {
+                source["name"]: executor.submit(
+                    run_shard,
+                    source,
+                    lookup,
+                    organisation,
+                    updated_by_script,
+                    save,
+                    use_saved,
+                )
+                for source in sources
+            }
+            for name, future in futures.items():
+                try:
+                    results[name] = future.result()
+                except Exception:
+                    logger.exception(f"Feed {name} failed!")
+                    failed.append(name)
+                    continue
+                logger.info(f"Feed {name} finished: {results[name]} datasets published")
+                metrics.count("datasets_published", results[name] or 0)
+    metrics.count("feeds", len(sources))
+    metrics.count("feeds_failed", len(failed))
+    if failed:
+        raise RuntimeError(f"Feeds failed: {', '.join(failed)}")
+    return results
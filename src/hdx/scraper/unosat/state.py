@@ -0,0 +1,107 @@
+#!/usr/bin/python
+"""
+State:
+-----
+
+State of the scraper kept in an HDX dataset. Besides the last build date of the
+feed, it holds the validators needed to make a conditional request for the
+feed, with the build date they were stored for, and the fingerprints of the
+datasets that have been published. Entries that failed to publish are kept in
+it as dead letters. The quick check on startup reads it from HDX too.
+
+"""
+
+import json
+import logging
+from os.path import join
+
+from hdx.api.utilities.hdx_state import HDXState
+from hdx.data.dataset import Dataset
+from hdx.utilities.dateparse import parse_date
+from hdx.utilities.loader import load_text
+from hdx.utilities.saver import save_text
+
+logger = logging.getLogger(__name__)
+
+
+def read_state(text):
+    """Convert state text into a dictionary. State that is just a date (as
+    written by older versions of the scraper) is also accepted.
+
+    Args:
+        text (str): State text
+
+    Returns:
+        Dict: State dictionary
+    """
+    text = text.strip()
+    if text.startswith("{"):
+        state = json.loads(text)
+    else:
+        state = {"last_build_date": text}
+    state["last_build_date"] = parse_date(state["last_build_date"])
+    state.setdefault("feed", {})
+    state.setdefault("fingerprints", {})
+    state.setdefault("dead_letters", {})
+    return state
+
+
+def write_state(state):
+    """Convert state dictionary into text. Only the top level keys are
+    sorted so that fingerprints stay in the order they were published.
+
+    Args:
+        state (Dict): State dictionary
+
+    Returns:
+        str: State text
+    """
+    state = dict(state)
+    # The time is kept so that it can be compared with the feed's lastBuildDate
+    state["last_build_date"] = state["last_build_date"].isoformat()
+    return json.dumps(dict(sorted(state.items())))
+
+
+class PipelineState(HDXState):
+    """HDXState holding a dictionary of state. The state is only written back
+    to HDX if it has changed so that runs that find nothing new do not make any
+    HDX writes. Only the last build date is logged as the fingerprints and
+    dead letters can be large.
+
+    Args:
+        dataset_name_or_id (str): Dataset name or ID
+        path (str): Path to temporary folder for state
+        configuration (Optional[Configuration]): HDX configuration. Defaults to global configuration.
+    """
+
+    def __init__(self, dataset_name_or_id, path, configuration=None):
+        super().__init__(
+            dataset_name_or_id, path, read_state, write_state, configuration
+        )
+        self._original = self.write_fn(self.state)
+
+    def read(self):
+        dataset = Dataset.read_from_hdx(
+            self._dataset_name_or_id, configuration=self._configuration
+        )
+        self._resource = dataset.get_resource()
+        _, path = self._resource.download()
+        state = self.read_fn(load_text(path))
+        logger.info(
+            f"State read from {self._dataset_name_or_id}: last build date {state['last_build_date']}"
+        )
+        return state
+
+    def write(self):
+        text = self.write_fn(self.state)
+        if text == self._original:
+            logger.info(f"State in {self._dataset_name_or_id} unchanged")
+        else:
+            logger.info(
+                f"State written to {self._dataset_name_or_id}: last build date {self.state['last_build_date']}"
+            )
+            file_to_upload = join(self.path, self._resource["name"])
+            save_text(text, file_to_upload)
+            self._resource.set_file_to_upload(file_to_upload)
+            self._resource.update_in_hdx()
+            self._original = text
@@ -0,0 +1,133 @@
+#!/usr/bin/python
+"""
+Watch:
+-----
+
+Long running mode that polls the feed on an adaptive interval. The interval
+drops to its minimum when the feed has changed, as UNOSAT tends to release
+products in bursts, and backs off while nothing is new or polling fails. Waits
+are randomised so that polls do not fall into step with the schedules of the
+feed or HDX.
+
+"""
+
+import logging
+import random
+from signal import SIGINT, SIGTERM, getsignal, signal
+from threading import Event, current_thread, main_thread
+
+logger = logging.getLogger(__name__)
+
+
+class PollInterval:
+    """Interval between polls that is reset to minimum when something new is
+    found and otherwise multiplied by backoff up to maximum. Each wait is
+    randomised by up to plus or minus jitter as a fraction of the interval.
+
+    Args:
+        minimum (float): Minimum interval in seconds. Defaults to 60.
+        maximum (float): Maximum interval in seconds. Defaults to 1800.
+        backoff (float): Factor to increase interval by. Defaults to 2.
+        jitter (float): Fraction of interval to randomise waits by. Defaults to 0.1.
+        seed (Optional[int]): Random seed. Defaults to None.
+    """
+
+    def __init__(self, minimum=60, maximum=1800, backoff=2, jitter=0.1, seed=None):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.backoff = backoff
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.seconds = minimum
+
+    def reset(self):
+        """Set interval back to minimum
+
+        Returns:
+            None
+        """
+        self.seconds = self.minimum
+
+    def increase(self):
+        """Back off by multiplying interval by backoff up to maximum
+
+        Returns:
+            None
+        """
+        self.seconds = min(self.maximum, self.seconds * self.backoff)
+
+    def get_wait(self):
+        """Get the number of seconds to wait before the next poll
+
+        Returns:
+            float: Seconds to wait
+        """
+        return self.seconds * self.random.uniform(1 - self.jitter, 1 + self.jitter)
+
+
+class Watcher:
+    """Call poll repeatedly until stopped, waiting for an adaptive interval in
+    between. poll returns None if the feed was unchanged or else the number of
+    datasets published. A poll that raises an exception is logged and backed
+    off from, so that a temporary failure of the feed or HDX does not stop
+    watching. SIGINT and SIGTERM stop watching once any poll in progress has
+    finished.
+
+    Args:
+        poll (Callable[[], Optional[int]]): Function to call to poll the feed
+        interval (PollInterval): Interval between polls
+        polls (Optional[int]): Number of polls after which to stop. Defaults to None (run until stopped).
+    """
+
+    def __init__(self, poll, interval, polls=None):
+        self.poll = poll
+        self.interval = interval
+        self.polls = polls
+        self.stopped = Event()
+
+    def stop(self, *args):
+        """Stop watching after any poll in progress
+
+        Returns:
+            None
+        """
+        logger.info("Stopping watching feed")
+        self.stopped.set()
+
+    def _poll(self):
+        try:
+            published = self.poll()
+        except Exception:
+            logger.exception("Polling feed failed!")
+            self.interval.increase()
+            return
+        if published is None:
+            self.interval.increase()
+        else:
+            self.interval.reset()
+
+    def run(self):
+        """Poll until stopped or the number of polls is reached
+
+        Returns:
+            int: Number of polls made
+        """
+        handlers = {}
+        if current_thread() is main_thread():
+            for signum in (SIGINT, SIGTERM):
+                handlers[signum] = getsignal(signum)
+                signal(signum, self.stop)
+        polls = 0
+        try:
+            while not self.stopped.is_set():
+                self._poll()
+                polls += 1
+                if self.polls is not None and polls >= self.polls:
+                    break
+                wait = self.interval.get_wait()
+                logger.info(f"Next poll of feed in {wait:.0f} seconds")
+                self.stopped.wait(wait)
+        finally:
+            for signum, handler in handlers.items():
+                signal(signum, handler)
+        return polls
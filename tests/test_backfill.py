@@ -0,0 +1,157 @@
+#!/usr/bin/python
+"""
+Unit tests for backfill.
+
+"""
+
+from datetime import timedelta
+from os.path import join
+
+import pytest
+
+from benchmarks.feed import generate_feed
+
+from hdx.scraper.unosat.backfill import Backfill
+from hdx.scraper.unosat.metrics import Metrics
+from hdx.scraper.unosat.pipeline import Pipeline
+from hdx.utilities.dateparse import parse_date
+from hdx.utilities.downloader import Download
+from hdx.utilities.path import temp_dir
+from hdx.utilities.retriever import Retrieve
+
+
+class FakeState:
+    def __init__(self, state):
+        self.state = state
+        self.written = []
+
+    def get(self):
+        return self.state
+
+    def set(self, state):
+        self.state = state
+
+    def write(self):
+        self.written.append(self.state["last_build_date"])
+
+
+class FakePublisher:
+    def __init__(self, fail=None):
+        self.fail = fail
+        self.published = []
+        self.last_done = None
+
+    def run(self, entries, generate, dead_letters):
+        published = 0
+        for entry in entries:
+            if entry.published == self.fail:
+                raise ValueError("HDX error")
+            self.published.append(entry.published)
+            self.last_done = entry
+            published += 1
+        return published
+
+
+class TestBackfill:
+    @pytest.fixture(scope="function")
+    def folder(self):
+        with temp_dir(
+            "test_backfill",
+            delete_if_exists=True,
+            delete_on_success=True,
+            delete_on_failure=False,
+        ) as folder:
+            yield folder
+
+    @staticmethod
+    def run_backfill(configuration, folder, state, monkeypatch, since=None, fail=None):
+        """Run a backfill in chunks of 4 failing on the entry published at fail
+        and return the dates of the entries published"""
+        configuration = dict(configuration)
+        for key in ("coalesce", "probe_links"):
+            configuration.pop(key, None)
+        configuration["backfill"] = {"chunk_size": 4}
+        publisher = FakePublisher(fail)
+        monkeypatch.setattr(Backfill, "get_publisher", lambda *args: publisher)
+        with Download() as downloader:
+            retriever = Retrieve(downloader, folder, folder, folder, False, True)
+            pipeline = Pipeline(configuration, retriever)
+            backfill = Backfill(configuration, pipeline, state, Metrics(), None, "test")
+            if fail is None:
+                backfill.run({"folder": folder}, since)
+            else:
+                with pytest.raises(ValueError):
+                    backfill.run({"folder": folder}, since)
+        return publisher.published
+
+    @staticmethod
+    def get_state(last_build_date, until=None):
+        state = {"last_build_date": last_build_date, "fingerprints": {}}
+        state["dead_letters"] = {}
+        if until:
+            state["until"] = until.isoformat()
+        return FakeState(state)
+
+    def test_get_chunk(self, folder):
+        path = join("tests", "fixtures", "feed")
+        since = parse_date("2020-02-09")
+        until = parse_date("2023-01-25 23:59:59")
+        remaining, chunk = Backfill.get_chunk(path, since, until, 1)
+        assert remaining == 3
+        assert [entry.published for entry in chunk] == [
+            parse_date("2023-01-20 14:44:27")
+        ]
+        remaining, chunk = Backfill.get_chunk(path, chunk[-1].published, until, 5)
+        assert remaining == 2
+        assert [entry.published for entry in chunk] == [
+            parse_date("2023-01-25 14:07:32"),
+            parse_date("2023-01-25 16:05:21"),
+        ]
+        # Entries published after the end of the backfill are left out
+        until = parse_date("2023-01-25 15:00:00")
+        remaining, chunk = Backfill.get_chunk(path, since, until, 5)
+        assert remaining == 2
+        assert chunk[-1].published == parse_date("2023-01-25 14:07:32")
+        assert Backfill.get_chunk(path, until, until, 5) == (0, [])
+        # Entries published at the same time are kept in the same chunk
+        path = join(folder, "feed")
+        dates = generate_feed(path, 3, interval=timedelta(0))
+        remaining, chunk = Backfill.get_chunk(path, since, dates[0], 2)
+        assert remaining == 3
+        assert len(chunk) == 3
+
+    def test_resume_after_failure(self, configuration, folder, monkeypatch):
+        dates = generate_feed(join(folder, "feed"), 10)
+        since = dates[-1] - timedelta(hours=1)
+        state = self.get_state(since)
+        # Fails on the third entry of the second chunk
+        published = self.run_backfill(
+            configuration, folder, state, monkeypatch, since, dates[3]
+        )
+        assert published == dates[9:3:-1]
+        assert state.written == [dates[6]]
+        # Only carries on from the last entry published
+        assert state.state["last_build_date"] == dates[4]
+        assert state.state["until"] == dates[0].isoformat()
+        published = self.run_backfill(configuration, folder, state, monkeypatch)
+        assert published == dates[3::-1]
+        assert state.state["last_build_date"] == dates[0]
+        assert "until" not in state.state
+
+    def test_backfill_from(self, configuration, folder, monkeypatch):
+        dates = generate_feed(join(folder, "feed"), 10)
+        since = dates[-1] - timedelta(hours=1)
+        # Carrying on stops at the end of the backfill in the state
+        state = self.get_state(dates[7], dates[5])
+        published = self.run_backfill(configuration, folder, state, monkeypatch)
+        assert published == dates[6:4:-1]
+        assert state.state["last_build_date"] == dates[5]
+        assert "until" not in state.state
+        # Starting again goes to the feed's build date
+        state = self.get_state(dates[7], dates[5])
+        published = self.run_backfill(
+            configuration, folder, state, monkeypatch, since, dates[8]
+        )
+        assert published == [dates[9]]
+        assert state.state["last_build_date"] == dates[9]
+        assert state.state["until"] == dates[0].isoformat()
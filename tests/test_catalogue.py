@@ -0,0 +1,66 @@
+#!/usr/bin/python
+"""
+Unit tests for catalogue.
+
+"""
+
+from datetime import datetime, timezone
+
+from hdx.scraper.unosat.catalogue import Catalogue
+from hdx.scraper.unosat.feed import FeedEntry
+
+
+class TestCatalogue:
+    def test_catalogue(self):
+        now = datetime(2023, 1, 26, tzinfo=timezone.utc)
+        flood = FeedEntry(
+            title="Water extents South Sudan",
+            published=datetime(2023, 1, 25, tzinfo=timezone.utc),
+            eventcode="FL20220424SSD",
+            iso3="SSD",
+            tags=("FL",),
+            bbox=(24.405928, 6.380813, 35.200516, 11.164421),
+        )
+        cyclone = FeedEntry(
+            title="Damage Assessment Vanuatu",
+            published=datetime(2023, 1, 24, tzinfo=timezone.utc),
+            eventcode="TC20230119VUT",
+            gdacs_eventid="1000959",
+            iso3="VUT;ssd",
+            tags=("TC", "FL"),
+        )
+        with Catalogue() as catalogue:
+            catalogue.record(flood, "failed", error=ValueError("HDX error"), now=now)
+            catalogue.record(cyclone, "skipped", now=now)
+            assert catalogue.get("Water extents South Sudan") == {
+                "title": "Water extents South Sudan",
+                "name": "water-extents-south-sudan",
+                "eventcode": "FL20220424SSD",
+                "gdacs_eventid": None,
+                "iso3": "SSD",
+                "categories": "FL",
+                "published": "2023-01-25T00:00:00+00:00",
+                "processed": "2023-01-26T00:00:00+00:00",
+                "min_lon": 24.405928,
+                "min_lat": 6.380813,
+                "max_lon": 35.200516,
+                "max_lat": 11.164421,
+                "outcome": "failed",
+                "error": "ValueError('HDX error')",
+            }
+            catalogue.record(flood, "published", "water-extents", now=now)
+
+            def find(**kwargs):
+                return [record["title"] for record in catalogue.find(**kwargs)]
+
+            assert find(iso3="ssd") == [flood.title, cyclone.title]
+            assert find(iso3="VUT") == [cyclone.title]
+            assert find(category="FL", outcome="published") == [flood.title]
+            assert find(gdacs_eventid="1000959") == [cyclone.title]
+            assert find(eventcode="FL20220424SSD", name="water-extents") == [
+                flood.title
+            ]
+            assert find(bbox=(30, 10, 40, 20)) == [flood.title]
+            assert find(bbox=(0, 0, 10, 10)) == []
+            assert catalogue.get("Water extents South Sudan")["error"] is None
+            assert catalogue.get("Unknown") is None
@@ -0,0 +1,114 @@
+#!/usr/bin/python
+"""
+Unit tests for dead letters.
+
+"""
+
+from datetime import datetime, timezone
+
+from hdx.scraper.unosat.deadletter import DeadLetterQueue
+from hdx.scraper.unosat.feed import FeedEntry
+from hdx.scraper.unosat.pipeline import Pipeline
+from hdx.scraper.unosat.runner import Runner
+
+
+def get_entry(title, day):
+    return FeedEntry(
+        title=title,
+        published=datetime(2023, 1, day, 12, tzinfo=timezone.utc),
+        tags=("FL",),
+    )
+
+
+class TestDeadLetters:
+    def test_dead_letter_queue(self):
+        letters = {}
+        dead_letters = DeadLetterQueue(letters, delay=10, max_delay=25)
+        entry1 = get_entry("title1", 2)
+        entry2 = get_entry("title2", 1)
+        dead_letters.add(entry1, ValueError("HDX error"), now=1000)
+        dead_letters.add(entry2, ValueError("HDX error"), now=1000)
+        assert letters["title1"] == {
+            "entry": {
+                "title": "title1",
+                "published": "2023-01-02T12:00:00+00:00",
+                "eventcode": None,
+                "gdacs_eventid": None,
+                "summary": "",
+                "iso3": None,
+                "tags": ["FL"],
+                "gdb_link": None,
+                "shp_link": None,
+                "kml_link": None,
+                "excel": None,
+                "wmap_link": None,
+                "pdf": None,
+                "image_link": None,
+                "bbox": None,
+            },
+            "attempts": 1,
+            "error": "ValueError('HDX error')",
+            "retry_after": 1010,
+        }
+        assert dead_letters.get_due(now=1005) == []
+        assert dead_letters.get_due(now=1010) == [entry2, entry1]
+        dead_letters.add(entry1, ValueError("HDX error"), now=1010)
+        assert letters["title1"]["attempts"] == 2
+        assert letters["title1"]["retry_after"] == 1030
+        dead_letters.add(entry1, ValueError("HDX error"), now=1030)
+        assert letters["title1"]["retry_after"] == 1055
+        dead_letters.remove("title1")
+        dead_letters.remove("title3")
+        assert len(dead_letters) == 1
+
+    def test_max_attempts(self):
+        letters = {}
+        dead_letters = DeadLetterQueue(letters, delay=10, max_attempts=2)
+        entry = get_entry("title1", 2)
+        assert dead_letters.add(entry, ValueError("HDX error"), now=1000) is True
+        assert dead_letters.add(entry, ValueError("HDX error"), now=1010) is False
+        assert letters == {}
+
+    def test_coalesce_retries(self, configuration):
+        pipeline = Pipeline(configuration, None)
+        runner = Runner(configuration, pipeline, None, None, None, None)
+        letters = {}
+        dead_letters = DeadLetterQueue(letters)
+
+        def get_product(title, day, number):
+            return FeedEntry(
+                title=title,
+                published=datetime(2023, 1, day, tzinfo=timezone.utc),
+                iso3="SSD",
+                shp_link=f"https://unosat.org/static/{number}/shapefile.zip",
+            )
+
+        for entry in (get_product("title1", 1, 1), get_product("title2", 2, 2)):
+            dead_letters.add(entry, ValueError("HDX error"), now=1000)
+        retries = dead_letters.get_due(now=2000)
+        chunk = [get_product("title3", 3, 3), get_product("title1", 4, 4)]
+        retries, kept = runner.coalesce(retries, chunk, dead_letters)
+        # The retry of title1 is superseded by its newer entry
+        assert [entry.title for entry in retries] == ["title2"]
+        assert kept == chunk
+        assert sorted(letters) == ["title2"]
+
+    def test_contiguous_build_date(self):
+        previous_build_date = datetime(2023, 1, 1, tzinfo=timezone.utc)
+        entries = [get_entry("a", 2), get_entry("b", 3), get_entry("c", 3)]
+        entries.append(get_entry("d", 4))
+
+        def get_date(last_done):
+            return Runner.get_contiguous_build_date(
+                entries, last_done, previous_build_date
+            )
+
+        assert get_date(None) == previous_build_date
+        assert get_date(get_entry("retry", 1)) == previous_build_date
+        assert get_date(entries[0]) == entries[0].published
+        # c has the same date as b so b's date cannot be stored
+        assert get_date(entries[1]) == entries[0].published
+        assert get_date(entries[2]) == entries[2].published
+        assert get_date(entries[3]) == entries[3].published
+        entries[0] = get_entry("a", 3)
+        assert get_date(entries[0]) == previous_build_date
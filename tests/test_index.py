@@ -0,0 +1,106 @@
+#!/usr/bin/python
+"""
+Unit tests for HDX index.
+
+"""
+
+import pytest
+from ckanapi.errors import NotFound
+
+from hdx.scraper.unosat.index import HDXIndex
+
+
+class TestHDXIndex:
+    def test_call(self):
+        calls = []
+
+        def call_remoteckan(action, data, *args, **kwargs):
+            calls.append(action)
+            if action == "ckanext_showcase_create":
+                return {"id": "s2", "name": data["name"]}
+            if action == "package_show":
+                return {"id": "d3", "name": data["id"]}
+            return {}
+
+        index = HDXIndex(None, "org", {"dataset1": "1234"})
+        index.datasets = {
+            "dataset1": {"id": "d1", "name": "dataset1", "resources": []},
+        }
+        index.showcases = {"dataset1-showcase": {"id": "s1"}}
+        index.showcase_datasets = {"s1": [{"id": "d1"}]}
+        index.expect("dataset1")
+        index.expect("dataset2")
+
+        dataset = index.call(call_remoteckan, "package_show", {"id": "dataset1"})
+        assert dataset == {"id": "d1", "name": "dataset1", "resources": []}
+        dataset["resources"].append({})
+        assert index.datasets["dataset1"]["resources"] == []
+        with pytest.raises(NotFound):
+            index.call(call_remoteckan, "package_show", {"id": "dataset2"})
+        with pytest.raises(NotFound):
+            index.call(
+                call_remoteckan, "ckanext_showcase_show", {"id": "dataset2-showcase"}
+            )
+        assert index.call(
+            call_remoteckan, "ckanext_showcase_package_list", {"showcase_id": "s1"}
+        ) == [{"id": "d1"}]
+        assert calls == []
+
+        index.call(call_remoteckan, "package_show", {"id": "other"})
+        index.call(call_remoteckan, "ckanext_showcase_create", {"name": "x-showcase"})
+        assert index.showcases["x-showcase"] == {"id": "s2", "name": "x-showcase"}
+        index.call(
+            call_remoteckan,
+            "ckanext_showcase_package_association_create",
+            {"showcase_id": "s2", "package_id": "d2"},
+        )
+        assert index.call(
+            call_remoteckan, "ckanext_showcase_package_list", {"showcase_id": "s2"}
+        ) == [{"id": "d2"}]
+        assert calls == [
+            "package_show",
+            "ckanext_showcase_create",
+            "ckanext_showcase_package_association_create",
+        ]
+
+    def test_build(self, monkeypatch):
+        searches = []
+
+        class Found:
+            def __init__(self, data):
+                self.data = data
+
+            def __getitem__(self, key):
+                return self.data[key]
+
+            def get_resources(self):
+                return []
+
+        def search_datasets(**kwargs):
+            searches.append(kwargs)
+            return [Found({"id": "d1", "name": "dataset1"})]
+
+        def search_showcases(**kwargs):
+            searches.append(kwargs)
+            return [Found({"id": "s1", "name": "dataset1-showcase"})]
+
+        monkeypatch.setattr(
+            "hdx.scraper.unosat.index.Dataset.search_in_hdx", search_datasets
+        )
+        monkeypatch.setattr(
+            "hdx.scraper.unosat.index.Showcase.search_in_hdx", search_showcases
+        )
+        index = HDXIndex(None, "org", {"dataset1": "1234"}, batch_size=2)
+        # Created by an earlier poll but not yet searchable
+        index.datasets["dataset0"] = {"id": "d0", "name": "dataset0"}
+        index.build(["dataset1", "dataset2", "dataset1", "dataset3"])
+        assert [search["fq"] for search in searches] == [
+            "owner_org:org AND name:(dataset1 OR dataset2)",
+            "name:(dataset1-showcase OR dataset2-showcase)",
+            "owner_org:org AND name:(dataset3)",
+            "name:(dataset3-showcase)",
+        ]
+        assert searches[0]["include_private"] is True
+        assert searches[0]["include_drafts"] is True
+        assert sorted(index.datasets) == ["dataset0", "dataset1"]
+        assert index.showcase_datasets == {"s1": [{"id": "d1"}]}
@@ -0,0 +1,257 @@
+#!/usr/bin/python
+"""
+End to end tests of main against a local stand-in for HDX.
+
+"""
+
+import json
+from os import chdir, getcwd, makedirs
+from os.path import join
+from shutil import copyfile
+
+import pytest
+
+from benchmarks.hdx_server import create_server
+from benchmarks.replay import replay
+from benchmarks.run import create_configuration
+
+from hdx.api.configuration import Configuration
+from hdx.scraper.unosat.__main__ import lookup, main
+from hdx.scraper.unosat.catalogue import Catalogue
+from hdx.scraper.unosat.shard import SharedTokenBucket, init_shard, run_shard
+from hdx.utilities.loader import load_json, load_text
+from hdx.utilities.path import get_temp_dir, temp_dir
+from hdx.utilities.useragent import UserAgent
+
+
+class TestMain:
+    @pytest.fixture(scope="function")
+    def restore_configuration(self, configuration):
+        yield
+        Configuration._configuration = configuration
+
+    def test_resume_after_failure(self, restore_configuration):
+        with temp_dir(
+            "test_main",
+            delete_if_exists=True,
+            delete_on_success=True,
+            delete_on_failure=False,
+        ) as folder:
+            results = replay(
+                folder,
+                join("tests", "fixtures", "feed"),
+                "2020-02-09",
+                publishing={"hdx_calls": 1000, "period": 1, "max_failures": 1},
+                fail_after=2,
+            )
+            runs = results["runs"]
+            assert [run["success"] for run in runs] == [False, True]
+            assert results["injected"]["failures"] >= 1
+            assert runs[1]["metrics"]["counts"]["datasets_published"] == 2
+            assert results["datasets"] == 2
+            assert results["showcases"] == 2
+            assert results["hdx_calls"]["package_create"] == 2
+            assert results["duplicate_associations"] == 0
+            state = json.loads(results["state"])
+            assert state["last_build_date"] == "2023-01-25T16:05:21+00:00"
+            assert len(state["fingerprints"]) == 2
+            with Catalogue(join(folder, "unosat_catalogue.db")) as catalogue:
+                assert len(catalogue.find(outcome="published")) == 2
+                assert len(catalogue.find(iso3="SSD", outcome="published")) == 1
+
+    def test_watch(self, restore_configuration):
+        with temp_dir(
+            "test_main",
+            delete_if_exists=True,
+            delete_on_success=True,
+            delete_on_failure=False,
+        ) as folder:
+            saved_folder = join(folder, "saved_data")
+            makedirs(saved_folder)
+            copyfile(join("tests", "fixtures", "feed"), join(saved_folder, "feed"))
+            get_temp_dir(lookup, delete_if_exists=True)
+            get_temp_dir(f"{lookup}-watch", delete_if_exists=True)
+            server = create_server(join(folder, "state.txt"), "2020-02-09")
+            cwd = getcwd()
+            with server:
+                chdir(folder)
+                try:
+                    configuration = create_configuration(hdx_url=server.url)
+                    configuration["publishing"].update({"hdx_calls": 1000, "period": 1})
+                    configuration["watch"] = {"minimum": 0.01, "polls": 2}
+                    main(use_saved=True, watch=True)
+                    # The report is of the last poll which found nothing new
+                    report = load_json(configuration["metrics"]["json"])
+                finally:
+                    chdir(cwd)
+            calls = server.ckan.calls
+            assert calls["package_create"] == 2
+            assert calls["organization_list_for_user"] == 1
+            assert report["hdx_calls"] == {}
+            assert report["values"]["last_run_success"] == 1
+            state = json.loads(load_text(server.ckan.state_path))
+            assert state["last_build_date"] == "2023-01-25T16:05:21+00:00"
+
+    @pytest.mark.parametrize("processes", [2, 1])
+    def test_feeds(self, restore_configuration, processes):
+        with temp_dir(
+            "test_main",
+            delete_if_exists=True,
+            delete_on_success=True,
+            delete_on_failure=False,
+        ) as folder:
+            sources = []
+            for name in ("latest", "archive"):
+                saved_folder = join(folder, "saved_data", name)
+                makedirs(saved_folder)
+                copyfile(join("tests", "fixtures", "feed"), join(saved_folder, "feed"))
+                get_temp_dir(f"{lookup}-{name}", delete_if_exists=True)
+                sources.append(
+                    {
+                        "name": name,
+                        "url": f"https://unosat.org/product/{name}/feed/",
+                        "state": f"pipeline-state-unosat-{name}",
+                    }
+                )
+            server = create_server(join(folder, "state.txt"), "2020-02-09")
+            for source in sources:
+                server.ckan.add_state(
+                    source["state"], join(folder, f"{source['name']}.txt"), "2020-02-09"
+                )
+            cwd = getcwd()
+            with server:
+                chdir(folder)
+                try:
+                    configuration = create_configuration(hdx_url=server.url)
+                    configuration["publishing"].update({"hdx_calls": 1000, "period": 1})
+                    # With one process, the worker is reused for both feeds
+                    configuration["feeds"] = {
+                        "processes": processes,
+                        "sources": sources,
+                    }
+                    main(use_saved=True)
+                    report = load_json(configuration["metrics"]["json"])
+                    claimed = 0
+                    for source in sources:
+                        shard_report = load_json(
+                            f"unosat_metrics_{source['name']}.json"
+                        )
+                        counts = shard_report["counts"]
+                        claimed += counts.get("datasets_claimed_elsewhere", 0)
+                finally:
+                    chdir(cwd)
+            calls = server.ckan.calls
+            # Both feeds have the same products which are only published once
+            assert calls["package_create"] == 2
+            assert claimed == 2
+            assert report["counts"] == {
+                "feeds": 2,
+                "feeds_failed": 0,
+                "datasets_published": 2,
+            }
+            for name in ("latest", "archive"):
+                state = json.loads(load_text(join(folder, f"{name}.txt")))
+                assert state["last_build_date"] == "2023-01-25T16:05:21+00:00"
+
+    def test_run_shard_twice(self, restore_configuration):
+        with temp_dir(
+            "test_main",
+            delete_if_exists=True,
+            delete_on_success=True,
+            delete_on_failure=False,
+        ) as folder:
+            sources = []
+            server = create_server(join(folder, "state.txt"), "2020-02-09")
+            for name in ("latest", "archive"):
+                saved_folder = join(folder, "saved_data", name)
+                makedirs(saved_folder)
+                copyfile(join("tests", "fixtures", "feed"), join(saved_folder, "feed"))
+                get_temp_dir(f"{lookup}-{name}", delete_if_exists=True)
+                source = {
+                    "name": name,
+                    "url": f"https://unosat.org/product/{name}/feed/",
+                    "state": f"pipeline-state-unosat-{name}",
+                }
+                server.ckan.add_state(
+                    source["state"], join(folder, f"{name}.txt"), "2020-02-09"
+                )
+                sources.append(source)
+            cwd = getcwd()
+            with server:
+                chdir(folder)
+                try:
+                    configuration = create_configuration(hdx_url=server.url)
+                    configuration["publishing"].update({"hdx_calls": 1000, "period": 1})
+                    bucket = SharedTokenBucket(1000, 1)
+                    init_shard(configuration, UserAgent.user_agent, bucket, {})
+                    call_remoteckan = configuration.call_remoteckan
+                    calls = []
+                    for source in sources:
+                        before = sum(server.ckan.calls.values())
+                        run_shard(
+                            source,
+                            lookup,
+                            configuration["organisation"],
+                            "test",
+                            False,
+                            True,
+                        )
+                        # The metrics, rate limit and index of the feed are
+                        # not left wrapped around HDX calls for the next one
+                        assert configuration.call_remoteckan == call_remoteckan
+                        calls.append(sum(server.ckan.calls.values()) - before)
+                    for source, made in zip(sources, calls):
+                        report = load_json(f"unosat_metrics_{source['name']}.json")
+                        assert sum(report["hdx_calls"].values()) == made
+                finally:
+                    chdir(cwd)
+
+    def test_backfill(self, restore_configuration):
+        with temp_dir(
+            "test_main",
+            delete_if_exists=True,
+            delete_on_success=True,
+            delete_on_failure=False,
+        ) as folder:
+            saved_folder = join(folder, "saved_data")
+            makedirs(saved_folder)
+            copyfile(join("tests", "fixtures", "feed"), join(saved_folder, "feed"))
+            get_temp_dir(f"{lookup}-backfill", delete_if_exists=True)
+            state_path = join(folder, "state.txt")
+            backfill_path = join(folder, "backfill.txt")
+            server = create_server(state_path, "2023-01-01", fail_after=5)
+            server.ckan.add_state(
+                "pipeline-state-unosat-backfill", backfill_path, "2023-01-01"
+            )
+            cwd = getcwd()
+            with server:
+                chdir(folder)
+                try:
+                    configuration = create_configuration(hdx_url=server.url)
+                    configuration["publishing"].update(
+                        {"hdx_calls": 1000, "period": 1, "max_failures": 1}
+                    )
+                    configuration["backfill"].update(
+                        {"chunk_size": 1, "datasets_per_hour": None}
+                    )
+                    with pytest.raises(Exception):
+                        main(use_saved=True, backfill_from="2020-02-09")
+                    # The chunk that was published has been checkpointed
+                    state = json.loads(load_text(backfill_path))
+                    assert state["last_build_date"] == "2023-01-20T14:44:27+00:00"
+                    assert state["until"] == "2023-01-25T16:05:21+00:00"
+                    server.fail_after = None
+                    main(use_saved=True, backfill=True)
+                    report = load_json(configuration["metrics"]["json"])
+                finally:
+                    chdir(cwd)
+            calls = server.ckan.calls
+            assert calls["package_create"] == 2
+            assert report["counts"]["backfill_chunks"] == 2
+            assert report["values"]["backfill_entries_remaining"] == 0
+            state = json.loads(load_text(backfill_path))
+            assert state["last_build_date"] == "2023-01-25T16:05:21+00:00"
+            assert "until" not in state
+            assert len(state["fingerprints"]) == 2
+            # The state of scheduled runs is untouched
+            assert load_text(state_path) == "2023-01-01"
@@ -0,0 +1,85 @@
+#!/usr/bin/python
+"""
+Unit tests for metrics.
+
+"""
+
+from os.path import join
+
+import pytest
+
+from hdx.scraper.unosat.metrics import Metrics
+from hdx.utilities.loader import load_json, load_text
+from hdx.utilities.path import temp_dir
+
+
+class FakeConfiguration(dict):
+    def call_remoteckan(self, action, data=None, *args, **kwargs):
+        if action == "package_create":
+            raise ValueError("HDX error")
+        return {}
+
+
+class TestMetrics:
+    def test_observe(self):
+        metrics = Metrics(buckets=(0.1, 1))
+        metrics.observe("generate_dataset", 0.05)
+        metrics.observe("generate_dataset", 0.5)
+        metrics.observe("generate_dataset", 2)
+        assert list(metrics.time_iterator("parse_entry", [1, 2])) == [1, 2]
+        with metrics.time("publish"):
+            pass
+        report = metrics.get_report()
+        generate_dataset = report["stages"]["generate_dataset"]
+        assert generate_dataset["count"] == 3
+        assert generate_dataset["seconds"] == 2.55
+        assert generate_dataset["max_seconds"] == 2
+        assert generate_dataset["histogram"] == {"0.1": 1, "1": 2}
+        assert report["stages"]["parse_entry"]["count"] == 2
+        assert report["stages"]["publish"]["count"] == 1
+
+    def test_install(self):
+        configuration = FakeConfiguration()
+        metrics = Metrics()
+        metrics.install(configuration)
+        configuration.call_remoteckan("package_show", {"id": "a"})
+        configuration.call_remoteckan("package_show", {"id": "b"})
+        with pytest.raises(ValueError):
+            configuration.call_remoteckan("package_create", {"name": "a"})
+        report = metrics.get_report()
+        assert report["hdx_calls"] == {"package_show": 2, "package_create": 1}
+        assert report["hdx_errors"] == {"package_create": 1}
+        assert report["stages"]["hdx_call"]["count"] == 3
+
+    def test_run(self):
+        with temp_dir(
+            "test_metrics", delete_on_success=True, delete_on_failure=False
+        ) as folder:
+            json_path = join(folder, "metrics.json")
+            prometheus_path = join(folder, "metrics.prom")
+            metrics = Metrics(
+                {"json": json_path, "prometheus": prometheus_path}, buckets=(1,)
+            )
+            with pytest.raises(ValueError):
+                with metrics.run():
+                    metrics.count("entries", 2)
+                    metrics.add_bytes_downloaded(100)
+                    raise ValueError("Failed")
+            report = load_json(json_path)
+            assert report["counts"] == {"entries": 2}
+            assert report["bytes_downloaded"] == 100
+            assert report["values"]["last_run_success"] == 0
+            assert report["stages"]["run"]["count"] == 1
+            text = load_text(prometheus_path)
+            assert "# TYPE unosat_stage_duration_seconds histogram" in text
+            assert 'unosat_stage_duration_seconds_bucket{stage="run",le="1"} 1' in text
+            assert (
+                'unosat_stage_duration_seconds_bucket{stage="run",le="+Inf"} 1' in text
+            )
+            assert "unosat_entries 2" in text
+            assert "unosat_bytes_downloaded 100" in text
+            assert "unosat_last_run_success 0" in text
+
+            with metrics.run():
+                pass
+            assert load_json(json_path)["values"]["last_run_success"] == 1
@@ -0,0 +1,70 @@
+#!/usr/bin/python
+"""
+Unit tests for link probing.
+
+"""
+
+from datetime import datetime, timezone
+from os import listdir
+from os.path import abspath, join
+
+from hdx.scraper.unosat.feed import FeedEntry
+from hdx.scraper.unosat.pipeline import Pipeline
+from hdx.scraper.unosat.probe import LinkProber, get_size
+from hdx.utilities.path import temp_dir
+
+
+class TestProbe:
+    def test_get_size(self):
+        assert get_size({"Content-Range": "bytes 0-0/12345"}) == 12345
+        assert get_size({"Content-Range": "bytes 0-0/*"}) is None
+        assert get_size({"Content-Length": "51"}) == 51
+        assert get_size({}) is None
+
+    def test_probe_links(self, configuration):
+        with temp_dir(
+            "test_probe",
+            delete_if_exists=True,
+            delete_on_success=True,
+            delete_on_failure=False,
+        ) as folder:
+            alive = f"file://{abspath(join(folder, 'shapefile.zip'))}"
+            with open(join(folder, "shapefile.zip"), "w") as f:
+                f.write("12345")
+            dead = f"file://{abspath(join(folder, 'geodatabase.zip'))}"
+            image = f"file://{abspath(join(folder, 'image.jpg'))}"
+            entry = FeedEntry(
+                title="Water extents South Sudan",
+                published=datetime(2023, 1, 26, tzinfo=timezone.utc),
+                iso3="SSD",
+                tags=("FL",),
+                gdb_link=dead,
+                shp_link=alive,
+                pdf=alive,
+                image_link=image,
+            )
+            results = join(folder, "links.json")
+            pipeline = Pipeline(configuration, None, probe_results=results)
+            pipeline.probe_links([entry, entry])
+            # The results are saved through a temporary file that is renamed
+            assert sorted(listdir(folder)) == ["links.json", "shapefile.zip"]
+            prober = pipeline.prober
+            assert prober.get(alive)["size"] == 5
+            assert prober.get(dead)["status"] == 404
+            counts = pipeline.metrics.get_report()["counts"]
+            assert counts == {"links_probed": 3, "links_dead": 2}
+
+            dataset, showcase = pipeline.generate_dataset(entry)
+            resources = dataset.get_resources()
+            assert [resource["url"] for resource in resources] == [alive]
+            assert resources[0]["size"] == 5
+            assert showcase["url"] == alive
+            assert showcase["image_url"] is None
+
+            # Working links are not probed again, dead ones only after retry_dead
+            prober = LinkProber(results, retry_dead=3600, metrics=pipeline.metrics)
+            prober.probe([alive, dead])
+            assert pipeline.metrics.get_report()["counts"]["links_probed"] == 3
+            prober.retry_dead = 0
+            prober.probe([alive, dead])
+            assert pipeline.metrics.get_report()["counts"]["links_probed"] == 4
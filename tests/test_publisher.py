@@ -0,0 +1,301 @@
+#!/usr/bin/python
+"""
+Unit tests for publishing.
+
+"""
+
+from os import remove
+from os.path import join
+from threading import Event
+from time import monotonic, sleep
+
+import pytest
+
+from hdx.scraper.unosat.deadletter import DeadLetterQueue
+from hdx.scraper.unosat.publisher import (
+    Publisher,
+    TokenBucket,
+    get_call_budget,
+    get_fingerprint,
+)
+from hdx.utilities.loader import load_text
+from hdx.utilities.path import temp_dir
+
+
+class FakeConfiguration(dict):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.calls = []
+
+    def call_remoteckan(self, *args, **kwargs):
+        self.calls.append(args[0])
+
+
+class Entry(dict):
+    @property
+    def title(self):
+        return self["title"]
+
+    def to_dict(self):
+        return dict(self)
+
+
+class FakeDataset(dict):
+    @property
+    def data(self):
+        return self
+
+    def get_resources(self):
+        return []
+
+
+class TestPublisher:
+    def test_token_bucket(self):
+        bucket = TokenBucket(100, 1, capacity=2)
+        start = monotonic()
+        for _ in range(4):
+            bucket.acquire()
+        assert monotonic() - start >= 0.015
+
+    def test_get_call_budget(self):
+        configuration = FakeConfiguration({"publishing": {"hdx_calls": 100}})
+        assert get_call_budget(configuration) == 100
+        assert get_call_budget(configuration, True) == 100
+        configuration["backfill"] = {"budget_fraction": 0.25}
+        assert get_call_budget(configuration) == 75
+        assert get_call_budget(configuration, True) == 25
+        configuration["backfill"]["budget_fraction"] = 1
+        assert get_call_budget(configuration) == 1
+
+    def test_run(self, monkeypatch):
+        configuration = FakeConfiguration(
+            {"publishing": {"workers": 3, "hdx_calls": 1000, "period": 1}}
+        )
+        entries = [Entry(title=f"title{i}") for i in range(10)]
+        with temp_dir(
+            "test_publisher",
+            delete_if_exists=True,
+            delete_on_success=True,
+            delete_on_failure=False,
+        ) as folder:
+            info = {"folder": folder, "batch": "1234"}
+            publisher = Publisher(configuration, info, "test")
+            published = []
+
+            def publish(dataset, showcase):
+                configuration.call_remoteckan("package_create", dataset)
+                if dataset["name"] == "title6":
+                    raise ValueError("HDX error")
+                published.append(dataset["name"])
+
+            monkeypatch.setattr(publisher, "publish", publish)
+
+            def generate(entry):
+                if entry.title == "title2":
+                    return None, None
+                return FakeDataset(name=entry.title, notes=entry.get("notes")), None
+
+            with pytest.raises(ValueError):
+                publisher.run(entries, generate)
+            assert "title5" in published
+            assert "title2" not in published
+            assert configuration.calls[:2] == ["package_create", "package_create"]
+            assert load_text(join(folder, "progress.txt")) == "title=title6"
+            assert "title6" not in publisher.fingerprints
+            assert "title5" in publisher.fingerprints
+
+            published.clear()
+            monkeypatch.setattr(
+                publisher,
+                "publish",
+                lambda dataset, showcase: published.append(dataset["name"]),
+            )
+            assert publisher.run(entries, generate) == 4
+            assert published == ["title6", "title7", "title8", "title9"]
+
+            published.clear()
+            remove(join(folder, "progress.txt"))
+            entries[8]["notes"] = "changed"
+            assert publisher.run(entries, generate) == 1
+            assert published == ["title8"]
+
+    def test_progress_while_generating(self, monkeypatch):
+        configuration = FakeConfiguration(
+            {"publishing": {"workers": 2, "hdx_calls": 1000, "period": 1}}
+        )
+        entries = [Entry(title=f"title{i}") for i in range(3)]
+        with temp_dir(
+            "test_publisher",
+            delete_if_exists=True,
+            delete_on_success=True,
+            delete_on_failure=False,
+        ) as folder:
+            info = {"folder": folder, "batch": "1234"}
+            publisher = Publisher(configuration, info, "test")
+            title0_publishing = Event()
+            monkeypatch.setattr(
+                publisher,
+                "publish",
+                lambda dataset, showcase: title0_publishing.wait(5),
+            )
+            progress = []
+
+            def generate(entry):
+                progress.append(load_text(join(folder, "progress.txt")))
+                if entry.title == "title2":
+                    title0_publishing.set()
+                return FakeDataset(name=entry.title), None
+
+            assert publisher.run(entries, generate) == 3
+            # title0 is still publishing while the newer entries are generated
+            assert progress == ["title=title0"] * 3
+
+    def test_same_dataset(self, monkeypatch):
+        configuration = FakeConfiguration(
+            {"publishing": {"workers": 3, "hdx_calls": 1000, "period": 1}}
+        )
+        entries = [
+            Entry(title="title0", notes="old"),
+            Entry(title="title1"),
+            Entry(title="title0", notes="new"),
+        ]
+        with temp_dir(
+            "test_publisher",
+            delete_if_exists=True,
+            delete_on_success=True,
+            delete_on_failure=False,
+        ) as folder:
+            info = {"folder": folder, "batch": "1234"}
+            publisher = Publisher(configuration, info, "test")
+            published = []
+
+            def publish(dataset, showcase):
+                if dataset["notes"] == "old":
+                    sleep(0.2)
+                published.append((dataset["name"], dataset["notes"]))
+
+            monkeypatch.setattr(publisher, "publish", publish)
+
+            def generate(entry):
+                return FakeDataset(name=entry.title, notes=entry.get("notes")), None
+
+            assert publisher.run(entries, generate) == 3
+            # The older content of title0 does not land after the newer
+            assert published.index(("title0", "old")) < published.index(
+                ("title0", "new")
+            )
+            new_dataset, _ = generate(entries[2])
+            assert publisher.fingerprints["title0"] == get_fingerprint(
+                new_dataset, None
+            )
+
+    def test_max_fingerprints(self, monkeypatch):
+        configuration = FakeConfiguration(
+            {"publishing": {"hdx_calls": 1000, "period": 1, "max_fingerprints": 2}}
+        )
+        entries = [Entry(title=f"title{i}") for i in range(3)]
+        with temp_dir(
+            "test_publisher",
+            delete_if_exists=True,
+            delete_on_success=True,
+            delete_on_failure=False,
+        ) as folder:
+            info = {"folder": folder, "batch": "1234"}
+            fingerprints = {"title1": "old"}
+            publisher = Publisher(configuration, info, "test", fingerprints)
+            monkeypatch.setattr(publisher, "publish", lambda dataset, showcase: None)
+
+            def generate(entry):
+                return FakeDataset(name=entry.title), None
+
+            assert publisher.run(entries, generate) == 3
+            # Only the most recently published are kept
+            assert list(fingerprints) == ["title1", "title2"]
+
+    def test_pace(self):
+        configuration = FakeConfiguration(
+            {"publishing": {"workers": 2, "hdx_calls": 1000, "period": 1}}
+        )
+        entries = [Entry(title=f"title{i}") for i in range(4)]
+
+        class CountingBucket(TokenBucket):
+            acquired = 0
+
+            def acquire(self):
+                self.acquired += 1
+                super().acquire()
+
+        class CreatedDataset(FakeDataset):
+            def create_in_hdx(self, **kwargs):
+                configuration.call_remoteckan("package_create", self)
+
+        def generate(entry):
+            if entry.title == "title1":
+                return None, None
+            return CreatedDataset(name=entry.title), None
+
+        with temp_dir(
+            "test_publisher",
+            delete_if_exists=True,
+            delete_on_success=True,
+            delete_on_failure=False,
+        ) as folder:
+            info = {"folder": folder, "batch": "1234"}
+            pace = CountingBucket(1000, 1)
+            publisher = Publisher(configuration, info, "test", pace=pace)
+            assert publisher.run(entries[:3], generate) == 2
+            # Left out and unchanged entries do not take a token
+            assert publisher.run(entries, generate) == 1
+            assert pace.acquired == 3
+            assert configuration.calls == ["package_create"] * 3
+            assert "pace_wait_seconds" in publisher.metrics.get_report()["values"]
+
+    def test_run_dead_letters(self, monkeypatch):
+        configuration = FakeConfiguration(
+            {"publishing": {"workers": 2, "hdx_calls": 1000, "period": 1}}
+        )
+        configuration["publishing"]["max_failures"] = 2
+        entries = [Entry(title=f"title{i}") for i in range(10)]
+        with temp_dir(
+            "test_publisher",
+            delete_if_exists=True,
+            delete_on_success=True,
+            delete_on_failure=False,
+        ) as folder:
+            info = {"folder": folder, "batch": "1234"}
+            publisher = Publisher(configuration, info, "test")
+            failing = {"title3", "title6", "title7", "title8"}
+            published = []
+
+            def publish(dataset, showcase):
+                if dataset["name"] in failing:
+                    raise ValueError("HDX error")
+                published.append(dataset["name"])
+
+            monkeypatch.setattr(publisher, "publish", publish)
+
+            def generate(entry):
+                if entry.title == "title1":
+                    raise ValueError("Bad entry")
+                return FakeDataset(name=entry.title), None
+
+            dead_letters = DeadLetterQueue({"title0": {}})
+            with pytest.raises(ValueError):
+                publisher.run(entries, generate, dead_letters)
+            # title6 and title7 failed in a row so publishing stopped
+            assert sorted(published) == ["title0", "title2", "title4", "title5"]
+            assert publisher.last_done is entries[7]
+            assert sorted(dead_letters.letters) == [
+                "title1",
+                "title3",
+                "title6",
+                "title7",
+            ]
+            assert load_text(join(folder, "progress.txt")) == "title=title1"
+            # title3 has now failed twice so it is given up on
+            remove(join(folder, "progress.txt"))
+            dead_letters.max_attempts = 2
+            publisher.run([entries[3]], generate, dead_letters)
+            assert "title3" not in dead_letters.letters
+            counts = publisher.metrics.get_report()["counts"]
+            assert counts["datasets_abandoned"] == 1
@@ -0,0 +1,101 @@
+#!/usr/bin/python
+"""
+Unit tests for quick check.
+
+"""
+
+from os.path import abspath, join
+from pathlib import Path
+
+from benchmarks.hdx_server import create_server
+
+from hdx.scraper.unosat.__main__ import quick_check
+from hdx.scraper.unosat.quickcheck import (
+    feed_unchanged,
+    get_hdx_site,
+    read_hdx_state,
+    read_last_build_date,
+)
+from hdx.scraper.unosat.state import read_state, write_state
+from hdx.utilities.dateparse import parse_date
+from hdx.utilities.path import temp_dir
+from hdx.utilities.saver import save_text
+
+
+class TestQuickCheck:
+    feed = join("tests", "fixtures", "feed")
+
+    def test_read_last_build_date(self):
+        with open(self.feed, "rb") as f:
+            last_build_date = read_last_build_date(f)
+        assert last_build_date == parse_date("2023-01-25 16:05:21")
+
+    def test_feed_unchanged(self):
+        url = Path(abspath(self.feed)).as_uri()
+        assert feed_unchanged(url, read_state("2023-01-20"), "test") is False
+        # The state written after publishing the newest entry
+        state = read_state("2023-01-25 16:05:21")
+        assert feed_unchanged(url, state, "test") is True
+
+    def test_get_hdx_site(self, monkeypatch):
+        with temp_dir(
+            "test_quickcheck",
+            delete_if_exists=True,
+            delete_on_success=True,
+            delete_on_failure=False,
+        ) as folder:
+            hdx_config_yaml = join(folder, "hdx_configuration.yaml")
+            save_text('hdx_site: "feature"\nhdx_key: "1234"\n', hdx_config_yaml)
+            for name in ("HDX_URL", "HDX_SITE", "HDX_KEY", "HDX_KEY_PROD"):
+                monkeypatch.delenv(name, raising=False)
+            assert get_hdx_site([], {}, hdx_config_yaml) == (
+                "https://feature.data-humdata-org.ahconu.org",
+                "1234",
+            )
+            monkeypatch.setenv("HDX_SITE", "prod")
+            monkeypatch.setenv("HDX_KEY_PROD", "5678")
+            assert get_hdx_site([], {}, hdx_config_yaml) == (
+                "https://data.humdata.org",
+                "5678",
+            )
+            argv = ["--hdx-url=http://localhost/", "--hdx-key", "9012"]
+            assert get_hdx_site(argv, {}, hdx_config_yaml) == (
+                "http://localhost",
+                "9012",
+            )
+
+    def test_quick_check(self):
+        with temp_dir(
+            "test_quickcheck",
+            delete_if_exists=True,
+            delete_on_success=True,
+            delete_on_failure=False,
+        ) as folder:
+            project_config_yaml = join(folder, "project_configuration.yaml")
+            save_text(
+                f'url: "{Path(abspath(self.feed)).as_uri()}"\n'
+                'state: "pipeline-state-unosat"\n'
+                "quick_check:\n  timeout: 10\n",
+                project_config_yaml,
+            )
+            state = write_state(read_state("2023-01-25 16:05:21"))
+            server = create_server(join(folder, "state.txt"), state)
+            with server:
+                hdx = ["--hdx-url", server.url]
+                assert read_hdx_state(server.url, "pipeline-state-unosat", "test")[
+                    "last_build_date"
+                ] == parse_date("2023-01-25 16:05:21")
+                assert quick_check(project_config_yaml, hdx) is True
+                assert quick_check(project_config_yaml, hdx + ["--use-saved"]) is False
+                for argv in (
+                    ["--wat"],
+                    ["-w"],
+                    ["--backfill-from=2020-01-01"],
+                    ["--no-refresh-reference"],
+                ):
+                    assert quick_check(project_config_yaml, hdx + argv) is False
+                # The state in HDX has been moved back
+                save_text(write_state(read_state("2023-01-20")), server.ckan.state_path)
+                assert quick_check(project_config_yaml, hdx) is False
+            # HDX cannot be reached
+            assert quick_check(project_config_yaml, hdx) is False
@@ -0,0 +1,62 @@
+#!/usr/bin/python
+"""
+Unit tests for reference data.
+
+"""
+
+import json
+from os import listdir, utime
+from os.path import exists, join
+from shutil import copyfile
+from time import time
+
+from hdx.api.locations import Locations
+from hdx.data.vocabulary import Vocabulary
+from hdx.location.country import Country
+from hdx.scraper.unosat.reference import ReferenceCache
+from hdx.utilities.path import temp_dir
+
+
+class TestReference:
+    def test_reference_cache(self, configuration):
+        locations = Locations.validlocations()
+        data = {
+            "locations": locations,
+            "vocabulary": dict(Vocabulary.get_approved_vocabulary()),
+            "tags_mapping": Vocabulary.read_tags_mappings(),
+        }
+        with temp_dir(
+            "test_reference", delete_on_success=True, delete_on_failure=False
+        ) as folder:
+            reference = ReferenceCache(configuration, folder, ttl=3600)
+            for name, value in data.items():
+                with open(reference.get_path(name), "w", encoding="utf-8") as f:
+                    json.dump(value, f)
+            copyfile(Country._ochapath_default, reference.get_path("countries"))
+            assert reference.is_fresh("locations")
+
+            def fail():
+                raise OSError("HDX down")
+
+            reference._download_locations = fail
+            assert reference.load() is True
+            assert Locations.validlocations() == locations
+            assert Vocabulary.approved_tags()[0] == "geodata"
+            assert Country.get_iso3_country_code_fuzzy("South Sudan")[0] == "SSD"
+            assert reference.load() is False
+
+            # An expired file is used if downloading fails
+            path = reference.get_path("locations")
+            expired = time() - 7200
+            utime(path, (expired, expired))
+            assert not reference.is_fresh("locations")
+            assert reference.get("locations") == locations
+            new_locations = locations + [{"name": "afg", "title": "afg"}]
+            reference._download_locations = lambda: new_locations
+            assert reference.get("locations") == new_locations
+            assert reference.is_fresh("locations")
+            assert not [name for name in listdir(folder) if name.endswith(".tmp")]
+
+            reference.invalidate(["locations"])
+            assert not exists(path)
+            assert exists(join(folder, "vocabulary.json"))
@@ -0,0 +1,72 @@
+#!/usr/bin/python
+"""
+Unit tests for shards.
+
+"""
+
+from datetime import datetime, timezone
+from multiprocessing import get_context
+
+from hdx.scraper.unosat.feed import FeedEntry
+from hdx.scraper.unosat.pipeline import Pipeline
+from hdx.scraper.unosat.shard import (
+    SharedTokenBucket,
+    get_shard_outputs,
+    get_shard_path,
+)
+
+
+def take_tokens(bucket, number):
+    for _ in range(number):
+        bucket.acquire()
+
+
+class TestShard:
+    def test_shared_token_bucket(self):
+        context = get_context()
+        bucket = SharedTokenBucket(1, 1000, 3, context)
+        process = context.Process(target=take_tokens, args=(bucket, 3))
+        process.start()
+        process.join()
+        assert process.exitcode == 0
+        # The tokens taken in the other process are gone from this one
+        assert bucket.tokens < 1
+
+    def test_get_shard_outputs(self):
+        outputs = {"json": "unosat_metrics.json", "prometheus": "unosat_metrics.prom"}
+        assert get_shard_outputs(outputs, "archive") == {
+            "json": "unosat_metrics_archive.json",
+            "prometheus": "unosat_metrics_archive.prom",
+        }
+        assert get_shard_outputs(None, "archive") == {}
+
+    def test_get_shard_path(self):
+        assert get_shard_path("unosat_links.json", "archive") == (
+            "unosat_links_archive.json"
+        )
+        assert get_shard_path(None, "archive") is None
+
+    def test_claims(self, configuration):
+        entry = FeedEntry(
+            title="Water extents South Sudan",
+            published=datetime(2023, 1, 25, tzinfo=timezone.utc),
+            iso3="SSD",
+            tags=("FL",),
+            shp_link="https://unosat.org/static/unosat_filesystem/3479/shapefile.zip",
+        )
+        claims = {}
+        pipelines = []
+        for shard in ("latest", "archive"):
+            pipeline = Pipeline(configuration, None)
+            pipeline.claims = claims
+            pipeline.shard = shard
+            pipelines.append(pipeline)
+        dataset, _ = pipelines[0].generate_dataset(entry)
+        assert dataset["name"] == "water-extents-south-sudan"
+        assert pipelines[1].generate_dataset(entry) == (None, None)
+        assert claims == {"water-extents-south-sudan": "latest"}
+        counts = pipelines[1].metrics.get_report()["counts"]
+        assert counts == {"datasets_claimed_elsewhere": 1}
+        # A feed can generate a dataset it has claimed again
+        dataset, _ = pipelines[0].generate_dataset(entry)
+        assert dataset is not None
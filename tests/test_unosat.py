@@ -4,22 +4,245 @@ Unit tests for UNOSAT.
 
 """
 
+import tracemalloc
 from datetime import datetime, timezone
-from os.path import join
+from os.path import getsize, join
+from shutil import copyfile
 
 import pytest
 
+from benchmarks.feed import generate_feed
+
+from hdx.scraper.unosat.feed import FeedEntry, hash_file
 from hdx.scraper.unosat.pipeline import Pipeline
+from hdx.scraper.unosat.runner import Runner
+from hdx.scraper.unosat.state import read_state, write_state
 from hdx.utilities.downloader import Download
 from hdx.utilities.path import temp_dir
 from hdx.utilities.retriever import Retrieve
 
+CAVEATS = (
+    "This is a preliminary assessment and has not yet been validated in the field. It"
+    " is important to consider the characteristics of the source imagery used in the "
+    "analyses when interpreting results. For damage assessments it should be noted "
+    "that only significant damage to the structural integrity of the buildings "
+    "analyzed can be seen in imagery, while minor damage such as cracks or holes may "
+    "not be visible at all. For flood extractions using radar data it is important to"
+    " note that urban areas and highly vegetated areas may mask the flood signature "
+    "and result in underestimation of flood waters. Users with specific questions or "
+    "concerns should contact unosat@unitar.org to seek clarification."
+)
+METHODOLOGY = (
+    "UNOSAT datasets and maps are produced using a variety of methods. In general, "
+    "analysts closely review satellite imagery, often comparing two or more images "
+    "together, and determine notable changes between the images. For damage "
+    "assessments, refugee or IDP assessments, and similar analyses, these changes are"
+    " then manually documented in the vector data by the analyst. For flood "
+    "extractions, landcover mapping and similar analyses, a variety of automated "
+    "remote sensing techniques are used to extract the relevant information which is "
+    "then reviewed and revised as necessary by the analyst. In all cases, resulting "
+    "data is then loaded into a standardized UNOSAT geodatabase and exported "
+    "asshapefiles for dissemination."
+)
+
 
 class TestUNOSAT:
     @pytest.fixture(scope="function")
     def fixtures(self):
         return join("tests", "fixtures")
 
+    def test_parse_feed(self, configuration, fixtures):
+        with temp_dir(
+            "test_unosat", delete_on_success=True, delete_on_failure=False
+        ) as folder:
+            with Download() as downloader:
+                retriever = Retrieve(downloader, folder, fixtures, folder, False, True)
+                pipeline = Pipeline(configuration, retriever)
+                previous_build_date = datetime(2023, 1, 20, 15, 0, tzinfo=timezone.utc)
+                last_build_date, entries = pipeline.parse_feed(previous_build_date)
+                assert last_build_date == datetime(
+                    2023, 1, 25, 16, 5, 21, tzinfo=timezone.utc
+                )
+                assert [entry.eventcode for entry in entries] == [
+                    "TC20230119VUT",
+                    "FL20220424SSD",
+                ]
+                entry = entries[0]
+                assert entry.tags == ("TC",)
+                assert entry.iso3 == "VUT"
+                assert entry.gdacs_eventid == "1000959"
+                assert entry.bbox == (169.70481, -20.285363, 169.948395, -20.074376)
+                assert entry["image_link"] == (
+                    "https://unosat.org/static/unosat_filesystem/3474/UNOSAT_"
+                    "Preliminary_Assessment_Report_TC20220119VUT_Aneityum_21Jan2022.jpg"
+                )
+                assert not hasattr(entry, "__dict__")
+                last_build_date, entries = pipeline.parse_feed(last_build_date)
+                assert last_build_date == datetime(
+                    2023, 1, 25, 16, 5, 21, tzinfo=timezone.utc
+                )
+                assert entries == []
+
+                configuration["stream_feed"] = False
+                try:
+                    _, full_entries = pipeline.parse_feed(previous_build_date)
+                finally:
+                    configuration["stream_feed"] = True
+                _, entries = pipeline.parse_feed(previous_build_date)
+                assert entries == full_entries
+
+    def test_conditional_feed(self, configuration, fixtures):
+        class Response:
+            status_code = 200
+            headers = {}
+
+        class Downloader:
+            response = Response()
+
+        class LiveRetriever:
+            # Retrieves the fixture as if it had been downloaded
+            use_saved = False
+            downloader = Downloader()
+
+            def download_file(self, url, **kwargs):
+                path = join(folder, "feed")
+                copyfile(join(fixtures, "feed"), path)
+                return path
+
+        with temp_dir(
+            "test_unosat",
+            delete_if_exists=True,
+            delete_on_success=True,
+            delete_on_failure=False,
+        ) as folder:
+            pipeline = Pipeline(configuration, LiveRetriever())
+            previous_build_date = datetime(2023, 1, 20, 15, 0, tzinfo=timezone.utc)
+            feed_hash = hash_file(join(fixtures, "feed"))
+            last_build_date, entries = pipeline.parse_feed(
+                previous_build_date, {"hash": "1234"}
+            )
+            assert pipeline.feed_unchanged is False
+            validators = pipeline.feed_validators
+            assert validators == {
+                "etag": None,
+                "last_modified": None,
+                "hash": feed_hash,
+                "build_date": "2023-01-25T16:05:21+00:00",
+            }
+            assert len(entries) == 2
+
+            last_build_date, entries = pipeline.parse_feed(last_build_date, validators)
+            assert pipeline.feed_unchanged is True
+            assert last_build_date == datetime(
+                2023, 1, 25, 16, 5, 21, tzinfo=timezone.utc
+            )
+            assert entries == []
+            assert pipeline.feed_validators == validators
+
+            # The state has been moved back so the feed is read again
+            last_build_date, entries = pipeline.parse_feed(
+                previous_build_date, validators
+            )
+            assert pipeline.feed_unchanged is False
+            assert len(entries) == 2
+
+            # Saved data is never taken to be unchanged
+            with Download() as downloader:
+                retriever = Retrieve(downloader, folder, fixtures, folder, False, True)
+                pipeline = Pipeline(configuration, retriever)
+                _, entries = pipeline.parse_feed(
+                    previous_build_date,
+                    {"hash": feed_hash, "build_date": previous_build_date.isoformat()},
+                )
+                assert pipeline.feed_unchanged is False
+                assert len(entries) == 2
+
+    def test_new_entries_memory(self, configuration):
+        with temp_dir(
+            "test_unosat", delete_on_success=True, delete_on_failure=False
+        ) as folder:
+            path = join(folder, "feed")
+            dates = generate_feed(path, 2000)
+            item_size = getsize(path) / 2000
+            with Download() as downloader:
+                retriever = Retrieve(downloader, folder, folder, folder, False, True)
+                pipeline = Pipeline(configuration, retriever)
+                runner = Runner(configuration, pipeline, None, None, None, None)
+                runner.chunk_size = 20
+                for new in (20, 200):
+                    previous_build_date = datetime(1900, 1, 1, tzinfo=timezone.utc)
+                    if new < len(dates):
+                        previous_build_date = dates[new]
+                    tracemalloc.start()
+                    _, chunks = runner.get_new_entries(previous_build_date, None)
+                    published = [previous_build_date]
+                    for chunk in chunks:
+                        assert len(chunk) <= 20
+                        published.extend(entry.published for entry in chunk)
+                    _, peak = tracemalloc.get_traced_memory()
+                    tracemalloc.stop()
+                    assert len(published) == new + 1
+                    assert published == sorted(published)
+                    # Only one chunk is held in memory however many entries
+                    # are new
+                    assert peak < 4 * 20 * item_size + 256 * 1024
+
+    def test_coalesce(self, configuration):
+        pipeline = Pipeline(configuration, None)
+        base = "https://unosat.org/static/unosat_filesystem"
+
+        def get_entry(number, title, eventcode, day, iso3="PAK"):
+            return FeedEntry(
+                title=title,
+                published=datetime(2023, 1, day, tzinfo=timezone.utc),
+                eventcode=eventcode,
+                iso3=iso3,
+                shp_link=f"{base}/{number}/shapefile.zip",
+            )
+
+        entries = [
+            get_entry(3476, "Damage Assessment Vanuatu", "None", 17),
+            get_entry(3477, "Water extents over South Sudan", "FL4SSD", 18),
+            get_entry(3477, "Water extents South Sudan", "FL3SSD", 19),
+            get_entry(3478, "Flood Evolution Pakistan - 20 January", "FL1PAK", 20),
+            get_entry(3479, "Water extents South Sudan", "FL2SSD", 26),
+            get_entry(3480, "Flood Evolution Pakistan - 27 January", "FL1PAK", 27),
+            # Generates no dataset so does not supersede the older entry
+            get_entry(3481, "Damage Assessment Vanuatu", "None", 28, None),
+        ]
+        coalesced = pipeline.coalesce(entries)
+        # Only the entry whose dataset would be overwritten is dropped. The
+        # entry sharing its resource url is kept as the url is not published.
+        assert coalesced == entries[:2] + entries[3:]
+        assert pipeline.metrics.get_report()["counts"] == {"entries_superseded": 1}
+        coalesced = pipeline.coalesce(entries, by_event=True)
+        assert coalesced == entries[:2] + entries[4:]
+
+    def test_state(self):
+        state = read_state("2023-01-25T16:05:21+00:00")
+        assert state == {
+            "last_build_date": datetime(2023, 1, 25, 16, 5, 21, tzinfo=timezone.utc),
+            "feed": {},
+            "fingerprints": {},
+            "dead_letters": {},
+        }
+        state["feed"] = {"etag": '"abc"', "last_modified": None, "hash": "1234"}
+        state["fingerprints"] = {"dataset-b": "5678", "dataset-a": "9012"}
+        text = write_state(state)
+        # Fingerprints are kept in the order they were published
+        assert text == (
+            '{"dead_letters": {}, '
+            '"feed": {"etag": "\\"abc\\"", "last_modified": null, "hash": "1234"}, '
+            '"fingerprints": {"dataset-b": "5678", "dataset-a": "9012"}, '
+            '"last_build_date": "2023-01-25T16:05:21+00:00"}'
+        )
+        state = read_state(text)
+        assert list(state["fingerprints"]) == ["dataset-b", "dataset-a"]
+        assert state["last_build_date"] == datetime(
+            2023, 1, 25, 16, 5, 21, tzinfo=timezone.utc
+        )
+        assert state["feed"]["etag"] == '"abc"'
+
     def test_generate_datasets_and_showcases(self, configuration, fixtures):
         with temp_dir(
             "test_unosat", delete_on_success=True, delete_on_failure=False
@@ -40,10 +263,15 @@ class TestUNOSAT:
 
                 dataset, showcase = pipeline.generate_dataset(entries[1])
                 assert dataset == {
+                    "caveats": CAVEATS,
                     "data_update_frequency": "-1",
                     "dataset_date": "[2023-01-25T00:00:00 TO 2023-01-25T00:00:00]",
                     "groups": [{"name": "ssd"}],
+                    "dataset_source": "UN Operational Satellite Applications Programme (UNOSAT)",
+                    "license_id": "cc-by-sa",
                     "maintainer": "83fa9515-3ba4-4f1d-9860-f38b20f80442",
+                    "methodology": "Other",
+                    "methodology_other": METHODOLOGY,
                     "name": "satellite-detected-water-extents-between-17-and-21-january-2023-over-south-sudan",
                     "notes": "**UNOSAT code: FL20220424SSD**  This map illustrates "
                     "cumulative satellite-detected water using VIIRS in South Sudan "
@@ -54,12 +282,14 @@ class TestUNOSAT:
                     "of about 3,000 km² since the period between 12 to 16 January 2022. "
                     "Based on Worldpop population data and the maximal flood water "
                     "extent ~795,000 people are potentially exposed or living close to "
-                    "flooded areas.\n"
+                    "flooded areas.  \n"
                     "This is a preliminary analysis and has not yet been validated in "
                     "the field. Please send ground feedback to the United Nations "
                     "Satellite Centre (UNOSAT).",
                     "owner_org": "ba5aacba-0633-4364-9528-bc76a3f6cf95",
-                    "subnational": "1",
+                    "package_creator": "unosat",
+                    "private": False,
+                    "subnational": True,
                     "tags": [
                         {
                             "name": "geodata",
@@ -117,22 +347,27 @@ class TestUNOSAT:
 
                 dataset, showcase = pipeline.generate_dataset(entries[2])
                 assert dataset == {
+                    "caveats": CAVEATS,
                     "data_update_frequency": "-1",
                     "dataset_date": "[2023-01-20T00:00:00 TO 2023-01-20T00:00:00]",
                     "groups": [{"name": "pak"}],
+                    "dataset_source": "UN Operational Satellite Applications Programme (UNOSAT)",
+                    "license_id": "cc-by-sa",
                     "maintainer": "83fa9515-3ba4-4f1d-9860-f38b20f80442",
+                    "methodology": "Other",
+                    "methodology_other": METHODOLOGY,
                     "name": "preliminary-satellite-derived-flood-evolution-assessment-islamic-republic-of-pakistan-20-j",
                     "notes": "**UNOSAT code: FL20221121PAK**  Status: Overall "
-                    "decrease of flood waters observed\n"
-                    "Further action(s): continue monitoring\n"
+                    "decrease of flood waters observed  \n"
+                    "Further action(s): continue monitoring  \n"
                     "Evolution of Cumulative Flood Waters over I.R. of Pakistan (01-07 "
-                    "January 2023 Vs 09-15 January 2023):\n"
+                    "January 2023 Vs 09-15 January 2023):  \n"
                     "Between 09 and 15 January 2023 approximately 4.5 million people "
                     "remain potentially exposed or living close to maximum floodwaters "
-                    "areas(*);\n"
+                    "areas(*);  \n"
                     "Approximately 1.3 million people are potentially exposed or living "
                     "close to minimum floodwaters areas(**) between 09 and 15 January "
-                    "2023;\n"
+                    "2023;  \n"
                     "Based on satellite observations between 01 and 07 January 2023 and "
                     "compared with observations between 09 and 15 January 2023 , the "
                     "maximum flood water extent appears to continue to retract with "
@@ -140,7 +375,9 @@ class TestUNOSAT:
                     "-200 km²  in Khyber Pakhtunkhwa and ~ -200 km²  in Gilgit "
                     "Baltistan.",
                     "owner_org": "ba5aacba-0633-4364-9528-bc76a3f6cf95",
-                    "subnational": "1",
+                    "package_creator": "unosat",
+                    "private": False,
+                    "subnational": True,
                     "tags": [
                         {
                             "name": "geodata",
@@ -195,3 +432,6 @@ class TestUNOSAT:
                     "title": "Static PDF Map",
                     "url": "https://unosat.org/static/unosat_filesystem/3471/UNOSAT_Preliminary_Assessment_Report_FL20221121PAK_Pakistan_WeeklyUpdate_20230120.pdf",
                 }
+                # Tags are only mapped once for entries with the same categories
+                # and not at all for entries that generate no dataset
+                assert list(pipeline.mapped_tags) == [("FL",)]
@@ -0,0 +1,41 @@
+#!/usr/bin/python
+"""
+Unit tests for watch.
+
+"""
+
+from hdx.scraper.unosat.watch import PollInterval, Watcher
+
+
+class TestWatch:
+    def test_poll_interval(self):
+        interval = PollInterval(10, 35, 2, 0.1, seed=1)
+        assert 9 <= interval.get_wait() <= 11
+        interval.increase()
+        assert interval.seconds == 20
+        interval.increase()
+        interval.increase()
+        assert interval.seconds == 35
+        interval.reset()
+        assert interval.seconds == 10
+
+    def test_watcher(self):
+        results = [None, 2, ValueError("HDX down"), None, 0]
+        seconds = []
+        interval = PollInterval(0.001, 0.004, 2, 0)
+
+        def poll():
+            seconds.append(interval.seconds)
+            result = results.pop(0)
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        watcher = Watcher(poll, interval, polls=5)
+        assert watcher.run() == 5
+        assert seconds == [0.001, 0.002, 0.001, 0.002, 0.004]
+        assert interval.seconds == 0.001
+
+        watcher = Watcher(poll, interval)
+        watcher.stop()
+        assert watcher.run() == 0